@@ -1,17 +1,34 @@
 import os
 import logging
 import asyncio
+import time
 import uuid
-from typing import Optional, Dict, List, Any
-from contextlib import asynccontextmanager
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from contextlib import asynccontextmanager, suppress
 from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
-from image_generator import ImageGenerator
+from comfyui_client import create_http_session
+from comfyui_pool import parse_backends
+from image_generator import GENERATION_STAGE_SECONDS, ImageGenerator
+from image_pipeline import ImageEncoder, parse_derivatives
+from job_coalescer import JobCoalescer, coalesce_key, merge_key
+from job_eta import EtaEstimator
+from job_journal import JobJournal
+from job_events import FINAL_EVENTS, JobEventBroker, format_sse
+from job_scheduler import FairSharePolicy, create_scheduler
+from job_store import Job, JobStore
+from metrics import REGISTRY
 from prompt_parser import PromptParser
-from filename_utils import get_domain_path
+from result_cache import ResultCache
+from timing_stats import TimingStats
+from tracing import NOOP_SPAN, JsonlSpanExporter, OtlpHttpSpanExporter, Span, Tracer, monotonic_to_ns, perf_to_ns, use_span
+from vram_policy import VramDecision, VramPolicy
+from filename_utils import get_derivative_path, get_domain_path
 
 # Load environment variables
 load_dotenv()
@@ -25,14 +42,53 @@ logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup logic: Start multiple workers to handle concurrency
+    # Startup logic: Share one pooled HTTP session across all ComfyUI REST calls
+    http_session = create_http_session(
+        limit=COMFYUI_HTTP_LIMIT,
+        limit_per_host=COMFYUI_HTTP_LIMIT_PER_HOST,
+        keepalive_timeout=COMFYUI_HTTP_KEEPALIVE,
+        total_timeout=COMFYUI_HTTP_TIMEOUT,
+        connect_timeout=COMFYUI_HTTP_CONNECT_TIMEOUT
+    )
+    generator.http_session = http_session
+    health_task = asyncio.create_task(generator.pool.run_health_checks())
+    config_task = asyncio.create_task(generator.config_store.watch(CONFIG_POLL_INTERVAL)) if CONFIG_POLL_INTERVAL > 0 else None
+
+    # Replay persisted jobs before any worker starts
+    journal_task = None
+    if journal:
+        journal.open()
+        journal.purge()
+        await restore_jobs(journal)
+        journal_task = asyncio.create_task(journal.run())
+    trace_task = asyncio.create_task(tracer.run(TRACE_FLUSH_INTERVAL)) if tracer.enabled else None
+
+    # Start multiple workers to handle concurrency
     for i in range(MAX_CONCURRENT_JOBS):
         logger.info(f"Starting worker {i+1}/{MAX_CONCURRENT_JOBS}")
         asyncio.create_task(worker())
-    
-    reset_inactivity_timer()
+    vram_task = asyncio.create_task(run_vram_policy())
     yield
-    # Shutdown logic can go here if needed
+    # Shutdown logic: close the shared ComfyUI connections and HTTP session
+    health_task.cancel()
+    vram_task.cancel()
+    for task in prewarm_tasks:
+        task.cancel()
+    await asyncio.gather(*prewarm_tasks, return_exceptions=True)
+    if config_task:
+        config_task.cancel()
+    if journal_task:
+        journal_task.cancel()
+        # Let an in-flight batch write finish before the connection closes
+        with suppress(asyncio.CancelledError):
+            await journal_task
+        await journal.close()
+    if trace_task:
+        trace_task.cancel()
+        await tracer.flush()
+    await generator.close()
+    generator.http_session = None
+    await http_session.close()
 
 app = FastAPI(title="FateBot Image Generation Service", lifespan=lifespan)
 
@@ -48,88 +104,599 @@ app.add_middleware(
 # Configuration
 COMFYUI_ADDRESS = os.getenv("COMFYUI_ADDRESS", "127.0.0.1")
 COMFYUI_PORT = int(os.getenv("COMFYUI_PORT", 8188))
+# Optional comma-separated list of host:port backends; defaults to COMFYUI_ADDRESS:COMFYUI_PORT
+COMFYUI_BACKENDS = parse_backends(os.getenv("COMFYUI_BACKENDS", ""), default_port=COMFYUI_PORT)
+COMFYUI_HEALTH_INTERVAL = float(os.getenv("COMFYUI_HEALTH_INTERVAL", "30"))
+COMFYUI_RETRY_DELAY = float(os.getenv("COMFYUI_RETRY_DELAY", "60"))
+# Seconds a prompt may spend queued and executing on ComfyUI before its job fails (0 waits indefinitely)
+COMFYUI_EXECUTION_TIMEOUT = float(os.getenv("COMFYUI_EXECUTION_TIMEOUT", "1800"))
 COMFYUI_FOLDER_PATH = os.getenv("COMFYUI_FOLDER_PATH", "./output")
 WEB_DOMAIN = os.getenv("WEB_DOMAIN", "")
+# Pooled HTTP connections to ComfyUI (timeouts in seconds, limit 0 means unlimited)
+COMFYUI_HTTP_LIMIT = int(os.getenv("COMFYUI_HTTP_LIMIT", "32"))
+COMFYUI_HTTP_LIMIT_PER_HOST = int(os.getenv("COMFYUI_HTTP_LIMIT_PER_HOST", "0"))
+COMFYUI_HTTP_KEEPALIVE = float(os.getenv("COMFYUI_HTTP_KEEPALIVE", "30"))
+COMFYUI_HTTP_TIMEOUT = float(os.getenv("COMFYUI_HTTP_TIMEOUT", "60"))
+COMFYUI_HTTP_CONNECT_TIMEOUT = float(os.getenv("COMFYUI_HTTP_CONNECT_TIMEOUT", "10"))
 MODEL_CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config", "modelConfiguration.json")
+# Seconds between checks of the model configuration and workflows for changes (0 disables hot reload)
+CONFIG_POLL_INTERVAL = float(os.getenv("CONFIG_POLL_INTERVAL", "5"))
+# Output encoding: "webp", "avif" (needs Pillow with libavif) or "png" (stores ComfyUI's PNG bytes untouched)
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "webp")
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+IMAGE_METHOD = int(os.getenv("IMAGE_METHOD", "4"))
+IMAGE_LOSSLESS = os.getenv("IMAGE_LOSSLESS", "false").lower() in ("1", "true", "yes")
+IMAGE_ENCODE_WORKERS = int(os.getenv("IMAGE_ENCODE_WORKERS", "2"))
+# Width in pixels of a downscaled preview saved next to each grid (0 disables it)
+GRID_PREVIEW_WIDTH = int(os.getenv("GRID_PREVIEW_WIDTH", "0"))
+# Downscaled copies saved next to each result, as name:max_edge pairs (e.g. "thumb:256,medium:1024")
+IMAGE_DERIVATIVES = parse_derivatives(os.getenv("IMAGE_DERIVATIVES", ""))
+# Disk budget in bytes for reusing results of requests with an explicit --seed (0 disables the cache)
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", "0"))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1000"))
+# Tracing: fraction of jobs traced (0 disables it), exported to a JSONL file and/or an OTLP/HTTP collector
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "")
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", "5"))
+tracer = Tracer(
+    TRACE_SAMPLE_RATE,
+    exporters=([JsonlSpanExporter(TRACE_FILE)] if TRACE_FILE else [])
+    + ([OtlpHttpSpanExporter(TRACE_OTLP_ENDPOINT)] if TRACE_OTLP_ENDPOINT else [])
+)
+# Timing histograms behind the wait estimates weigh the last ~TIMING_HALFLIFE jobs per model the most
+TIMING_HALFLIFE = int(os.getenv("TIMING_HALFLIFE", "200"))
+# Seconds per image assumed for estimates before any job has been timed
+ETA_DEFAULT_SECONDS = float(os.getenv("ETA_DEFAULT_SECONDS", "30"))
+timing_stats = TimingStats(halflife=TIMING_HALFLIFE)
 # Generation Service
 generator = ImageGenerator(
     comfyui_address=COMFYUI_ADDRESS,
     comfyui_port=COMFYUI_PORT,
     output_dir=COMFYUI_FOLDER_PATH,
-    model_config_path=MODEL_CONFIG_PATH
+    model_config_path=MODEL_CONFIG_PATH,
+    backends=COMFYUI_BACKENDS,
+    health_interval=COMFYUI_HEALTH_INTERVAL,
+    retry_delay=COMFYUI_RETRY_DELAY,
+    encoder=ImageEncoder(IMAGE_FORMAT, quality=IMAGE_QUALITY, method=IMAGE_METHOD, lossless=IMAGE_LOSSLESS),
+    encode_workers=IMAGE_ENCODE_WORKERS,
+    derivatives=IMAGE_DERIVATIVES,
+    grid_preview_width=GRID_PREVIEW_WIDTH,
+    result_cache=ResultCache(
+        RESULT_CACHE_MAX_BYTES, RESULT_CACHE_MAX_ENTRIES, companions=list(IMAGE_DERIVATIVES) + ["preview"],
+        index_path=os.path.join(COMFYUI_FOLDER_PATH, ".result_cache.json")
+    ) if RESULT_CACHE_MAX_BYTES > 0 else None,
+    timing_stats=timing_stats,
+    execution_timeout=COMFYUI_EXECUTION_TIMEOUT or None
 )
 
-# Concurrency setting (Default to 1 for strict FIFO)
+# Concurrency setting (Default to 1 for a single job on the GPU at a time)
 MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "1"))
 
+# Scheduling policy: "affinity" groups same-model jobs to avoid checkpoint reloads, "fifo" is strict arrival order,
+# "fair" shares generation time between nicks
+JOB_SCHEDULER = os.getenv("JOB_SCHEDULER", "affinity")
+# Maximum number of later jobs allowed to overtake a queued job under the affinity scheduler
+SCHEDULER_STARVATION_LIMIT = int(os.getenv("SCHEDULER_STARVATION_LIMIT", "8"))
+# Fair scheduler: per-nick limits on queued and running jobs (0 means unlimited), and an optional JSON
+# file with weights, priority classes and per-nick overrides
+USER_MAX_QUEUED = int(os.getenv("USER_MAX_QUEUED", "0"))
+USER_MAX_RUNNING = int(os.getenv("USER_MAX_RUNNING", "0"))
+SCHEDULER_POLICY_FILE = os.getenv("SCHEDULER_POLICY_FILE", "")
+
+# Finished jobs are kept for JOB_TTL seconds, and at most JOB_MAX_FINISHED of them
+JOB_TTL = float(os.getenv("JOB_TTL", "3600"))
+JOB_MAX_FINISHED = int(os.getenv("JOB_MAX_FINISHED", "1000"))
+
+# Optional SQLite file persisting the queue and job registry across restarts (empty disables it)
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "")
+JOB_DB_FLUSH_INTERVAL = float(os.getenv("JOB_DB_FLUSH_INTERVAL", "0.2"))
+
+# Attach requests with an explicit seed to an identical queued or running job instead of running them twice
+JOB_COALESCING = os.getenv("JOB_COALESCING", "true").lower() in ("1", "true", "yes")
+# Largest combined batch size when /request/batch merges identical prompts into one ComfyUI prompt (1 disables merging)
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "16"))
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "100"))
+
+# Opt-in micro-batching: a worker waits up to MICROBATCH_WINDOW seconds (0 disables) for queued jobs on
+# the same model and runs up to MICROBATCH_MAX_JOBS of them as one ComfyUI execution
+MICROBATCH_WINDOW = float(os.getenv("MICROBATCH_WINDOW", "0"))
+MICROBATCH_MAX_JOBS = int(os.getenv("MICROBATCH_MAX_JOBS", "4"))
+
+# VRAM policy: seconds between evaluations, and how long an idle backend keeps its model (see vram_policy.py)
+VRAM_POLICY_INTERVAL = float(os.getenv("VRAM_POLICY_INTERVAL", "30"))
+VRAM_IDLE_TIMEOUT = float(os.getenv("VRAM_IDLE_TIMEOUT", "600"))
+VRAM_MIN_IDLE = float(os.getenv("VRAM_MIN_IDLE", "60"))
+VRAM_MAX_IDLE = float(os.getenv("VRAM_MAX_IDLE", "3600"))
+VRAM_KEEP_PROBABILITY = float(os.getenv("VRAM_KEEP_PROBABILITY", "0.5"))
+# Load the model of a queued job on an idle backend before the job starts
+VRAM_PREWARM = os.getenv("VRAM_PREWARM", "true").lower() in ("1", "true", "yes")
+VRAM_PREWARM_TIMEOUT = float(os.getenv("VRAM_PREWARM_TIMEOUT", "300"))
+vram_policy = VramPolicy(
+    idle_timeout=VRAM_IDLE_TIMEOUT,
+    min_idle=VRAM_MIN_IDLE,
+    max_idle=VRAM_MAX_IDLE,
+    keep_probability=VRAM_KEEP_PROBABILITY,
+    prewarm=VRAM_PREWARM
+)
+
 # Task Queue System
-class Job:
-    def __init__(self, raw_message: str, nick: str):
-        self.id = str(uuid.uuid4())
-        self.raw_message = raw_message
-        self.nick = nick
-        self.status = "queued"
-        self.result = None
-        self.error = None
-        self.event = asyncio.Event()
-
-queue = asyncio.Queue()
-jobs: Dict[str, Job] = {}
+def profile_job(job: Job) -> Optional[Dict]:
+    """
+    Resolves a job's model and image count from its message once and keeps them on the job,
+    where scheduling, estimates and the VRAM policy read them. Returns the parsed prompt, or
+    None if it could not be resolved.
+    """
+    job.images = 1
+    try:
+        filtered_prompt = PromptParser.parse_input(job.raw_message)
+        configs = generator.config_store.snapshot()
+        job.model, _ = generator.resolve_model(filtered_prompt, configs)
+        job.images = generator.resolve_count(filtered_prompt, configs)
+        return filtered_prompt
+    except Exception as e:
+        logger.debug(f"Could not resolve model for job {job.id}: {e}")
+        return None
+
+def job_model_key(job: Job) -> Optional[str]:
+    """
+    The model a job will run on, used by the scheduler to group same-model jobs.
+    """
+    if job.images is None:
+        profile_job(job)
+    return job.model
+
+def job_coalesce_key(job: Job, filtered_prompt: Optional[Dict]) -> Optional[str]:
+    """
+    Canonical parameters of a job, used to share one execution between identical requests.
+    """
+    if filtered_prompt is None or job.model is None:
+        return None
+    try:
+        return coalesce_key(filtered_prompt, job.model)
+    except Exception as e:
+        logger.debug(f"Could not compute coalescing key for job {job.id}: {e}")
+        return None
+
+def job_images(job: Job) -> int:
+    """
+    Number of images a queued or running job will produce, used to weigh it for scheduling and estimates.
+    Jobs merged into it by /request/batch are included.
+    """
+    group = coalescer.merged_group(job)
+    if group:
+        return sum(count for _, count in group)
+    if job.images is None:
+        profile_job(job)
+    return job.images
+
+def scheduler_options() -> Dict[str, Any]:
+    name = JOB_SCHEDULER.lower()
+    if name == "affinity":
+        return {"starvation_limit": SCHEDULER_STARVATION_LIMIT}
+    if name == "fair":
+        limits = {"max_queued": USER_MAX_QUEUED, "max_running": USER_MAX_RUNNING}
+        policy = FairSharePolicy.from_file(SCHEDULER_POLICY_FILE, **limits) if SCHEDULER_POLICY_FILE else FairSharePolicy(**limits)
+        return {"user_func": lambda job: job.nick, "cost_func": job_images, "policy": policy}
+    return {}
+
+queue = create_scheduler(JOB_SCHEDULER, key_func=job_model_key, **scheduler_options())
+jobs = JobStore(ttl=JOB_TTL, max_finished=JOB_MAX_FINISHED)
 active_jobs: Dict[str, Job] = {}
+# Monotonic start time, model and image count of each running job, for wait estimates
+running_profiles: Dict[str, Tuple[float, Optional[str], int]] = {}
+# Root span of each unfinished job that was sampled for tracing
+job_spans: Dict[str, Span] = {}
+eta = EtaEstimator(timing_stats, workers=MAX_CONCURRENT_JOBS, default_seconds=ETA_DEFAULT_SECONDS)
+coalescer = JobCoalescer()
+# Job ids of recent /request/batch submissions, oldest first
+batches: "OrderedDict[str, List[str]]" = OrderedDict()
+events = JobEventBroker()
+journal = JobJournal(JOB_DB_PATH, flush_interval=JOB_DB_FLUSH_INTERVAL, retention=JOB_TTL) if JOB_DB_PATH else None
+
+QUEUE_DEPTH = REGISTRY.gauge("service_queue_depth", "Jobs waiting in the queue")
+ACTIVE_JOBS = REGISTRY.gauge("service_active_jobs", "Jobs currently running")
+JOBS_BY_STATUS = REGISTRY.gauge("service_jobs", "Registered jobs by status, including finished jobs not yet expired", ["status"])
+JOBS_FINISHED = REGISTRY.counter("service_jobs_finished_total", "Jobs that finished, by outcome and model", ["status", "model"])
+# Computed when /metrics is scraped, so queueing and finishing jobs cost nothing extra
+QUEUE_DEPTH.set_function(lambda: [({}, queue.qsize())])
+ACTIVE_JOBS.set_function(lambda: [({}, len(active_jobs))])
+JOBS_BY_STATUS.set_function(lambda: [({"status": status}, count) for status, count in jobs.count_by_status().items()])
+
+def persist(job: Job, prompt_id: Optional[str] = None):
+    if journal:
+        journal.record(job, prompt_id)
+
+def register(job: Job) -> Tuple[Optional[Job], Optional[Dict]]:
+    """
+    Registers a job and returns the identical queued or running job it attached to, if any,
+    and the job's parsed prompt. A job that did not attach still has to be queued.
+    """
+    jobs[job.id] = job
+    filtered_prompt = profile_job(job)
+    primary = coalescer.attach(job, job_coalesce_key(job, filtered_prompt)) if JOB_COALESCING else None
+    if primary is not None:
+        job.status = primary.status
+    span = tracer.start_trace("job", {"job.id": job.id, "nick": job.nick}, start_ns=monotonic_to_ns(job.created_at))
+    if span.recording:
+        if primary is not None:
+            span.set_attribute("attached_to", primary.id)
+        job_spans[job.id] = span
+    persist(job)
+    return primary, filtered_prompt
+
+def finish_from_cache(job: Job, filtered_prompt: Optional[Dict]) -> bool:
+    """
+    Completes a job right away with an earlier identical result from the result cache, so a
+    repeated request does not wait behind the queue. Returns whether it did.
+    """
+    if filtered_prompt is None:
+        return False
+    try:
+        cached_path = generator.cached_result(filtered_prompt)
+    except Exception as e:
+        logger.debug(f"Could not look up cached result for job {job.id}: {e}")
+        return False
+    if not cached_path:
+        return False
+    job.finish("completed", result=result_path(cached_path))
+    logger.info(f"Job {job.id} completed from the result cache for {job.nick}")
+    events.publish(job.id, "cache_hit", {"model": job.model})
+    finish_job(job)
+    return True
+
+async def submit(job: Job) -> Optional[Job]:
+    primary, filtered_prompt = register(job)
+    if primary is None and not finish_from_cache(job, filtered_prompt):
+        await queue.put(job)
+    return primary
+
+async def submit_batch(batch: List[Job]) -> List[Optional[Job]]:
+    """
+    Registers and queues several jobs at once. Jobs for the same prompt, model and size are
+    merged into one execution up to BATCH_MAX_IMAGES images. Returns, for each job, the job
+    it attached or was merged to, if any.
+    """
+    leaders: Dict[str, List] = {}
+    to_queue, primaries = [], []
+    for job in batch:
+        primary, filtered_prompt = register(job)
+        if primary is None and finish_from_cache(job, filtered_prompt):
+            primaries.append(None)
+            continue
+        if primary is None and BATCH_MAX_IMAGES > 1:
+            key, count = None, job.images
+            if filtered_prompt is not None:
+                try:
+                    key = merge_key(filtered_prompt, job.model)
+                except Exception as e:
+                    logger.debug(f"Could not merge job {job.id}: {e}")
+            leader = leaders.get(key) if key else None
+            if leader is not None and leader[1] + count <= BATCH_MAX_IMAGES:
+                coalescer.merge(leader[0], job, leader[2], count)
+                leader[1] += count
+                primary = leader[0]
+            elif key is not None:
+                # [leader job, images in its batch so far, its own count]
+                leaders[key] = [job, count, count]
+        if primary is None:
+            to_queue.append(job)
+        primaries.append(primary)
+    await queue.put_many(to_queue)
+    return primaries
 
-# Inactivity Management
-inactivity_timer: Optional[asyncio.TimerHandle] = None
-INACTIVITY_DELAY = 10 * 60  # 10 minutes
+def publish_to_followers(job: Job, event_type: str, data: Dict):
+    for follower in coalescer.followers(job):
+        events.publish(follower.id, event_type, data)
 
-def reset_inactivity_timer():
-    global inactivity_timer
-    if inactivity_timer:
-        inactivity_timer.cancel()
-    inactivity_timer = asyncio.get_event_loop().call_later(INACTIVITY_DELAY, lambda: asyncio.create_task(unload_vram_task()))
+def result_path(image_path: str) -> str:
+    return get_domain_path(image_path, WEB_DOMAIN) if WEB_DOMAIN else image_path
 
-async def unload_vram_task():
-    if active_jobs or not queue.empty():
-        logger.info("Skipping VRAM unload: Jobs are still active or queued.")
-        reset_inactivity_timer()
+async def restore_jobs(journal: JobJournal):
+    """
+    Reloads persisted jobs: finished ones back into the registry, queued and interrupted ones back onto the queue.
+    """
+    orphaned_prompts = []
+    requeued = 0
+    for row in journal.load():
+        job = Job(row["raw_message"], row["nick"])
+        job.id = row["id"]
+        if row["status"] in ("completed", "failed"):
+            job.finish(row["status"], result=row["result"], error=row["error"])
+            # Carry the original finish time over so the TTL still applies
+            job.finished_at = time.monotonic() - max(0.0, time.time() - row["updated_at"])
+            jobs[job.id] = job
+            continue
+
+        if row["status"] == "processing" and row["prompt_id"]:
+            # Its images were streamed to the old process; run it again instead of leaving it in ComfyUI's queue
+            orphaned_prompts.append(row["prompt_id"])
+        await submit(job)
+        requeued += 1
+
+    if orphaned_prompts:
+        await generator.pool.delete_queued_prompts(orphaned_prompts)
+    logger.info(f"Restored {requeued} queued job(s) from {journal.path}")
+
+# Seconds between keep-alive comments on idle event streams
+EVENT_KEEPALIVE = 15.0
+
+def publish_queue_positions():
+    """
+    Sends updated queue positions to every queued job that has an event stream open.
+    """
+    if not events.has_subscribers():
         return
+    for index, queued in enumerate(queue.planned_order()):
+        events.publish_position(queued.id, index + 1 + len(active_jobs))
+        for follower in coalescer.followers(queued):
+            events.publish_position(follower.id, index + 1 + len(active_jobs))
+
+def lookup_job(job_id: str) -> Job:
+    """
+    Returns the job or raises 404 for unknown ids and 410 for jobs evicted from the registry.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        if jobs.is_expired(job_id):
+            raise HTTPException(status_code=410, detail="Job expired")
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+def job_state(job: Job) -> Dict[str, Any]:
+    state = {
+        "status": job.status,
+        "result": job.result,
+        "error": job.error
+    }
+    if job.status == "completed" and job.result and IMAGE_DERIVATIVES:
+        # The result already went through get_domain_path, so its derivatives share its location
+        state["derivatives"] = {name: get_derivative_path(job.result, name) for name in IMAGE_DERIVATIVES}
+    return state
+
+# VRAM Management
+def record_demand(submitted: List[Job]):
+    for job in submitted:
+        # Requests answered from the result cache need no model
+        if not job.finished:
+            vram_policy.record_request(job.model)
+
+def waiting_models() -> List[Optional[str]]:
+    """
+    Models of the queued jobs that no free worker is about to pick up, in dispatch order.
+    """
+    schedule = queue.planned_schedule()
+    free_workers = max(0, MAX_CONCURRENT_JOBS - len(active_jobs))
+    return [model_name for _, model_name in schedule[free_workers:]]
+
+# Running prewarms, referenced until they finish so they are neither collected nor left behind at shutdown
+prewarm_tasks: Set[asyncio.Task] = set()
 
-    logger.info("Inactivity detected. Unloading VRAM.")
+async def apply_vram_decision(decision: VramDecision):
+    """
+    Carries out an unload, which is skipped if a job took the backend since the decision, or a
+    prewarm, whose backend the caller reserved and which is released here.
+    """
     try:
-        await generator.unload_models()
+        if decision.action == "unload":
+            await generator.pool.unload(decision.backend)
+        elif decision.action == "prewarm":
+            try:
+                await generator.prewarm(decision.model, decision.backend, timeout=VRAM_PREWARM_TIMEOUT)
+            finally:
+                generator.pool.release(decision.backend)
     except Exception as e:
-        logger.error(f"Auto-unload failed: {e}")
+        logger.error(f"VRAM policy could not {decision.action} {decision.model} on {decision.backend.name}: {e}")
+
+async def run_vram_policy():
+    """
+    Evaluates the VRAM policy every VRAM_POLICY_INTERVAL seconds and whenever a job is queued.
+    """
+    while True:
+        await queue.wait_for_put(VRAM_POLICY_INTERVAL)
+        try:
+            decisions = vram_policy.decide(generator.pool.backends, waiting_models())
+            vram_policy.report(decisions)
+            for decision in decisions:
+                if decision.action == "unload":
+                    await apply_vram_decision(decision)
+                elif decision.action == "prewarm":
+                    # Runs alongside jobs on other backends; reserved right away so no job is sent to
+                    # the backend before the task starts, and busy until the model is loaded
+                    if not generator.pool.reserve(decision.backend):
+                        continue
+                    task = asyncio.create_task(apply_vram_decision(decision))
+                    prewarm_tasks.add(task)
+                    task.add_done_callback(prewarm_tasks.discard)
+        except Exception as e:
+            logger.error(f"VRAM policy evaluation failed: {e}")
 
 # Worker Loop
+def start_job(job: Job):
+    active_jobs[job.id] = job
+    now = time.monotonic()
+    model_name = job_model_key(job)
+    running_profiles[job.id] = (now, model_name, job_images(job))
+    timing_stats.record(model_name, "queue_wait", now - job.created_at)
+    span = job_spans.get(job.id, NOOP_SPAN)
+    if span.recording:
+        span.set_attribute("model", model_name)
+        span.record("queue_wait", span.start_ns, monotonic_to_ns(now))
+    job.status = "processing"
+    logger.info(f"Processing job {job.id} for {job.nick}")
+    events.publish(job.id, "processing", {"position": 0})
+    persist(job)
+    for follower in coalescer.followers(job):
+        follower.status = "processing"
+        persist(follower)
+    publish_to_followers(job, "processing", {"position": 0})
+
+def parse_job(job: Job) -> Dict:
+    started = time.perf_counter()
+    try:
+        filtered_prompt = PromptParser.parse_input(job.raw_message)
+    except Exception as pe:
+        raise Exception(f"[Prompt Error] Failed to parse options: {pe}")
+    model_name = running_profiles[job.id][1] if job.id in running_profiles else None
+    finished = time.perf_counter()
+    GENERATION_STAGE_SECONDS.observe(finished - started, stage="parse", model=model_name or "")
+    span = job_spans.get(job.id, NOOP_SPAN)
+    if span.recording:
+        span.record("parse", perf_to_ns(started), perf_to_ns(finished))
+    return filtered_prompt
+
+def job_event_handler(job: Job) -> Callable[[str, Dict], None]:
+    span = job_spans.get(job.id, NOOP_SPAN)
+
+    def on_event(event_type: str, data: Dict):
+        if event_type == "started":
+            persist(job, prompt_id=data.get("prompt_id"))
+            span.set_attribute("backend", data.get("backend"))
+        elif event_type in ("executing", "cached"):
+            # Node execution from the WebSocket stream; progress ticks are too many to keep
+            span.add_event(event_type, {key: str(value) for key, value in data.items()})
+        events.publish(job.id, event_type, data)
+        publish_to_followers(job, event_type, data)
+    return on_event
+
+def finish_job(job: Job, merged_results: Optional[Dict[str, Optional[str]]] = None):
+    """
+    Records a job that has just finished (job.finish was called) and settles the jobs attached to it.
+    """
+    merged_results = merged_results or {}
+    active_jobs.pop(job.id, None)
+    profile = running_profiles.pop(job.id, None)
+    model_label = (profile[1] if profile else job.model) or ""
+    JOBS_FINISHED.inc(status=job.status, model=model_label)
+    end_job_span(job)
+    jobs.mark_finished(job)
+    persist(job)
+    events.publish(job.id, job.status, job_state(job))
+    # Identical requests that attached to this job share its outcome, merged ones get their own images
+    for follower in coalescer.release(job):
+        if merged_results.get(follower.id):
+            follower.finish("completed", result=result_path(merged_results[follower.id]))
+        elif follower.id in merged_results:
+            follower.finish("failed", error="[Internal Service Error] No images were generated")
+        else:
+            follower.finish(job.status, result=job.result, error=job.error)
+        JOBS_FINISHED.inc(status=follower.status, model=model_label)
+        end_job_span(follower)
+        jobs.mark_finished(follower)
+        persist(follower)
+        events.publish(follower.id, follower.status, job_state(follower))
+
+def end_job_span(job: Job):
+    span = job_spans.pop(job.id, None)
+    if span is not None:
+        span.set_attribute("status", job.status)
+        span.set_attribute("error", job.error)
+        span.end()
+
+async def run_job(job: Job):
+    start_job(job)
+    publish_queue_positions()
+
+    merged_results: Dict[str, Optional[str]] = {}
+    try:
+        filtered_prompt = parse_job(job)
+
+        # Generate
+        on_event = job_event_handler(job)
+        group = coalescer.merged_group(job)
+        with use_span(job_spans.get(job.id, NOOP_SPAN)):
+            if group:
+                # Merged requests run as one batch; each gets its own share of the images back
+                paths = await generator.generate_batch(filtered_prompt, [count for _, count in group], on_event=on_event)
+                merged_results = {member.id: path for (member, _), path in zip(group, paths)}
+                image_path = merged_results[job.id]
+                if not image_path:
+                    raise Exception("[Internal Service Error] No images were generated")
+            else:
+                image_path = await generator.generate_image(filtered_prompt, on_event=on_event)
+        job.finish("completed", result=result_path(image_path))
+        logger.info(f"Job {job.id} completed for {job.nick}")
+    except Exception as e:
+        logger.error(f"Job {job.id} failed: {e}")
+        job.finish("failed", error=str(e))
+    finally:
+        finish_job(job, merged_results)
+
+async def run_microbatch(batch: List[Job]):
+    """
+    Runs compatible jobs as one ComfyUI execution and hands each its own images.
+    """
+    for job in batch:
+        start_job(job)
+    publish_queue_positions()
+
+    runnable, prompts = [], []
+    for job in batch:
+        try:
+            prompts.append(parse_job(job))
+            runnable.append(job)
+        except Exception as e:
+            job.finish("failed", error=str(e))
+            finish_job(job)
+
+    # Stages of the shared execution are traced on the first job; the others point to its trace
+    span = next((job_spans[job.id] for job in runnable if job.id in job_spans), NOOP_SPAN)
+    span.set_attribute("microbatch.jobs", len(runnable))
+    for job in runnable:
+        if job.id in job_spans and job_spans[job.id] is not span:
+            job_spans[job.id].set_attribute("microbatch.trace_id", span.trace_id)
+    try:
+        with use_span(span):
+            paths = await generator.generate_combined(prompts, on_events=[job_event_handler(job) for job in runnable])
+        for job, image_path in zip(runnable, paths):
+            if image_path:
+                job.finish("completed", result=result_path(image_path))
+                logger.info(f"Job {job.id} completed for {job.nick}")
+            else:
+                job.finish("failed", error="[Internal Service Error] No images were generated")
+    except Exception as e:
+        logger.error(f"Micro-batch of {len(runnable)} jobs failed: {e}")
+        for job in runnable:
+            job.finish("failed", error=str(e))
+    finally:
+        for job in runnable:
+            finish_job(job)
+
+def microbatchable(job: Job) -> bool:
+    # Requests merged by /request/batch already share one prompt
+    return coalescer.merged_group(job) is None
+
+async def collect_microbatch(job: Job) -> List[Job]:
+    """
+    Gathers queued jobs for the same model as `job`, waiting up to MICROBATCH_WINDOW seconds for more to arrive.
+    """
+    batch = [job]
+    if not microbatchable(job):
+        return batch
+    key = queue.current_key
+    if key is None:
+        return batch
+    deadline = asyncio.get_running_loop().time() + MICROBATCH_WINDOW
+    while len(batch) < MICROBATCH_MAX_JOBS:
+        batch += queue.take_matching(key, microbatchable, MICROBATCH_MAX_JOBS - len(batch))
+        remaining = deadline - asyncio.get_running_loop().time()
+        if len(batch) >= MICROBATCH_MAX_JOBS or remaining <= 0:
+            break
+        await queue.wait_for_put(remaining)
+    return batch
+
 async def worker():
     while True:
         job = await queue.get()
-        active_jobs[job.id] = job
-        job.status = "processing"
-        logger.info(f"Processing job {job.id} for {job.nick}")
-        
+        batch = await collect_microbatch(job) if MICROBATCH_WINDOW > 0 else [job]
         try:
-            # Parse prompt
-            raw_msg = job.raw_message
-            try:
-                filtered_prompt = PromptParser.parse_input(raw_msg)
-            except Exception as pe:
-                raise Exception(f"[Prompt Error] Failed to parse options: {pe}")
-            
-            # Generate
-            image_path = await generator.generate_image(filtered_prompt)
-            job.result = get_domain_path(image_path, WEB_DOMAIN) if WEB_DOMAIN else image_path
-            
-            job.status = "completed"
-            logger.info(f"Job {job.id} completed for {job.nick}")
-        except Exception as e:
-            logger.error(f"Job {job.id} failed: {e}")
-            job.error = str(e)
-            job.status = "failed"
+            if len(batch) == 1:
+                await run_job(job)
+            else:
+                await run_microbatch(batch)
         finally:
-            active_jobs.pop(job.id, None)
-            job.event.set()
-            queue.task_done()
-            reset_inactivity_timer()
+            for queued in batch:
+                queue.task_done(queued)
 
 
 
@@ -141,50 +708,227 @@ class GenerateRequest(BaseModel):
 class GenerateResponse(BaseModel):
     job_id: str
     queue_position: int
+    # Unix times the job is expected to start and finish, from recent generation times
+    estimated_start: Optional[float] = None
+    estimated_completion: Optional[float] = None
+
+class BatchRequest(BaseModel):
+    requests: List[GenerateRequest]
+
+class BatchResponse(BaseModel):
+    batch_id: str
+    jobs: List[GenerateResponse]
+
+def queue_estimates() -> Dict[str, Tuple[int, float, float]]:
+    """
+    Position and expected start and completion (Unix times) of every queued job, by job id.
+    """
+    schedule = queue.planned_schedule()
+    now = time.monotonic()
+    running = [(model_name, images, now - started) for started, model_name, images in running_profiles.values()]
+    estimates = eta.schedule(running, [(model_name, job_images(queued)) for queued, model_name in schedule])
+    wall_clock = time.time()
+    return {
+        queued.id: (index + 1, wall_clock + start, wall_clock + finish)
+        for index, ((queued, _), (start, finish)) in enumerate(zip(schedule, estimates))
+    }
+
+def running_estimate(job: Job) -> Optional[float]:
+    """
+    Expected completion (Unix time) of a running job.
+    """
+    profile = running_profiles.get(job.id)
+    if profile is None:
+        return None
+    started, model_name, images = profile
+    return time.time() + eta.remaining(model_name, images, time.monotonic() - started)
+
+def queue_positions(
+    submitted: List[Job], primaries: List[Optional[Job]]
+) -> List[Tuple[int, Optional[float], Optional[float]]]:
+    """
+    Positions and expected start and completion times reported for newly submitted jobs;
+    attached and merged jobs share their primary's.
+    """
+    planned = queue_estimates()
+    positions = []
+    for job, primary in zip(submitted, primaries):
+        target = primary or job
+        if target.status == "processing":
+            positions.append((0, None, running_estimate(target)))
+        elif target.finished:
+            positions.append((0, None, None))
+        else:
+            # Position calculation: place in the scheduled order + anything currently running
+            position, estimated_start, estimated_completion = planned.get(target.id, (queue.qsize(), None, None))
+            positions.append((position + len(active_jobs), estimated_start, estimated_completion))
+    return positions
+
+def job_estimate(job: Job) -> Dict[str, Optional[float]]:
+    """
+    Expected start and completion (Unix times) of an unfinished job, as reported by /job.
+    """
+    target = coalescer.primary_of(job) or job
+    if target.status == "processing":
+        return {"estimated_start": None, "estimated_completion": running_estimate(target)}
+    _, estimated_start, estimated_completion = queue_estimates().get(target.id, (None, None, None))
+    return {"estimated_start": estimated_start, "estimated_completion": estimated_completion}
+
+def check_admission(submitted: List[Job]):
+    if not queue.admits(submitted):
+        raise HTTPException(status_code=429, detail="Too many queued jobs for this nick")
 
 @app.post("/request", response_model=GenerateResponse)
 async def request_generation(request: GenerateRequest):
-    reset_inactivity_timer()
     job = Job(request.message, request.nick)
-    jobs[job.id] = job
-    await queue.put(job)
-    
-    # Position calculation: everything in queue + anything currently running
-    pos = queue.qsize() + len(active_jobs)
-        
-    return GenerateResponse(job_id=job.id, queue_position=pos)
+    check_admission([job])
+    primary = await submit(job)
+    record_demand([job])
+    pos, estimated_start, estimated_completion = queue_positions([job], [primary])[0]
+    publish_queue_positions()
+
+    return GenerateResponse(
+        job_id=job.id, queue_position=pos,
+        estimated_start=estimated_start, estimated_completion=estimated_completion
+    )
+
+@app.post("/request/batch", response_model=BatchResponse)
+async def request_batch(request: BatchRequest):
+    """
+    Queues several requests at once and returns a batch id to wait on or stream all their results.
+    """
+    if not request.requests:
+        raise HTTPException(status_code=422, detail="Batch is empty")
+    if len(request.requests) > BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {BATCH_MAX_REQUESTS} requests")
+    submitted = [Job(r.message, r.nick) for r in request.requests]
+    check_admission(submitted)
+    primaries = await submit_batch(submitted)
+    record_demand(submitted)
+    positions = queue_positions(submitted, primaries)
+    publish_queue_positions()
+
+    batch_id = str(uuid.uuid4())
+    batches[batch_id] = [job.id for job in submitted]
+    while len(batches) > JOB_MAX_FINISHED:
+        batches.popitem(last=False)
+    return BatchResponse(
+        batch_id=batch_id,
+        jobs=[
+            GenerateResponse(
+                job_id=job.id, queue_position=pos,
+                estimated_start=estimated_start, estimated_completion=estimated_completion
+            )
+            for job, (pos, estimated_start, estimated_completion) in zip(submitted, positions)
+        ]
+    )
+
+def lookup_batch(batch_id: str) -> List[str]:
+    job_ids = batches.get(batch_id)
+    if job_ids is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return job_ids
+
+def batch_job_state(job_id: str) -> Dict[str, Any]:
+    job = jobs.get(job_id)
+    state = job_state(job) if job is not None else {"status": "expired", "result": None, "error": None}
+    return {"job_id": job_id, **state}
+
+@app.get("/batch/{batch_id}")
+async def get_batch_status(batch_id: str):
+    return {"batch_id": batch_id, "jobs": [batch_job_state(job_id) for job_id in lookup_batch(batch_id)]}
+
+@app.get("/batch/{batch_id}/wait")
+async def wait_for_batch(batch_id: str):
+    job_ids = lookup_batch(batch_id)
+    pending = [job for job in (jobs.get(job_id) for job_id in job_ids) if job is not None and not job.finished]
+    await asyncio.gather(*(job.event.wait() for job in pending))
+    return {"batch_id": batch_id, "jobs": [batch_job_state(job_id) for job_id in job_ids]}
+
+@app.get("/batch/{batch_id}/events")
+async def stream_batch_events(batch_id: str):
+    """
+    Streams a 'result' event for each job of the batch as it finishes, then a final 'done' event.
+    """
+    job_ids = lookup_batch(batch_id)
+
+    async def event_stream():
+        waiters = {}
+        for job_id in job_ids:
+            job = jobs.get(job_id)
+            if job is None or job.finished:
+                yield format_sse("result", batch_job_state(job_id))
+            else:
+                waiters[asyncio.ensure_future(job.event.wait())] = job_id
+        try:
+            while waiters:
+                done, _ = await asyncio.wait(waiters, timeout=EVENT_KEEPALIVE, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    yield ": keep-alive\n\n"
+                for waiter in done:
+                    yield format_sse("result", batch_job_state(waiters.pop(waiter)))
+            yield format_sse("done", {"batch_id": batch_id})
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 @app.get("/job/{job_id}")
 async def get_job_status(job_id: str):
-    if job_id not in jobs:
-        raise HTTPException(status_code=404, detail="Job not found")
-    
-    job = jobs[job_id]
-    return {
-        "status": job.status,
-        "result": job.result,
-        "error": job.error
-    }
+    job = lookup_job(job_id)
+    if job.finished:
+        return job_state(job)
+    return {**job_state(job), **job_estimate(job)}
 
 @app.get("/wait/{job_id}")
 async def wait_for_job(job_id: str):
-    if job_id not in jobs:
-        raise HTTPException(status_code=404, detail="Job not found")
-    
-    job = jobs[job_id]
+    job = lookup_job(job_id)
     await job.event.wait()
-    return {
-        "status": job.status,
-        "result": job.result,
-        "error": job.error
-    }
+    return job_state(job)
+
+@app.get("/events/{job_id}")
+async def stream_job_events(job_id: str):
+    """
+    Streams a job's queue position, node execution, sampler progress and final result as Server-Sent Events.
+    """
+    job = lookup_job(job_id)
+    # Subscribe before reading the state so no event falls between the two
+    subscription = events.subscribe(job.id)
+
+    async def event_stream():
+        try:
+            if job.event.is_set():
+                yield format_sse(job.status, job_state(job))
+                return
+            position = queue.position(coalescer.primary_of(job) or job)
+            yield format_sse("queue" if position else job.status, {"position": position + len(active_jobs) if position else 0})
+            while True:
+                event = await events.next_event(subscription, EVENT_KEEPALIVE)
+                if event is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                event_type, data = event
+                yield format_sse(event_type, data)
+                if event_type in FINAL_EVENTS:
+                    return
+        finally:
+            events.unsubscribe(job.id, subscription)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 @app.get("/models")
 async def list_models():
+    # Pick up edits right away instead of waiting for the next poll
+    generator.config_store.check_for_changes()
     configs = generator._load_model_configs()
     models = [k for k in configs.keys() if k != "DEFAULTS"]
     return {"models": models}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,235 @@
+"""
+End-to-end load test: starts the fake ComfyUI server, runs the service against it with
+uvicorn in a subprocess, and drives jobs through POST /request and GET /wait at a fixed
+concurrency. Reports latency percentiles, throughput and the service's CPU time and peak
+RSS, and writes them as JSON for comparison between commits.
+
+    python benchmarks/load_test.py --jobs 200 --concurrency 16 --workers 2 --output load.json
+    python benchmarks/load_test.py --compare load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from fake_comfyui import FakeComfyUI  # noqa: E402
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q * len(ordered)) - 1))]
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def children_usage() -> Dict[str, float]:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {"cpu": usage.ru_utime + usage.ru_stime, "maxrss_kb": usage.ru_maxrss}
+
+async def start_service(args, comfyui_port: int, output_dir: str) -> asyncio.subprocess.Process:
+    env = {
+        **os.environ,
+        "COMFYUI_ADDRESS": "127.0.0.1",
+        "COMFYUI_PORT": str(comfyui_port),
+        "COMFYUI_BACKENDS": "",
+        "COMFYUI_FOLDER_PATH": output_dir,
+        "MAX_CONCURRENT_JOBS": str(args.workers),
+        "CONFIG_POLL_INTERVAL": "0",
+        "JOB_DB_PATH": "",
+        "LOG_LEVEL": args.log_level,
+    }
+    return await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(args.port),
+        "--log-level", "warning", cwd=ROOT, env=env
+    )
+
+async def wait_until_ready(session: aiohttp.ClientSession, base_url: str, process, timeout: float = 30.0) -> List[str]:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.returncode is not None:
+            raise RuntimeError(f"service exited with code {process.returncode}")
+        try:
+            async with session.get(f"{base_url}/models") as response:
+                if response.status == 200:
+                    return (await response.json())["models"]
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"service did not answer on {base_url} within {timeout:.0f} s")
+
+async def run_job(session: aiohttp.ClientSession, base_url: str, message: str) -> Dict:
+    started = time.perf_counter()
+    async with session.post(f"{base_url}/request", json={"message": message, "nick": "loadtest"}) as response:
+        if response.status != 200:
+            return {"status": f"http_{response.status}", "latency": time.perf_counter() - started}
+        job_id = (await response.json())["job_id"]
+    async with session.get(f"{base_url}/wait/{job_id}") as response:
+        state = await response.json()
+    return {"status": state["status"], "latency": time.perf_counter() - started}
+
+async def drive(session: aiohttp.ClientSession, base_url: str, messages: List[str], concurrency: int) -> List[Dict]:
+    results: List[Dict] = []
+    pending = iter(messages)
+
+    async def client():
+        for message in pending:
+            try:
+                results.append(await run_job(session, base_url, message))
+            except aiohttp.ClientError as e:
+                results.append({"status": f"client_error: {e}", "latency": None})
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return results
+
+def make_messages(args, models: List[str]) -> List[str]:
+    models = args.models.split(",") if args.models else models[:1]
+    messages = []
+    for i in range(args.jobs):
+        message = f"load test {i}, a lighthouse at dusk --model {models[i % len(models)]} --seed {i}"
+        if args.count > 1:
+            message += f" --count {args.count}"
+        messages.append(message)
+    return messages
+
+def summarize(args, results: List[Dict], elapsed: float, usage: Dict[str, float], fake: FakeComfyUI) -> Dict:
+    latencies = [r["latency"] for r in results if r["status"] == "completed"]
+    statuses: Dict[str, int] = {}
+    for r in results:
+        statuses[r["status"]] = statuses.get(r["status"], 0) + 1
+    return {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "config": {
+            "jobs": args.jobs, "concurrency": args.concurrency, "workers": args.workers, "count": args.count,
+            "models": args.models, "execution_delay": args.execution_delay,
+            "execution_overhead": args.execution_overhead, "model_load_penalty": args.model_load_penalty,
+            "image_size": args.image_size, "failure_rate": args.failure_rate,
+        },
+        "statuses": statuses,
+        "elapsed": elapsed,
+        "jobs_per_second": len(latencies) / elapsed if elapsed else None,
+        "latency": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": max(latencies) if latencies else None,
+        },
+        "service": {"cpu_seconds": usage["cpu"], "max_rss_mb": usage["maxrss_kb"] / 1024},
+        "comfyui": {"prompts": len(fake.prompts_received), "model_loads": fake.model_loads, "failures": fake.failures},
+    }
+
+def print_report(report: Dict):
+    latency = report["latency"]
+    fmt = lambda value: f"{value * 1000:8.1f} ms" if value is not None else "       -   "
+    print(f"jobs        : {report['statuses']} in {report['elapsed']:.2f} s")
+    print(f"throughput  : {report['jobs_per_second'] or 0:.2f} jobs/s")
+    print(f"latency     : p50 {fmt(latency['p50'])}  p95 {fmt(latency['p95'])}  p99 {fmt(latency['p99'])}")
+    print(f"service     : {report['service']['cpu_seconds']:.2f} s CPU, {report['service']['max_rss_mb']:.1f} MB peak RSS")
+    print(f"comfyui     : {report['comfyui']['prompts']} prompts, {report['comfyui']['model_loads']} model loads")
+
+def print_comparison(report: Dict, baseline: Dict):
+    rows = [
+        ("jobs/s", report["jobs_per_second"], baseline.get("jobs_per_second")),
+        ("p50", report["latency"]["p50"], baseline["latency"].get("p50")),
+        ("p95", report["latency"]["p95"], baseline["latency"].get("p95")),
+        ("p99", report["latency"]["p99"], baseline["latency"].get("p99")),
+        ("cpu s", report["service"]["cpu_seconds"], baseline["service"].get("cpu_seconds")),
+        ("rss MB", report["service"]["max_rss_mb"], baseline["service"].get("max_rss_mb")),
+    ]
+    print(f"compared with {baseline.get('commit') or 'baseline'}:")
+    for name, current, previous in rows:
+        if current is None or not previous:
+            continue
+        print(f"  {name:<7} {previous:10.3f} -> {current:10.3f}  ({(current - previous) / previous * 100:+6.1f}%)")
+
+async def main(args) -> Dict:
+    fake = FakeComfyUI(
+        execution_delay=args.execution_delay,
+        image_size=(args.image_size, args.image_size),
+        execution_overhead=args.execution_overhead,
+        model_load_penalty=args.model_load_penalty,
+        failure_rate=args.failure_rate,
+        seed=args.seed
+    )
+    comfyui_port = await fake.start()
+    args.port = args.port or free_port()
+    base_url = f"http://127.0.0.1:{args.port}"
+    usage_before = children_usage()
+    with tempfile.TemporaryDirectory() as output_dir:
+        process = await start_service(args, comfyui_port, output_dir)
+        try:
+            timeout = aiohttp.ClientTimeout(total=None)
+            connector = aiohttp.TCPConnector(limit=args.concurrency * 2)
+            async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+                models = await wait_until_ready(session, base_url, process)
+                messages = make_messages(args, models)
+                if args.warmup:
+                    await drive(session, base_url, messages[:args.warmup], min(args.concurrency, args.warmup))
+                started = time.perf_counter()
+                results = await drive(session, base_url, messages, args.concurrency)
+                elapsed = time.perf_counter() - started
+        finally:
+            if process.returncode is None:
+                process.send_signal(signal.SIGINT)
+                try:
+                    await asyncio.wait_for(process.wait(), 15)
+                except asyncio.TimeoutError:
+                    process.kill()
+                    await process.wait()
+            await fake.stop()
+    usage_after = children_usage()
+    usage = {"cpu": usage_after["cpu"] - usage_before["cpu"], "maxrss_kb": usage_after["maxrss_kb"]}
+    return summarize(args, results, elapsed, usage, fake)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8, help="clients submitting and waiting in parallel")
+    parser.add_argument("--workers", type=int, default=1, help="MAX_CONCURRENT_JOBS of the service")
+    parser.add_argument("--count", type=int, default=1, help="images per job")
+    parser.add_argument("--models", default="", help="comma-separated models used round-robin (default: the first configured)")
+    parser.add_argument("--warmup", type=int, default=0, help="jobs run before measuring")
+    parser.add_argument("--execution-delay", type=float, default=0.01, help="seconds per KSampler node")
+    parser.add_argument("--execution-overhead", type=float, default=0.0, help="fixed seconds per prompt")
+    parser.add_argument("--model-load-penalty", type=float, default=0.0, help="seconds to switch checkpoints")
+    parser.add_argument("--image-size", type=int, default=512)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=0, help="port for the service (default: any free port)")
+    parser.add_argument("--log-level", default="WARNING", help="LOG_LEVEL of the service")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    parser.add_argument("--compare", help="JSON report of an earlier run to compare with")
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args))
+    print_report(report)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(report, json.load(f))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
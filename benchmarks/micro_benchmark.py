@@ -0,0 +1,208 @@
+"""
+Micro-benchmarks of the per-job CPU work done by the service: prompt parsing, workflow
+materialization, applying the model configuration, WebP encoding and grid composition.
+Fixtures come from workflows/ and config/modelConfiguration.json; image cases cover
+1 to 16 images and sizes up to 2048 px.
+
+    python benchmarks/micro_benchmark.py                           # run and print
+    python benchmarks/micro_benchmark.py --save                    # store the baseline
+    python benchmarks/micro_benchmark.py --compare --threshold 0.25
+
+With --compare, the run fails (exit status 1) when any case is more than `threshold`
+slower than the stored baseline. Baselines are machine-specific: store one on the machine
+that checks for regressions.
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from PIL import Image  # noqa: E402
+
+from image_grid import GridBuilder  # noqa: E402
+from image_pipeline import ImageEncoder  # noqa: E402
+from prompt_parser import PromptParser  # noqa: E402
+from prompt_processor import PromptProcessor  # noqa: E402
+from workflow_loader import WorkflowLoader  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "micro_baseline.json")
+MODEL_CONFIG_PATH = os.path.join(ROOT, "config", "modelConfiguration.json")
+
+MESSAGES = {
+    "plain": "a lighthouse at dusk, dramatic clouds, volumetric light",
+    "flags": "a lighthouse at dusk --model AnimagineXL -w 832 -h 1216 --count 4 --seed 1234 --no blurry, lowres",
+    "long": ", ".join(f"detail {i}" for i in range(60)) + " --negative " + ", ".join(f"bad {i}" for i in range(30)) + " -c 16",
+    "quoted": 'a lighthouse at dusk --no "text, -w watermark, signature" --steps 28 --cfg 4.5 --sampler euler --ar 16:9',
+    "very_long": ", ".join(f"self-portrait detail {i}" for i in range(400))
+                 + " --no " + ", ".join(f"bad {i}" for i in range(200)) + " --seed 7 --count 16 --denoise 0.5",
+}
+
+def sample_image(size: int) -> Image.Image:
+    """
+    A deterministic test image with smooth gradients and fine noise, which compresses about
+    as well as a generated picture (pure noise would be the worst case for WebP).
+    """
+    gradient = Image.linear_gradient("L").resize((size, size))
+    noise = Image.effect_noise((size, size), 24)
+    return Image.merge("RGB", (gradient, gradient.rotate(90), Image.blend(gradient, noise, 0.5)))
+
+def load_model_configs() -> Dict:
+    with open(MODEL_CONFIG_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+def build_cases(tmp_dir: str) -> List[Tuple[str, Callable[[], None]]]:
+    cases: List[Tuple[str, Callable[[], None]]] = []
+
+    for name, message in MESSAGES.items():
+        cases.append((f"parse/{name}", lambda message=message: PromptParser.parse_input(message)))
+
+    configs = load_model_configs()
+    defaults = configs.get("DEFAULTS", {})
+    models = {name: config for name, config in configs.items() if name != "DEFAULTS"}
+    workflows = sorted({config["workflow"] for config in models.values()})
+    for workflow in workflows:
+        cases.append((f"workflow_load/{workflow}", lambda workflow=workflow: WorkflowLoader.load_workflow_by_name(workflow)))
+
+    # One model per workflow, so every node layout is covered
+    by_workflow = {}
+    for name, config in models.items():
+        by_workflow.setdefault(config["workflow"], (name, config))
+    for workflow, (model_name, model_config) in sorted(by_workflow.items()):
+        for count in (1, 4, 16):
+            filtered = {**PromptParser.parse_input(MESSAGES["flags"]), "model": model_name, "count": count}
+
+            def update(workflow=workflow, model_config=model_config, filtered=filtered):
+                template = WorkflowLoader.load_template_by_name(workflow)
+                wrapper = PromptProcessor.create_prompt_data(template.instantiate())
+                PromptProcessor.update_prompt_with_model_config(wrapper, model_config, filtered, defaults, template.bindings)
+            cases.append((f"update_prompt/{workflow}/count={count}", update))
+
+    encoder = ImageEncoder("webp")
+    for size in (512, 1024, 2048):
+        image = sample_image(size)
+        path = os.path.join(tmp_dir, f"encode_{size}.webp")
+        cases.append((f"encode_webp/{size}", lambda image=image, path=path: encoder.save(image, path)))
+
+        png = io.BytesIO()
+        image.save(png, "PNG")
+        data = png.getvalue()
+
+        def decode(data=data):
+            with Image.open(io.BytesIO(data)) as decoded:
+                decoded.load()
+        cases.append((f"decode_png/{size}", decode))
+
+    # Grids of up to 16 tiles with the composed canvas at most 2048 px wide
+    for count, tile in ((1, 1024), (4, 1024), (4, 512), (9, 512), (16, 512)):
+        image = sample_image(tile)
+        path = os.path.join(tmp_dir, f"grid_{count}_{tile}.webp")
+
+        def compose(count=count, image=image, path=path):
+            grid = GridBuilder(count)
+            try:
+                for index in range(count):
+                    grid.add(index, image)
+                grid.save(path, encoder)
+            finally:
+                grid.close()
+        cases.append((f"grid/{count}x{tile}", compose))
+    return cases
+
+def measure(func: Callable[[], None], repeats: int, min_time: float) -> Dict[str, float]:
+    """
+    Median and minimum seconds per call over `repeats` rounds, each running enough calls to
+    last at least `min_time` seconds.
+    """
+    func()  # warm caches (workflow templates, codec setup)
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            break
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)) + 1)
+
+    rounds = [elapsed / number]
+    for _ in range(repeats - 1):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        rounds.append((time.perf_counter() - started) / number)
+    return {"median": statistics.median(rounds), "min": min(rounds), "calls": number}
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:9.1f} us"
+    return f"{seconds * 1e3:9.2f} ms"
+
+def compare(
+    results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], threshold: float, min_delta: float
+) -> List[str]:
+    """
+    Prints each case against the baseline and returns the names of those slower by more than
+    `threshold` and by at least `min_delta` seconds per call. Cases are compared by their fastest
+    round, which is the least disturbed by other load on the machine.
+    """
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            print(f"{name:<40} {format_seconds(result['min'])}   (no baseline)")
+            continue
+        change = result["min"] / previous["min"] - 1
+        flag = ""
+        if change > threshold and result["min"] - previous["min"] >= min_delta:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<40} {format_seconds(previous['min'])} -> {format_seconds(result['min'])}  ({change * 100:+6.1f}%){flag}")
+    return regressions
+
+def main(args) -> int:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cases = [(name, func) for name, func in build_cases(tmp_dir) if not args.filter or args.filter in name]
+        results = {}
+        for name, func in cases:
+            results[name] = measure(func, args.repeats, args.min_time)
+            if not args.compare:
+                print(f"{name:<40} {format_seconds(results[name]['median'])}  (min {format_seconds(results[name]['min']).strip()})")
+
+    if args.save:
+        baseline = {}
+        if args.filter and os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)["cases"]
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "cases": baseline}, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+
+    if args.compare:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["cases"]
+        regressions = compare(results, baseline, args.threshold, args.min_delta)
+        if regressions:
+            print(f"{len(regressions)} case(s) more than {args.threshold * 100:.0f}% slower than the baseline: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this")
+    parser.add_argument("--repeats", type=int, default=5, help="timed rounds per case")
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum seconds per round")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline file")
+    parser.add_argument("--save", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--compare", action="store_true", help="compare with the baseline and fail on regressions")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown before a case fails, as a fraction")
+    parser.add_argument("--min-delta", type=float, default=5e-6, help="smallest slowdown in seconds per call that counts as a regression")
+    sys.exit(main(parser.parse_args()))
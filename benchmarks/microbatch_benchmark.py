@@ -0,0 +1,68 @@
+"""
+Compares running prompts one ComfyUI execution each against micro-batches that share one
+execution, using the fake ComfyUI server with a fixed per-execution overhead.
+
+    python benchmarks/microbatch_benchmark.py --jobs 16 --batch 4 --overhead 0.3 --sampling 0.05
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fake_comfyui import FakeComfyUI  # noqa: E402
+from image_generator import ImageGenerator  # noqa: E402
+
+MODEL_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "config", "modelConfiguration.json")
+
+def make_prompts(count: int):
+    return [
+        {"prompt": f"a lighthouse at dusk, variation {i}", "width": None, "height": None, "model": None,
+         "negative_prompt": None, "count": 1, "seed": -1}
+        for i in range(count)
+    ]
+
+async def run_sequential(generator: ImageGenerator, prompts) -> float:
+    started = time.perf_counter()
+    for prompt in prompts:
+        await generator.generate_image(prompt)
+    return time.perf_counter() - started
+
+async def run_microbatched(generator: ImageGenerator, prompts, batch: int) -> float:
+    started = time.perf_counter()
+    for offset in range(0, len(prompts), batch):
+        await generator.generate_combined(prompts[offset:offset + batch])
+    return time.perf_counter() - started
+
+async def main(args):
+    server = FakeComfyUI(execution_delay=args.sampling, execution_overhead=args.overhead)
+    port = await server.start()
+    prompts = make_prompts(args.jobs)
+    try:
+        with tempfile.TemporaryDirectory() as output_dir:
+            generator = ImageGenerator("127.0.0.1", port, output_dir, MODEL_CONFIG_PATH)
+            try:
+                sequential = await run_sequential(generator, prompts)
+                executions = len(server.prompts_received)
+                batched = await run_microbatched(generator, prompts, args.batch)
+                batched_executions = len(server.prompts_received) - executions
+            finally:
+                await generator.close()
+    finally:
+        await server.stop()
+
+    print(f"{args.jobs} jobs, {args.overhead * 1000:.0f} ms overhead per execution, {args.sampling * 1000:.0f} ms per sampler")
+    print(f"one execution per job : {sequential:7.3f} s  ({executions} executions, {args.jobs / sequential:6.2f} jobs/s)")
+    print(f"micro-batches of {args.batch:<4} : {batched:7.3f} s  ({batched_executions} executions, {args.jobs / batched:6.2f} jobs/s)")
+    print(f"speedup               : {sequential / batched:7.2f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=16)
+    parser.add_argument("--batch", type=int, default=4)
+    parser.add_argument("--overhead", type=float, default=0.3, help="seconds of fixed cost per ComfyUI execution")
+    parser.add_argument("--sampling", type=float, default=0.05, help="seconds per KSampler node")
+    asyncio.run(main(parser.parse_args()))
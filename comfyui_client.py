@@ -1,25 +1,57 @@
-import asyncio
-import json
 import uuid
 import logging
 import aiohttp
 import websockets
-from typing import Dict, List, Optional, Any
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Any
 
 logger = logging.getLogger(__name__)
 
+def create_http_session(
+    limit: int = 32,
+    limit_per_host: int = 0,
+    keepalive_timeout: float = 30.0,
+    total_timeout: Optional[float] = 60.0,
+    connect_timeout: Optional[float] = 10.0
+) -> aiohttp.ClientSession:
+    """
+    Creates a pooled aiohttp session with keep-alive connections, meant to be shared by every
+    ComfyUIClient for the lifetime of the service. Must be called from a running event loop.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        keepalive_timeout=keepalive_timeout,
+        ttl_dns_cache=300
+    )
+    timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
 class ComfyUIClient:
     """
     A client for interacting with the ComfyUI API and WebSocket server.
-    Handles prompt queueing, model unloading, and real-time image retrieval.
+    Handles prompt queueing, model unloading, and opening the WebSocket that
+    ComfyUIConnection reads real-time updates from.
     """
-    def __init__(self, address: str, port: int):
+    def __init__(self, address: str, port: int, session: Optional[aiohttp.ClientSession] = None):
         self.address = address
         self.port = port
+        self.session = session
         self.client_id = str(uuid.uuid4())
         self.ws = None
         logger.debug(f"Created ComfyUI client with ID: {self.client_id}")
 
+    @asynccontextmanager
+    async def _http_session(self) -> AsyncIterator[aiohttp.ClientSession]:
+        """
+        Yields the shared session when one was provided, otherwise a short-lived one.
+        """
+        if self.session is not None and not self.session.closed:
+            yield self.session
+        else:
+            async with aiohttp.ClientSession() as session:
+                yield session
+
     async def queue_prompt(self, prompt: Dict) -> Optional[str]:
         """
         Queues a prompt to the ComfyUI server for processing.
@@ -28,7 +60,7 @@ class ComfyUIClient:
         payload = {"prompt": prompt, "client_id": self.client_id}
         
         try:
-            async with aiohttp.ClientSession() as session:
+            async with self._http_session() as session:
                 async with session.post(url, json=payload) as response:
                     if response.status != 200:
                         error_text = await response.text()
@@ -42,6 +74,61 @@ class ComfyUIClient:
             logger.error(f"Error queuing prompt: {e}")
             raise Exception(f"[ComfyUI API Error] Failed to queue prompt: {e}")
 
+    async def delete_queued_prompts(self, prompt_ids: List[str]):
+        """
+        Removes prompts that have not started yet from the server's queue.
+        """
+        url = f"http://{self.address}:{self.port}/queue"
+        async with self._http_session() as session:
+            async with session.post(url, json={"delete": prompt_ids}) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    logger.error(f"ComfyUI Queue Delete Error ({response.status}): {error_text}")
+
+    async def interrupt(self, prompt_id: str):
+        """
+        Stops the prompt if it is the one the server is currently executing.
+        """
+        url = f"http://{self.address}:{self.port}/interrupt"
+        async with self._http_session() as session:
+            async with session.post(url, json={"prompt_id": prompt_id}) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    raise Exception(f"HTTP error! status: {response.status}, message: {error_text}")
+
+    async def get_queue(self) -> Dict:
+        """
+        Fetches the server's /queue: the running and pending prompts.
+        """
+        url = f"http://{self.address}:{self.port}/queue"
+        async with self._http_session() as session:
+            async with session.get(url) as response:
+                if response.status != 200:
+                    raise Exception(f"HTTP error! status: {response.status}")
+                return await response.json()
+
+    async def get_history(self, prompt_id: str) -> Dict:
+        """
+        Fetches the server's /history entry of a prompt; empty if the server does not know it.
+        """
+        url = f"http://{self.address}:{self.port}/history/{prompt_id}"
+        async with self._http_session() as session:
+            async with session.get(url) as response:
+                if response.status != 200:
+                    raise Exception(f"HTTP error! status: {response.status}")
+                return await response.json()
+
+    async def get_system_stats(self) -> Dict:
+        """
+        Fetches the server's /system_stats, used as a health check.
+        """
+        url = f"http://{self.address}:{self.port}/system_stats"
+        async with self._http_session() as session:
+            async with session.get(url) as response:
+                if response.status != 200:
+                    raise Exception(f"HTTP error! status: {response.status}")
+                return await response.json()
+
     async def connect_websocket(self):
         """
         Connects to the ComfyUI WebSocket server for real-time updates.
@@ -55,51 +142,6 @@ class ComfyUIClient:
             logger.error(f"Error connecting to ComfyUI server: {e}")
             raise Exception(f"[ComfyUI Connection Error] Could not connect to ComfyUI server at {self.address}. Is ComfyUI running? ({e})")
 
-    async def get_images_from_websocket(self, prompt_id: str) -> Dict[str, List[bytes]]:
-        """
-        Monitors the WebSocket for status updates and binary image data.
-        """
-        if not self.ws:
-            raise Exception("WebSocket not connected")
-
-        output_images = {}
-        current_node = ""
-        logger.debug(f"Waiting for images from prompt ID: {prompt_id}")
-
-        try:
-            while True:
-                message = await self.ws.recv()
-                
-                if isinstance(message, str):
-                    # JSON message
-                    data = json.loads(message)
-                    logger.debug(f"Received WebSocket message type: {data['type']}")
-
-                    if data['type'] == 'executing':
-                        executing_data = data['data']
-                        if executing_data['prompt_id'] == prompt_id:
-                            if executing_data['node'] is None:
-                                # Execution is done
-                                image_count = len(output_images.get('SaveImageWebsocket', []))
-                                logger.info(f"Execution complete. Received {image_count} image(s) for prompt {prompt_id}")
-                                return output_images
-                            else:
-                                logger.info(f"Executing node: {executing_data['node']} (prompt: {prompt_id})")
-                                current_node = executing_data['node']
-                else:
-                    # Binary data (image)
-                    if current_node == 'SaveImageWebsocket':
-                        if current_node not in output_images:
-                            output_images[current_node] = []
-                        
-                        # Remove the first 8 bytes (header) and add the image data
-                        image_data = message[8:]
-                        logger.debug(f"Received binary image data: {len(image_data)} bytes")
-                        output_images[current_node].append(image_data)
-        except Exception as e:
-            logger.error(f"Error processing WebSocket message: {e}")
-            raise Exception(f"[ComfyUI WebSocket Error] {e}")
-
     async def close(self):
         """
         Closes the active WebSocket connection.
@@ -111,6 +153,7 @@ class ComfyUIClient:
     async def unload_models(self):
         """
         Sends a request to the server's /free endpoint to unload models and free VRAM.
+        Raises if the server did not accept it.
         """
         url = f"http://{self.address}:{self.port}/free"
         payload = {
@@ -120,12 +163,13 @@ class ComfyUIClient:
         
         try:
             logger.info("Requesting ComfyUI to unload models...")
-            async with aiohttp.ClientSession() as session:
+            async with self._http_session() as session:
                 async with session.post(url, json=payload) as response:
                     if response.status != 200:
                         error_text = await response.text()
                         logger.error(f"ComfyUI Unload Models Error ({response.status}): {error_text}")
-                    else:
-                        logger.info("Successfully requested model unloading.")
+                        raise Exception(f"HTTP error! status: {response.status}, message: {error_text}")
+                    logger.info("Successfully requested model unloading.")
         except Exception as e:
             logger.error(f"Error requesting model unloading: {e}")
+            raise Exception(f"[ComfyUI API Error] Failed to unload models: {e}")
@@ -0,0 +1,298 @@
+import asyncio
+import json
+import logging
+from typing import Callable, Dict, List, Optional, Set
+
+from comfyui_client import ComfyUIClient
+
+logger = logging.getLogger(__name__)
+
+# Receives (event_type, data) for progress updates of a single prompt
+PromptListener = Callable[[str, Dict], None]
+# Receives (node, image_bytes) for every image frame of a single prompt as it arrives
+ImageListener = Callable[[str, bytes], None]
+
+class _PromptState:
+    """
+    Collects the WebSocket output of a single prompt until it finishes executing.
+    """
+    __slots__ = ("future", "images", "current_node", "started", "listener", "on_image")
+
+    def __init__(self):
+        self.future = asyncio.get_running_loop().create_future()
+        self.images: Dict[str, List[bytes]] = {}
+        self.current_node: Optional[str] = None
+        self.started = False
+        self.listener: Optional[PromptListener] = None
+        self.on_image: Optional[ImageListener] = None
+
+    def notify(self, event_type: str, data: Dict):
+        if self.listener is not None:
+            try:
+                self.listener(event_type, data)
+            except Exception as e:
+                logger.error(f"Prompt listener failed on {event_type}: {e}")
+
+    def finish(self):
+        if not self.future.done():
+            self.future.set_result(self.images)
+
+    def fail(self, error: Exception):
+        if not self.future.done():
+            self.future.set_exception(error)
+
+def queued_prompt_ids(queue: Dict, *keys: str) -> Set[str]:
+    """
+    Prompt IDs listed under the given keys of a /queue response.
+    """
+    return {
+        item[1] for key in keys for item in queue.get(key, [])
+        if isinstance(item, list) and len(item) > 1
+    }
+
+class ComfyUIConnection:
+    """
+    Maintains one long-lived, auto-reconnecting WebSocket to a ComfyUI backend and
+    routes `executing`/`executed`/binary messages to per-prompt futures.
+    All prompts are queued with the same client ID so their updates arrive on this socket.
+    """
+    def __init__(self, client: ComfyUIClient, reconnect_delay: float = 1.0, max_reconnect_delay: float = 30.0):
+        self.client = client
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self._prompts: Dict[str, _PromptState] = {}
+        # Prompts nobody waits for any more, e.g. after a timeout or an error; their remaining
+        # messages are dropped until the `executing` message that ends every prompt
+        self._abandoned: Set[str] = set()
+        self._running_prompt: Optional[str] = None
+        self._reader: Optional[asyncio.Task] = None
+        self._reconciler: Optional[asyncio.Task] = None
+        self._start_lock = asyncio.Lock()
+        self._closed = False
+
+    @property
+    def connected(self) -> bool:
+        return self.client.ws is not None and self._reader is not None and not self._reader.done()
+
+    async def start(self):
+        """
+        Opens the WebSocket and starts the background reader if it is not already running.
+        """
+        async with self._start_lock:
+            if self._reader is not None and not self._reader.done():
+                return
+            self._closed = False
+            await self.client.connect_websocket()
+            self._reader = asyncio.create_task(self._read_loop())
+
+    async def wait_for_images(
+        self,
+        prompt_id: str,
+        timeout: Optional[float] = None,
+        listener: Optional[PromptListener] = None,
+        on_image: Optional[ImageListener] = None
+    ) -> Dict[str, List[bytes]]:
+        """
+        Waits until the prompt finishes and returns the binary images received per node.
+        `listener` is called with the prompt's executing, cached and progress updates.
+        With `on_image`, image frames are handed over as they arrive instead of being collected.
+        A prompt that times out is removed from the server's queue or interrupted before this raises.
+        """
+        state = self._get_state(prompt_id)
+        state.listener = listener
+        if on_image is not None:
+            # Hand over frames that arrived before anyone was waiting, keeping their order
+            for node, images in list(state.images.items()):
+                for image_data in state.images.pop(node):
+                    on_image(node, image_data)
+            state.on_image = on_image
+        logger.debug(f"Waiting for images from prompt ID: {prompt_id}")
+        timed_out = False
+        try:
+            return await asyncio.wait_for(state.future, timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            raise Exception(f"[ComfyUI Timeout Error] Prompt {prompt_id} did not finish within {timeout}s")
+        finally:
+            self._prompts.pop(prompt_id, None)
+            # A timeout or cancelled caller cancels the future; the prompt itself may still run
+            if state.future.cancelled() or not state.future.done():
+                self._abandoned.add(prompt_id)
+            if timed_out:
+                await self.cancel(prompt_id)
+
+    async def cancel(self, prompt_id: str):
+        """
+        Drops the prompt from the server's queue, or interrupts it if it is already executing,
+        so the backend is free again. Failures are logged, not raised.
+        """
+        try:
+            await self.client.delete_queued_prompts([prompt_id])
+            # Checked after deleting, so a prompt that started meanwhile is still caught
+            if prompt_id in queued_prompt_ids(await self.client.get_queue(), 'queue_running'):
+                await self.client.interrupt(prompt_id)
+                logger.info(f"Interrupted prompt {prompt_id}")
+            else:
+                logger.info(f"Removed prompt {prompt_id} from the queue")
+        except Exception as e:
+            logger.warning(f"Could not cancel prompt {prompt_id}: {e}")
+
+    async def close(self):
+        """
+        Stops the reader, fails any waiting prompts and closes the WebSocket.
+        """
+        self._closed = True
+        if self._reconciler is not None:
+            self._reconciler.cancel()
+            self._reconciler = None
+        if self._reader is not None:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._reader = None
+        await self.client.close()
+        for prompt_id in list(self._prompts):
+            self._prompts.pop(prompt_id).fail(Exception("[ComfyUI WebSocket Error] Connection closed"))
+
+    async def _read_loop(self):
+        delay = self.reconnect_delay
+        while not self._closed:
+            try:
+                async for message in self.client.ws:
+                    self._dispatch(message)
+                    delay = self.reconnect_delay
+                logger.warning("ComfyUI WebSocket closed by server")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error processing WebSocket message: {e}")
+
+            self._fail_started_prompts()
+            await self.client.close()
+
+            # Reconnect with exponential backoff until the connection is closed deliberately
+            while not self._closed:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+                try:
+                    await self.client.connect_websocket()
+                    logger.info("Reconnected to ComfyUI WebSocket")
+                    # Checked alongside reading, so prompts finishing meanwhile are not mistaken for lost ones
+                    self._reconciler = asyncio.create_task(self._fail_lost_prompts())
+                    break
+                except Exception as e:
+                    logger.warning(f"WebSocket reconnect failed, retrying in {delay}s: {e}")
+
+    def _dispatch(self, message):
+        if isinstance(message, str):
+            data = json.loads(message)
+            msg_type = data.get('type')
+            msg_data = data.get('data') or {}
+            logger.debug(f"Received WebSocket message type: {msg_type}")
+            prompt_id = msg_data.get('prompt_id')
+            if not prompt_id:
+                return
+            if prompt_id in self._abandoned:
+                self._skip_abandoned(prompt_id, msg_type, msg_data)
+                return
+
+            if msg_type == 'executing':
+                state = self._get_state(prompt_id)
+                state.started = True
+                if msg_data.get('node') is None:
+                    # Execution is done
+                    image_count = sum(len(images) for images in state.images.values())
+                    logger.info(f"Execution complete. Received {image_count} image(s) for prompt {prompt_id}")
+                    if self._running_prompt == prompt_id:
+                        self._running_prompt = None
+                    state.finish()
+                else:
+                    logger.info(f"Executing node: {msg_data['node']} (prompt: {prompt_id})")
+                    state.current_node = msg_data['node']
+                    self._running_prompt = prompt_id
+                    state.notify('executing', {'node': msg_data['node']})
+            elif msg_type == 'executed':
+                logger.debug(f"Node {msg_data.get('node')} executed (prompt: {prompt_id})")
+            elif msg_type == 'progress':
+                state = self._prompts.get(prompt_id)
+                if state is not None:
+                    state.notify('progress', {'node': msg_data.get('node'), 'value': msg_data.get('value'), 'max': msg_data.get('max')})
+            elif msg_type == 'execution_cached':
+                state = self._prompts.get(prompt_id)
+                if state is not None:
+                    state.notify('cached', {'nodes': msg_data.get('nodes', [])})
+            elif msg_type in ('execution_error', 'execution_interrupted'):
+                error = msg_data.get('exception_message') or msg_type
+                logger.error(f"ComfyUI execution failed for prompt {prompt_id}: {error}")
+                if self._running_prompt == prompt_id:
+                    self._running_prompt = None
+                # Kept for a waiter that has not registered yet; the prompt's trailing messages are dropped
+                self._get_state(prompt_id).fail(Exception(f"[ComfyUI Execution Error] {error}"))
+                self._abandoned.add(prompt_id)
+        else:
+            # Binary frames carry no prompt ID; they belong to the prompt currently executing
+            state = self._prompts.get(self._running_prompt) if self._running_prompt else None
+            if state is None or state.current_node is None:
+                logger.debug("Dropping binary frame with no executing prompt")
+                return
+            # Remove the first 8 bytes (header) and keep the image data
+            image_data = message[8:]
+            logger.debug(f"Received binary image data: {len(image_data)} bytes")
+            if state.on_image is None:
+                state.images.setdefault(state.current_node, []).append(image_data)
+                return
+            try:
+                state.on_image(state.current_node, image_data)
+            except Exception as e:
+                logger.error(f"Image listener failed: {e}")
+
+    def _skip_abandoned(self, prompt_id: str, msg_type: str, msg_data: Dict):
+        if msg_type != 'executing':
+            return
+        # Track which prompt is running so its binary frames are dropped rather than misrouted
+        if msg_data.get('node') is not None:
+            self._running_prompt = prompt_id
+            return
+        if self._running_prompt == prompt_id:
+            self._running_prompt = None
+        self._abandoned.discard(prompt_id)
+        logger.debug(f"Abandoned prompt {prompt_id} ended")
+
+    def _get_state(self, prompt_id: str) -> _PromptState:
+        state = self._prompts.get(prompt_id)
+        if state is None:
+            state = self._prompts[prompt_id] = _PromptState()
+        return state
+
+    async def _fail_lost_prompts(self):
+        """
+        After a reconnect, fails the waiting prompts the server no longer has queued and whose
+        result did not arrive, e.g. because ComfyUI restarted and dropped its queue.
+        """
+        try:
+            queued = queued_prompt_ids(await self.client.get_queue(), 'queue_running', 'queue_pending')
+            # Abandoned prompts that are no longer queued will send nothing more
+            self._abandoned &= queued
+            for prompt_id, state in list(self._prompts.items()):
+                if prompt_id in queued or state.future.done():
+                    continue
+                history = await self.client.get_history(prompt_id)
+                if state.future.done():
+                    continue
+                if prompt_id in history:
+                    state.fail(Exception("[ComfyUI WebSocket Error] Prompt finished while the connection was lost"))
+                else:
+                    state.fail(Exception("[ComfyUI Connection Error] Prompt was dropped by ComfyUI; was it restarted?"))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Could not check queued prompts after reconnecting: {e}")
+
+    def _fail_started_prompts(self):
+        # Frames for prompts that were mid-execution are lost with the socket; queued prompts keep waiting
+        for prompt_id, state in list(self._prompts.items()):
+            if state.started and not state.future.done():
+                state.fail(Exception("[ComfyUI WebSocket Error] Connection lost during execution"))
+        self._running_prompt = None
@@ -0,0 +1,265 @@
+import asyncio
+import logging
+import re
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from comfyui_client import ComfyUIClient
+from comfyui_connection import ComfyUIConnection
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+COMFYUI_ERRORS = REGISTRY.counter(
+    "comfyui_errors_total", "Jobs that failed while running on ComfyUI, by model and kind of error", ["model", "kind"]
+)
+VRAM_UNLOADS = REGISTRY.counter(
+    "comfyui_vram_unloads_total", "Requests to a backend to unload its models and free VRAM", ["backend", "model"]
+)
+
+def error_kind(error: BaseException) -> str:
+    """
+    Kind of a '[ComfyUI <Kind> Error] ...' exception in lower case (e.g. 'execution'), or 'other'.
+    """
+    match = re.match(r"\[ComfyUI (\w+) Error\]", str(error))
+    return match.group(1).lower() if match else "other"
+
+def parse_backends(spec: str, default_port: int = 8188) -> List[Tuple[str, int]]:
+    """
+    Parses a comma-separated list of 'host:port' entries (port optional) into (host, port) tuples.
+    """
+    backends = []
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        host, _, port = entry.rpartition(':') if ':' in entry else (entry, '', '')
+        backends.append((host, int(port) if port else default_port))
+    return backends
+
+class ComfyUIBackend:
+    """
+    A single ComfyUI node together with the load and health state the pool dispatches on.
+    """
+    def __init__(self, address: str, port: int, session=None):
+        self.address = address
+        self.port = port
+        self.connection = ComfyUIConnection(ComfyUIClient(address, port, session=session))
+        self.in_flight = 0
+        self.latency: Optional[float] = None
+        self.loaded_model: Optional[str] = None
+        # Whether the node may hold models the pool does not know about, e.g. ones loaded before a restart
+        self.unknown_models = True
+        # When the backend last finished a job, for deciding when to unload its model
+        self.idle_since = time.monotonic()
+        self.healthy = True
+        self.retry_at = 0.0
+
+    @property
+    def name(self) -> str:
+        return f"{self.address}:{self.port}"
+
+    @property
+    def client(self) -> ComfyUIClient:
+        return self.connection.client
+
+    def record_latency(self, seconds: float, alpha: float):
+        # Exponentially weighted so the estimate follows recent jobs
+        self.latency = seconds if self.latency is None else alpha * seconds + (1 - alpha) * self.latency
+
+class ComfyUIPool:
+    """
+    Dispatches jobs across several ComfyUI backends. Prefers the node that already has the
+    job's model loaded, then the least loaded and fastest one. Nodes failing health checks
+    are evicted and probed again after `retry_delay` seconds.
+    """
+    def __init__(
+        self,
+        backends: List[Tuple[str, int]],
+        health_interval: float = 30.0,
+        retry_delay: float = 60.0,
+        cold_penalty: float = 1.0,
+        latency_alpha: float = 0.3
+    ):
+        if not backends:
+            raise ValueError("At least one ComfyUI backend is required")
+        self.backends = [ComfyUIBackend(address, port) for address, port in backends]
+        self.health_interval = health_interval
+        self.retry_delay = retry_delay
+        self.cold_penalty = cold_penalty
+        self.latency_alpha = latency_alpha
+        self.http_session = None
+
+    def set_http_session(self, session):
+        self.http_session = session
+        for backend in self.backends:
+            backend.client.session = session
+
+    def select(self, model_key: Optional[str] = None) -> ComfyUIBackend:
+        """
+        Picks the backend a job for `model_key` should run on.
+        """
+        now = time.monotonic()
+        candidates = [b for b in self.backends if b.healthy or now >= b.retry_at]
+        if not candidates:
+            raise Exception("[ComfyUI Connection Error] No healthy ComfyUI backends available")
+
+        def score(backend: ComfyUIBackend):
+            # A cold node costs roughly one extra job's worth of waiting for the checkpoint to load
+            warm = model_key is not None and backend.loaded_model == model_key
+            return (backend.in_flight + (0 if warm else self.cold_penalty), backend.latency or 0.0)
+
+        return min(candidates, key=score)
+
+    @asynccontextmanager
+    async def acquire(self, model_key: Optional[str] = None) -> AsyncIterator[ComfyUIBackend]:
+        """
+        Reserves a backend for one job and records its latency and loaded model when the job succeeds.
+        """
+        try:
+            backend = self.select(model_key)
+        except Exception as e:
+            COMFYUI_ERRORS.inc(model=model_key or "", kind=error_kind(e))
+            raise
+        backend.in_flight += 1
+        started = time.monotonic()
+        logger.info(f"Dispatching job for model {model_key} to ComfyUI backend {backend.name}")
+        try:
+            try:
+                await backend.connection.start()
+            except Exception:
+                self.mark_unhealthy(backend)
+                raise
+            yield backend
+            backend.record_latency(time.monotonic() - started, self.latency_alpha)
+            backend.loaded_model = model_key
+            self.mark_healthy(backend)
+        except Exception as e:
+            COMFYUI_ERRORS.inc(model=model_key or "", kind=error_kind(e))
+            # Tell node failures apart from bad prompts before evicting the backend
+            if backend.healthy:
+                await self.check_health(backend)
+            raise
+        finally:
+            backend.in_flight -= 1
+            backend.idle_since = time.monotonic()
+
+    def mark_healthy(self, backend: ComfyUIBackend):
+        if not backend.healthy:
+            logger.info(f"ComfyUI backend {backend.name} is healthy again")
+        backend.healthy = True
+
+    def mark_unhealthy(self, backend: ComfyUIBackend):
+        if backend.healthy:
+            logger.warning(f"Evicting ComfyUI backend {backend.name}; retrying in {self.retry_delay}s")
+        backend.healthy = False
+        backend.loaded_model = None
+        backend.unknown_models = True
+        backend.retry_at = time.monotonic() + self.retry_delay
+
+    async def check_health(self, backend: ComfyUIBackend) -> bool:
+        try:
+            await backend.client.get_system_stats()
+        except Exception as e:
+            logger.debug(f"Health check failed for {backend.name}: {e}")
+            self.mark_unhealthy(backend)
+            return False
+        self.mark_healthy(backend)
+        return True
+
+    async def check_all(self):
+        """
+        Probes every healthy backend and every evicted backend whose retry time has passed.
+        """
+        now = time.monotonic()
+        due = [b for b in self.backends if b.healthy or now >= b.retry_at]
+        await asyncio.gather(*(self.check_health(b) for b in due))
+
+    async def run_health_checks(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            try:
+                await self.check_all()
+            except Exception as e:
+                logger.error(f"Health check round failed: {e}")
+
+    async def unload_models(self):
+        """
+        Asks every healthy, idle backend to unload its models and free VRAM.
+        """
+        for backend in self.backends:
+            try:
+                await self.unload(backend)
+            except Exception as e:
+                logger.warning(f"Could not unload models on {backend.name}: {e}")
+
+    def reserve(self, backend: ComfyUIBackend) -> bool:
+        """
+        Marks a healthy, idle backend busy for VRAM housekeeping so jobs are dispatched elsewhere
+        meanwhile. Returns False, reserving nothing, if the backend is no longer idle.
+        """
+        if not backend.healthy or backend.in_flight:
+            return False
+        backend.in_flight += 1
+        return True
+
+    def release(self, backend: ComfyUIBackend):
+        backend.in_flight -= 1
+        backend.idle_since = time.monotonic()
+
+    async def unload(self, backend: ComfyUIBackend) -> bool:
+        """
+        Asks one backend to unload its models and free VRAM, unless it is busy or evicted by now.
+        Returns whether it was asked. Raises if the backend refused, in which case its models
+        are still considered loaded.
+        """
+        if not self.reserve(backend):
+            logger.debug(f"Not unloading {backend.name}; it is no longer idle")
+            return False
+        try:
+            await backend.client.unload_models()
+            VRAM_UNLOADS.inc(backend=backend.name, model=backend.loaded_model or "")
+            backend.loaded_model = None
+            backend.unknown_models = False
+        finally:
+            self.release(backend)
+        return True
+
+    async def prewarm(self, backend: ComfyUIBackend, model_key: str, workflow: Dict, timeout: Optional[float] = None):
+        """
+        Loads `model_key` on a backend ahead of the jobs that need it by running `workflow`, a
+        minimal prompt for that model, and discarding its output. The caller reserves the backend
+        with `reserve()` beforehand and releases it afterwards, so it counts as busy meanwhile.
+        """
+        started = time.monotonic()
+        logger.info(f"Prewarming model {model_key} on ComfyUI backend {backend.name}")
+        try:
+            await backend.connection.start()
+            prompt_id = await backend.client.queue_prompt(workflow)
+            if not prompt_id:
+                raise Exception("[ComfyUI API Error] Failed to queue prompt.")
+            await backend.connection.wait_for_images(prompt_id, timeout=timeout)
+            backend.loaded_model = model_key
+            logger.info(f"Model {model_key} loaded on {backend.name} in {time.monotonic() - started:.1f}s")
+        except Exception as e:
+            COMFYUI_ERRORS.inc(model=model_key, kind=error_kind(e))
+            if backend.healthy:
+                await self.check_health(backend)
+            raise
+
+    async def delete_queued_prompts(self, prompt_ids: List[str]):
+        """
+        Drops prompts from every reachable backend's queue, e.g. ones orphaned by a restart.
+        """
+        for backend in self.backends:
+            if not backend.healthy:
+                continue
+            try:
+                await backend.client.delete_queued_prompts(prompt_ids)
+            except Exception as e:
+                logger.warning(f"Could not delete queued prompts on {backend.name}: {e}")
+
+    async def close(self):
+        for backend in self.backends:
+            await backend.connection.close()
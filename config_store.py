@@ -0,0 +1,133 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+from metrics import REGISTRY
+from workflow_loader import WorkflowLoader
+
+logger = logging.getLogger(__name__)
+
+CONFIG_RELOADS = REGISTRY.counter(
+    "config_reloads_total", "Configuration reload attempts by kind and result", ["kind", "result"]
+)
+CONFIG_RELOAD_SECONDS = REGISTRY.histogram(
+    "config_reload_duration_seconds", "Time spent loading and validating configuration", ["kind"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+)
+CONFIG_LAST_RELOAD = REGISTRY.gauge(
+    "config_last_reload_timestamp_seconds", "Unix time of the last successful configuration reload", ["kind"]
+)
+
+class ModelConfigStore:
+    """
+    Holds the current model configuration and the workflows it references, reloading
+    them when their files change. A new configuration is validated before it replaces
+    the current snapshot, so callers holding a snapshot keep a consistent view.
+    """
+    def __init__(self, config_path: str):
+        self.config_path = config_path
+        self._snapshot: Optional[Dict] = None
+        self._version: Optional[Tuple[int, int]] = None
+        self._workflow_versions: Dict[str, Tuple] = {}
+
+    def snapshot(self) -> Dict:
+        """
+        Returns the current configuration, loading it on first use. Never mutate the result.
+        """
+        if self._snapshot is None:
+            self.reload()
+        return self._snapshot
+
+    def reload(self) -> Dict:
+        """
+        Reads and validates the configuration file, then swaps it in. Raises if it is invalid,
+        leaving the previous snapshot in place.
+        """
+        started = time.perf_counter()
+        version = WorkflowLoader.file_version(self.config_path)
+        try:
+            with open(self.config_path, 'r') as f:
+                configs = json.load(f)
+            self.validate(configs)
+        except Exception as e:
+            CONFIG_RELOADS.inc(kind="models", result="failure")
+            # Remember the broken version so it is not retried until the file changes again
+            self._version = version
+            logger.error(f"Rejected model configuration {self.config_path}: {e}")
+            raise
+        finally:
+            CONFIG_RELOAD_SECONDS.observe(time.perf_counter() - started, kind="models")
+
+        self._snapshot = configs
+        self._version = version
+        CONFIG_RELOADS.inc(kind="models", result="success")
+        CONFIG_LAST_RELOAD.set(time.time(), kind="models")
+        logger.info(f"Loaded model configuration with {len(configs) - ('DEFAULTS' in configs)} model(s)")
+        return configs
+
+    @staticmethod
+    def validate(configs: Dict):
+        """
+        Checks that every model names a loadable workflow and that the default model exists.
+        """
+        if not isinstance(configs, dict):
+            raise ValueError("Model configuration must be a JSON object")
+        models = {name: config for name, config in configs.items() if name != "DEFAULTS"}
+        if not models:
+            raise ValueError("Model configuration defines no models")
+        for name, config in models.items():
+            if not isinstance(config, dict) or not isinstance(config.get('workflow'), str):
+                raise ValueError(f"Model '{name}' must be an object with a 'workflow' name")
+            WorkflowLoader.load_template(WorkflowLoader.get_workflow_path(config['workflow']))
+        default_model = configs.get("DEFAULTS", {}).get("MODEL")
+        if default_model is not None and default_model not in models:
+            raise ValueError(f"Default model '{default_model}' is not defined")
+
+    def check_for_changes(self) -> bool:
+        """
+        Reloads the configuration and any referenced workflow whose file changed.
+        Returns True if anything was reloaded successfully.
+        """
+        changed = False
+        if self._snapshot is None or WorkflowLoader.file_version(self.config_path) != self._version:
+            try:
+                self.reload()
+                changed = True
+            except Exception:
+                pass
+
+        for workflow_name in {config['workflow'] for name, config in self.snapshot().items() if name != "DEFAULTS"}:
+            path = WorkflowLoader.get_workflow_path(workflow_name)
+            version = WorkflowLoader.template_version(path)
+            if path in self._workflow_versions and self._workflow_versions[path] == version:
+                continue
+            first_seen = path not in self._workflow_versions
+            self._workflow_versions[path] = version
+            if first_seen:
+                continue
+            started = time.perf_counter()
+            try:
+                WorkflowLoader.reload_template(path)
+                CONFIG_RELOADS.inc(kind="workflow", result="success")
+                CONFIG_LAST_RELOAD.set(time.time(), kind="workflow")
+                logger.info(f"Reloaded workflow {workflow_name}")
+                changed = True
+            except Exception as e:
+                CONFIG_RELOADS.inc(kind="workflow", result="failure")
+                logger.error(f"Rejected workflow {workflow_name}, keeping the previous version: {e}")
+            finally:
+                CONFIG_RELOAD_SECONDS.observe(time.perf_counter() - started, kind="workflow")
+        return changed
+
+    async def watch(self, interval: float):
+        """
+        Polls the configuration and workflow files for changes every `interval` seconds.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.check_for_changes()
+            except Exception as e:
+                logger.error(f"Configuration check failed: {e}")
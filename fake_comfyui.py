@@ -0,0 +1,328 @@
+import argparse
+import asyncio
+import io
+import json
+import logging
+import random
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+class FakeComfyUI:
+    """
+    A local stand-in for a ComfyUI server, used by tests and benchmarks.
+    Implements the subset of the API the service talks to: /prompt, /ws, /free, /history,
+    /queue, /interrupt and /system_stats. Prompts execute one at a time and stream PNG frames of
+    `image_size` for each SaveImageWebsocket node.
+    `execution_overhead` is a fixed cost per prompt (validation, model checks, sampler warmup),
+    `execution_delay` the cost of each KSampler node, and `model_load_penalty` the extra cost
+    of a prompt whose checkpoint is not the one loaded. A `failure_rate` fraction of prompts
+    fails with an execution error (drawn from a generator seeded with `seed`).
+    """
+    def __init__(
+        self,
+        execution_delay: float = 0.0,
+        image_size: Tuple[int, int] = (64, 64),
+        execution_overhead: float = 0.0,
+        model_load_penalty: float = 0.0,
+        failure_rate: float = 0.0,
+        seed: Optional[int] = None,
+        max_history: int = 10000
+    ):
+        self.execution_delay = execution_delay
+        self.execution_overhead = execution_overhead
+        self.model_load_penalty = model_load_penalty
+        self.failure_rate = failure_rate
+        self.image_size = image_size
+        self.max_history = max_history
+        self.prompts_received: List[Dict] = []
+        self.free_calls = 0
+        self.model_loads = 0
+        self.failures = 0
+        self.interrupts = 0
+        self.loaded_model: Optional[str] = None
+        self.host = "127.0.0.1"
+        self.port: Optional[int] = None
+        self.history: "OrderedDict[str, Dict]" = OrderedDict()
+        self._random = random.Random(seed)
+        self._sockets: Dict[str, web.WebSocketResponse] = {}
+        # Queued prompts as (number, prompt_id, client_id, prompt), and the one executing
+        self._pending: List[Tuple[int, str, str, Dict]] = []
+        self._running: Optional[Tuple[int, str, str, Dict]] = None
+        self._execution: Optional[asyncio.Task] = None
+        self._interrupted: Optional[str] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._fail_next = 0
+        self._executor: Optional[asyncio.Task] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._image_bytes: Optional[bytes] = None
+
+        self.app = web.Application()
+        self.app.router.add_post("/prompt", self._handle_prompt)
+        self.app.router.add_get("/ws", self._handle_ws)
+        self.app.router.add_post("/free", self._handle_free)
+        self.app.router.add_get("/history", self._handle_history)
+        self.app.router.add_get("/history/{prompt_id}", self._handle_history)
+        self.app.router.add_get("/queue", self._handle_get_queue)
+        self.app.router.add_post("/queue", self._handle_post_queue)
+        self.app.router.add_post("/interrupt", self._handle_interrupt)
+        self.app.router.add_get("/system_stats", self._handle_system_stats)
+
+    def fail_next(self, count: int = 1):
+        """
+        Makes the next `count` prompts fail with an execution error.
+        """
+        self._fail_next += count
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        """
+        Starts serving on the given port (0 picks a free one) and returns the bound port.
+        """
+        self.host = host
+        self._wakeup = asyncio.Event()
+        self._executor = asyncio.create_task(self._execute_loop())
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        logger.info(f"Fake ComfyUI listening on {host}:{self.port}")
+        return self.port
+
+    async def stop(self):
+        if self._executor is not None:
+            self._executor.cancel()
+            self._executor = None
+        for ws in list(self._sockets.values()):
+            await ws.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle_prompt(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        prompt = payload.get("prompt")
+        if not isinstance(prompt, dict) or not prompt:
+            return web.json_response({"error": "invalid prompt"}, status=400)
+
+        prompt_id = str(uuid.uuid4())
+        self.prompts_received.append(prompt)
+        number = len(self.prompts_received)
+        self._pending.append((number, prompt_id, payload.get("client_id"), prompt))
+        self._wakeup.set()
+        return web.json_response({"prompt_id": prompt_id, "number": number, "node_errors": {}})
+
+    async def _handle_ws(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        client_id = request.query.get("clientId", "")
+        self._sockets[client_id] = ws
+        await ws.send_str(json.dumps({"type": "status", "data": {"status": {"exec_info": {"queue_remaining": self.queue_remaining}}}}))
+        try:
+            async for _ in ws:
+                pass
+        finally:
+            if self._sockets.get(client_id) is ws:
+                del self._sockets[client_id]
+        return ws
+
+    async def _handle_free(self, request: web.Request) -> web.Response:
+        self.free_calls += 1
+        self.loaded_model = None
+        return web.json_response({})
+
+    async def _handle_history(self, request: web.Request) -> web.Response:
+        prompt_id = request.match_info.get("prompt_id")
+        if prompt_id is not None:
+            entry = self.history.get(prompt_id)
+            return web.json_response({prompt_id: entry} if entry else {})
+        max_items = int(request.query.get("max_items", "0"))
+        items = list(self.history.items())[-max_items:] if max_items else list(self.history.items())
+        return web.json_response(dict(items))
+
+    async def _handle_get_queue(self, request: web.Request) -> web.Response:
+        def entry(item):
+            number, prompt_id, client_id, prompt = item
+            return [number, prompt_id, prompt, {"client_id": client_id}, []]
+
+        return web.json_response({
+            "queue_running": [entry(self._running)] if self._running else [],
+            "queue_pending": [entry(item) for item in self._pending],
+        })
+
+    async def _handle_post_queue(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        if payload.get("clear"):
+            self._pending.clear()
+        if "delete" in payload:
+            deleted = set(payload["delete"])
+            self._pending = [item for item in self._pending if item[1] not in deleted]
+        return web.json_response({})
+
+    async def _handle_interrupt(self, request: web.Request) -> web.Response:
+        payload = await request.json() if request.can_read_body else {}
+        prompt_id = payload.get("prompt_id")
+        # Like ComfyUI, a prompt_id only interrupts the execution if it is that prompt's
+        if self._running and self._execution and prompt_id in (None, self._running[1]):
+            self._interrupted = self._running[1]
+            self._execution.cancel()
+        return web.json_response({})
+
+    async def _handle_system_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"system": {"os": "fake", "comfyui_version": "fake"}, "devices": []})
+
+    @property
+    def queue_remaining(self) -> int:
+        return len(self._pending) + (1 if self._running else 0)
+
+    async def _execute_loop(self):
+        while True:
+            while not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            self._running = self._pending.pop(0)
+            number, prompt_id, client_id, prompt = self._running
+            started = time.time()
+            status, error = "success", None
+            self._execution = asyncio.create_task(self._execute(prompt_id, client_id, prompt))
+            try:
+                await self._execution
+            except asyncio.CancelledError:
+                if self._interrupted != prompt_id:
+                    raise
+                self.interrupts += 1
+                status, error = "error", "Interrupted"
+                await self._send(client_id, {"type": "execution_interrupted", "data": {"prompt_id": prompt_id}})
+            except Exception as e:
+                status, error = "error", str(e)
+                logger.error(f"Fake execution of {prompt_id} failed: {e}")
+            finally:
+                self._running = None
+                self._execution = None
+                self._interrupted = None
+            self._record_history(number, prompt_id, client_id, prompt, status, error, started)
+            # Like ComfyUI's prompt worker, every prompt ends with this, including failed and interrupted ones
+            await self._send(client_id, {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
+
+    def _record_history(self, number, prompt_id, client_id, prompt, status, error, started):
+        messages = [["execution_start", {"prompt_id": prompt_id, "timestamp": int(started * 1000)}]]
+        messages.append(["execution_error" if error else "execution_success", {"prompt_id": prompt_id, "timestamp": int(time.time() * 1000)}])
+        self.history[prompt_id] = {
+            "prompt": [number, prompt_id, prompt, {"client_id": client_id}, []],
+            "outputs": {},
+            "status": {"status_str": status, "completed": error is None, "messages": messages},
+        }
+        while len(self.history) > self.max_history:
+            self.history.popitem(last=False)
+
+    async def _execute(self, prompt_id: str, client_id: str, prompt: Dict):
+        await self._send(client_id, {"type": "execution_start", "data": {"prompt_id": prompt_id}})
+        checkpoint = self._checkpoint(prompt)
+        if checkpoint != self.loaded_model:
+            self.model_loads += 1
+            await asyncio.sleep(self.model_load_penalty)
+        self.loaded_model = checkpoint
+        await asyncio.sleep(self.execution_overhead)
+
+        fail = self._fail_next > 0 or (self.failure_rate > 0 and self._random.random() < self.failure_rate)
+        if self._fail_next > 0:
+            self._fail_next -= 1
+
+        for node_id, node in prompt.items():
+            await self._send(client_id, {"type": "executing", "data": {"node": node_id, "prompt_id": prompt_id}})
+            if node.get("class_type") == "KSampler":
+                await asyncio.sleep(self.execution_delay)
+                if fail:
+                    self.failures += 1
+                    await self._send(client_id, {"type": "execution_error", "data": {
+                        "prompt_id": prompt_id, "node_id": node_id, "node_type": "KSampler",
+                        "exception_type": "RuntimeError", "exception_message": "Injected failure"
+                    }})
+                    raise RuntimeError("Injected failure")
+            elif node.get("class_type") == "SaveImageWebsocket":
+                frame = b"\x00\x00\x00\x01\x00\x00\x00\x02" + self._png()
+                for _ in range(self._batch_size(prompt, node_id)):
+                    await self._send_bytes(client_id, frame)
+
+    def _checkpoint(self, prompt: Dict) -> Optional[str]:
+        for node in prompt.values():
+            inputs = node.get("inputs", {})
+            for key in ("ckpt_name", "unet_name"):
+                if isinstance(inputs.get(key), str):
+                    return inputs[key]
+        return None
+
+    def _batch_size(self, prompt: Dict, node_id: str) -> int:
+        """
+        Batch size of the latent feeding `node_id`, found by following its input links upstream.
+        """
+        pending, seen = [node_id], set()
+        while pending:
+            current = pending.pop()
+            if current in seen or current not in prompt:
+                continue
+            seen.add(current)
+            node = prompt[current]
+            if str(node.get("class_type", "")).endswith("LatentImage"):
+                return int(node.get("inputs", {}).get("batch_size", 1))
+            pending.extend(value[0] for value in node.get("inputs", {}).values() if isinstance(value, list) and value)
+        # Unlinked graphs: fall back to the first latent node
+        for node in prompt.values():
+            if str(node.get("class_type", "")).endswith("LatentImage"):
+                return int(node.get("inputs", {}).get("batch_size", 1))
+        return 1
+
+    def _png(self) -> bytes:
+        # Every frame is a fixed-size image so large requests stay cheap to fake
+        if self._image_bytes is None:
+            buffer = io.BytesIO()
+            Image.new("RGB", self.image_size, (120, 80, 200)).save(buffer, "PNG")
+            self._image_bytes = buffer.getvalue()
+        return self._image_bytes
+
+    async def _send(self, client_id: str, message: Dict):
+        ws = self._sockets.get(client_id)
+        if ws is not None and not ws.closed:
+            await ws.send_str(json.dumps(message))
+
+    async def _send_bytes(self, client_id: str, data: bytes):
+        ws = self._sockets.get(client_id)
+        if ws is not None and not ws.closed:
+            await ws.send_bytes(data)
+
+async def _serve(args):
+    server = FakeComfyUI(
+        execution_delay=args.execution_delay,
+        image_size=(args.image_size, args.image_size),
+        execution_overhead=args.execution_overhead,
+        model_load_penalty=args.model_load_penalty,
+        failure_rate=args.failure_rate,
+        seed=args.seed
+    )
+    await server.start(args.host, args.port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake ComfyUI server for local testing and benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--execution-delay", type=float, default=0.5, help="seconds per KSampler node")
+    parser.add_argument("--execution-overhead", type=float, default=0.0, help="fixed seconds per prompt")
+    parser.add_argument("--model-load-penalty", type=float, default=0.0, help="seconds to switch checkpoints")
+    parser.add_argument("--image-size", type=int, default=512, help="edge of the square images returned")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of prompts that fail")
+    parser.add_argument("--seed", type=int, default=None)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -9,6 +9,14 @@ def get_image_filename(prompt_id: str, index: int, extension: str = "webp") -> s
     timestamp = int(time.time())
     return f"{timestamp}_{prompt_id}_{index}.{extension}"
 
+def get_derivative_path(filepath: str, name: str) -> str:
+    """
+    Path (or URL) of a named derivative saved next to an image.
+    Format: timestamp_promptId_index_name.extension
+    """
+    base, extension = os.path.splitext(filepath)
+    return f"{base}_{name}{extension}"
+
 def get_domain_path(filepath: str, domain: str = "") -> str:
     """
     Converts a local filesystem path to a URL using the provided domain.
@@ -1,128 +1,476 @@
-import os
-import logging
 import asyncio
-from typing import Dict, List, Optional
-from PIL import Image
-import io
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Tuple
 
-from comfyui_client import ComfyUIClient
+from comfyui_pool import ComfyUIPool
+from config_store import ModelConfigStore
+from image_pipeline import ImageEncoder, ImagePipeline, ImageStream
+from metrics import REGISTRY
+from prompt_parser import PromptParser
 from prompt_processor import PromptProcessor
+from result_cache import ResultCache, cache_key
+from timing_stats import TimingStats
+from tracing import current_span, perf_to_ns
+from workflow_batcher import branch_index, combine_workflows
 from workflow_loader import WorkflowLoader
-from image_grid import ImageGrid
-from filename_utils import get_image_filename
+from image_grid import GridBuilder, ImageGrid
+
+# Node whose image frames are the job's output
+OUTPUT_NODE = 'SaveImageWebsocket'
 
 logger = logging.getLogger(__name__)
 
+GENERATION_STAGE_SECONDS = REGISTRY.histogram(
+    "generation_stage_duration_seconds", "Time spent per job in each stage of a generation", ["stage", "model"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+)
+RECEIVED_BYTES = REGISTRY.histogram(
+    "generation_received_bytes", "Image bytes received from ComfyUI per job", ["model"],
+    buckets=(1 << 16, 1 << 18, 1 << 20, 1 << 22, 1 << 24, 1 << 26, 1 << 28)
+)
+
 class ImageGenerator:
     """
     Orchestrates the entire image generation process including model configuration,
     workflow loading, ComfyUI interaction, and image saving.
     """
-    def __init__(self, comfyui_address: str, comfyui_port: int, output_dir: str, model_config_path: str):
+    def __init__(
+        self,
+        comfyui_address: str,
+        comfyui_port: int,
+        output_dir: str,
+        model_config_path: str,
+        backends: Optional[List[Tuple[str, int]]] = None,
+        encoder: Optional[ImageEncoder] = None,
+        encode_workers: int = 2,
+        derivatives: Optional[Dict[str, int]] = None,
+        grid_preview_width: int = 0,
+        result_cache: Optional[ResultCache] = None,
+        timing_stats: Optional[TimingStats] = None,
+        execution_timeout: Optional[float] = None,
+        **pool_options
+    ):
         self.comfyui_address = comfyui_address
         self.comfyui_port = comfyui_port
         self.output_dir = output_dir
         self.model_config_path = model_config_path
-        self._model_configs = None
+        self.config_store = ModelConfigStore(model_config_path)
+        self.pool = ComfyUIPool(backends or [(comfyui_address, comfyui_port)], **pool_options)
+        self.pipeline = ImagePipeline(encoder, max_workers=encode_workers, derivatives=derivatives)
+        self.grid_preview_width = grid_preview_width
+        self.result_cache = result_cache
+        self.timing_stats = timing_stats
+        # Seconds a queued prompt may take to finish before its job fails (None waits indefinitely)
+        self.execution_timeout = execution_timeout
+
+    @property
+    def http_session(self):
+        return self.pool.http_session
+
+    @http_session.setter
+    def http_session(self, session):
+        # Shared aiohttp session for REST calls, set by the service lifespan
+        self.pool.set_http_session(session)
 
     def _load_model_configs(self):
-        if self._model_configs is None:
-            import json
-            with open(self.model_config_path, 'r') as f:
-                self._model_configs = json.load(f)
-        return self._model_configs
-
-    async def generate_image(self, filtered_prompt: Dict) -> str:
-        client = ComfyUIClient(self.comfyui_address, self.comfyui_port)
-        
+        # Current snapshot; the config store swaps in a new one when the file changes
+        return self.config_store.snapshot()
+
+    def resolve_model(self, filtered_prompt: Dict, configs: Optional[Dict] = None) -> Tuple[str, Dict]:
+        """
+        Resolves the requested model against the configuration, falling back to the default model.
+        Returns the model name and its configuration.
+        """
+        model_name = filtered_prompt.get('model')
+        if configs is None:
+            configs = self._load_model_configs()
+
+        # Default model if none specified
+        if not model_name or model_name not in configs or model_name == "DEFAULTS":
+            model_name = configs.get("DEFAULTS", {}).get("MODEL", [k for k in configs.keys() if k != "DEFAULTS"][0])
+
+        return model_name, configs[model_name]
+
+    def resolve_count(self, filtered_prompt: Dict, configs: Optional[Dict] = None) -> int:
+        """
+        Number of images a request produces, with the same precedence as the workflow update (user > model > global).
+        """
+        if configs is None:
+            configs = self._load_model_configs()
+        _, model_config = self.resolve_model(filtered_prompt, configs)
+        return filtered_prompt.get('count') or model_config.get('COUNT') or configs.get("DEFAULTS", {}).get('COUNT', 1)
+
+    def prepare_workflow(self, filtered_prompt: Dict) -> Tuple[str, Dict]:
+        """
+        Resolves the model and materializes its workflow for a request, returning (model_name, workflow).
+        """
+        started = time.perf_counter()
+        # Load model configuration; the job keeps this snapshot even if the config is reloaded meanwhile
+        configs = self._load_model_configs()
+        model_name, model_config = self.resolve_model(filtered_prompt, configs)
+        logger.info(f"Using model: {model_name}")
+
+        # Load workflow
+        workflow_name = model_config['workflow']
+        logger.info(f"Loading workflow: {workflow_name}")
+        template = WorkflowLoader.load_template_by_name(workflow_name)
+        workflow_data = template.instantiate()
+        if not workflow_data:
+            raise Exception(f"[Internal Service Error] Failed to load workflow: {workflow_name}")
+
+        # Create prompt data
+        prompt_wrapper = PromptProcessor.create_prompt_data(workflow_data)
+
+        # Update with model config through the workflow's bindings
+        global_defaults = configs.get("DEFAULTS", {})
+        PromptProcessor.update_prompt_with_model_config(
+            prompt_wrapper, model_config, filtered_prompt, global_defaults, template.bindings
+        )
+        finished = time.perf_counter()
+        GENERATION_STAGE_SECONDS.observe(finished - started, stage="workflow_load", model=model_name)
+        span = current_span()
+        if span.recording:
+            span.record("workflow_load", perf_to_ns(started), perf_to_ns(finished), {"model": model_name, "workflow": workflow_name})
+        return model_name, prompt_wrapper['workflow']
+
+    async def generate_image(self, filtered_prompt: Dict, on_event: Optional[Callable[[str, Dict], None]] = None) -> str:
+        """
+        Runs one generation and returns the path of the saved image (or grid).
+        `on_event` receives (event_type, data) progress updates while the job runs.
+        """
+        notify = on_event or (lambda event_type, data: None)
         try:
             logger.info("Starting image generation process")
-            
-            # Load model configuration
-            model_name = filtered_prompt.get('model')
-            configs = self._load_model_configs()
+            model_name, workflow = self.prepare_workflow(filtered_prompt)
 
-            # Default model if none specified
-            if not model_name or model_name not in configs or model_name == "DEFAULTS":
-                model_name = configs.get("DEFAULTS", {}).get("MODEL", [k for k in configs.keys() if k != "DEFAULTS"][0])
-            
-            logger.info(f"Using model: {model_name}")
-            model_config = configs[model_name]
-
-            # Load workflow
-            workflow_name = model_config['workflow']
-            logger.info(f"Loading workflow: {workflow_name}")
-            workflow_data = WorkflowLoader.load_workflow_by_name(workflow_name)
-            if not workflow_data:
-                raise Exception(f"[Internal Service Error] Failed to load workflow: {workflow_name}")
-
-            # Create prompt data
-            prompt_wrapper = PromptProcessor.create_prompt_data(workflow_data)
-            
-            # Update with model config
-            global_defaults = configs.get("DEFAULTS", {})
-            PromptProcessor.update_prompt_with_model_config(prompt_wrapper, model_config, filtered_prompt, global_defaults)
-
-            # Connect and queue
-            await client.connect_websocket()
-            prompt_id = await client.queue_prompt(prompt_wrapper['workflow'])
-            if not prompt_id:
-                raise Exception("[ComfyUI API Error] Failed to queue prompt.")
+            # Requests with an explicit seed are deterministic, so an earlier identical run can be reused
+            key = self._result_cache_key(filtered_prompt, workflow)
+            if key is not None:
+                cached_path = self.result_cache.get(key)
+                if cached_path:
+                    notify('cache_hit', {'model': model_name})
+                    return cached_path
 
-            # Get images
-            images_dict = await client.get_images_from_websocket(prompt_id)
-            image_data_list = images_dict.get('SaveImageWebsocket', [])
-            logger.info(f"Received {len(image_data_list)} image(s) from ComfyUI")
-
-            # Save individual images
-            saved_paths = await self.save_image_files(image_data_list, prompt_id)
-
-            # Generate grid
-            if len(saved_paths) > 1:
-                logger.info(f"Generating image grid from {len(saved_paths)} images")
-                grid_path = await ImageGrid.generate_image_grid(saved_paths)
-                return grid_path
-            elif len(saved_paths) == 1:
-                return saved_paths[0]
-            else:
-                raise Exception("[Internal Service Error] No images were generated")
+            saved_paths: List[str] = []
+            result_path = (await self._run_workflow(model_name, workflow, notify, on_event, saved_paths=saved_paths))[0]
+            if key is not None:
+                # The tiles of a grid are kept and evicted along with it
+                tiles = [path for path in saved_paths if path != result_path]
+                result_path, files = await asyncio.to_thread(self.result_cache.content_address, result_path, tiles)
+                self.result_cache.put(key, result_path, files)
+                await self.result_cache.flush()
+            return result_path
 
         except Exception as e:
             logger.error(f"Error during image generation: {e}")
             raise e
-        finally:
-            await client.close()
 
-    async def save_image_files(self, image_data_list: List[bytes], prompt_id: str) -> List[str]:
-        saved_images = []
-        if not image_data_list:
-            logger.warning("No images received from ComfyUI")
-            return saved_images
+    def cached_result(self, filtered_prompt: Dict) -> Optional[str]:
+        """
+        Path of an earlier identical result for a request with an explicit seed, or None.
+        Lets a request be answered without queueing it.
+        """
+        if self.result_cache is None or filtered_prompt.get('seed', -1) == -1:
+            return None
+        _, workflow = self.prepare_workflow(filtered_prompt)
+        # The worker looks again when the job runs, so only that lookup counts a miss
+        return self.result_cache.get(self._result_cache_key(filtered_prompt, workflow), record_miss=False)
+
+    async def generate_batch(
+        self,
+        filtered_prompt: Dict,
+        counts: List[int],
+        on_event: Optional[Callable[[str, Dict], None]] = None
+    ) -> List[Optional[str]]:
+        """
+        Runs several requests for the same prompt as one ComfyUI prompt whose batch size is the sum
+        of `counts`, then splits the images back in order. Returns each request's image (or grid)
+        path, or None for a request that received no images.
+        """
+        notify = on_event or (lambda event_type, data: None)
+        try:
+            logger.info(f"Starting merged generation of {len(counts)} requests ({sum(counts)} images)")
+            model_name, workflow = self.prepare_workflow({**filtered_prompt, 'count': sum(counts)})
+            return await self._run_workflow(model_name, workflow, notify, on_event, split=counts)
+        except Exception as e:
+            logger.error(f"Error during merged image generation: {e}")
+            raise e
+
+    async def generate_combined(
+        self,
+        filtered_prompts: List[Dict],
+        on_events: Optional[List[Optional[Callable[[str, Dict], None]]]] = None
+    ) -> List[Optional[str]]:
+        """
+        Runs several requests for the same model as one ComfyUI execution. Their workflows are
+        merged into one graph where shared nodes (loaders, identical conditioning) run once
+        and the rest becomes one branch per request. Returns each request's result path, or
+        None for a request that received no images.
+        """
+        on_events = on_events or [None] * len(filtered_prompts)
+        notifiers = [on_event or (lambda event_type, data: None) for on_event in on_events]
+        try:
+            prepared = [self.prepare_workflow(filtered_prompt) for filtered_prompt in filtered_prompts]
+            model_name = prepared[0][0]
+            if any(name != model_name for name, _ in prepared):
+                raise ValueError("Only requests for the same model can share an execution")
+            workflows = [workflow for _, workflow in prepared]
+            combined, outputs = combine_workflows(workflows)
+            # Output node id in the combined graph -> index of the request it belongs to
+            owners = {node_id: index for index, branch in enumerate(outputs) for node_id in branch}
+            logger.info(f"Running {len(workflows)} requests for {model_name} as one execution ({len(combined)} nodes)")
 
-        if not os.path.exists(self.output_dir):
-            os.makedirs(self.output_dir)
+            def listener(event_type: str, data: Dict):
+                # Updates for a branch go to its request, updates for shared nodes to everyone
+                branch = branch_index(str(data.get('node') or ''))
+                for index in ([branch] if branch is not None and branch < len(notifiers) else range(len(notifiers))):
+                    notifiers[index](event_type, data)
 
-        for index, image_bytes in enumerate(image_data_list):
-            filename = get_image_filename(prompt_id, index + 1, "webp")
-            filepath = os.path.join(self.output_dir, filename)
+            async with self.pool.acquire(model_name) as backend:
+                started = time.perf_counter()
+                prompt_id = await backend.client.queue_prompt(combined)
+                if not prompt_id:
+                    raise Exception("[ComfyUI API Error] Failed to queue prompt.")
+                queued_at = time.perf_counter()
+                self._record_queue_prompt(model_name, prompt_id, started, queued_at)
+                for notify in notifiers:
+                    notify('started', {'prompt_id': prompt_id, 'model': model_name, 'backend': backend.name})
 
+                streams = [
+                    ImageStream(self.pipeline, self.output_dir, f"{prompt_id}-{index + 1}", self._create_grid(workflow))
+                    for index, workflow in enumerate(workflows)
+                ]
+
+                def on_image(node: str, image_data: bytes):
+                    if node in owners:
+                        streams[owners[node]].add(image_data)
+
+                try:
+                    images_dict = await backend.connection.wait_for_images(
+                        prompt_id, timeout=self.execution_timeout, listener=listener, on_image=on_image
+                    )
+                except Exception:
+                    for stream in streams:
+                        await stream.finish()
+                        stream.close()
+                    raise
+
+            received_at = time.perf_counter()
+            for node, images in images_dict.items():
+                for image_data in images:
+                    on_image(node, image_data)
+
+            saved = []
+            for stream, notify in zip(streams, notifiers):
+                notify('saving', {'images': len(stream)})
+                saved.append(await stream.finish())
+            saved_at = time.perf_counter()
+            results = [await self._stream_result(stream, paths) for stream, paths in zip(streams, saved)]
+            first_images = [stream.first_image_at for stream in streams if stream.first_image_at is not None]
+            self._record_timings(
+                model_name, sum(len(stream) for stream in streams), sum(stream.bytes_received for stream in streams),
+                queued_at, min(first_images) if first_images else None, received_at, saved_at
+            )
+            return results
+        except Exception as e:
+            logger.error(f"Error during combined image generation: {e}")
+            raise e
+
+    async def _run_workflow(
+        self,
+        model_name: str,
+        workflow: Dict,
+        notify: Callable[[str, Dict], None],
+        on_event: Optional[Callable[[str, Dict], None]] = None,
+        split: Optional[List[int]] = None,
+        saved_paths: Optional[List[str]] = None
+    ) -> List[Optional[str]]:
+        """
+        Executes a materialized workflow on a backend and saves its output. Returns the result
+        path, or with `split`, one result per consecutive group of that many images.
+        The path of every image saved is appended to `saved_paths`.
+        """
+        collected = saved_paths
+        # Queue on the chosen backend's shared connection so updates for this prompt arrive on its socket
+        async with self.pool.acquire(model_name) as backend:
+            started = time.perf_counter()
+            prompt_id = await backend.client.queue_prompt(workflow)
+            if not prompt_id:
+                raise Exception("[ComfyUI API Error] Failed to queue prompt.")
+            queued_at = time.perf_counter()
+            self._record_queue_prompt(model_name, prompt_id, started, queued_at)
+            notify('started', {'prompt_id': prompt_id, 'model': model_name, 'backend': backend.name})
+
+            # Save images and paste them into the grid while the rest of the batch is still arriving
+            if split is None:
+                stream = ImageStream(self.pipeline, self.output_dir, prompt_id, self._create_grid(workflow))
+            else:
+                stream = ImageStream(self.pipeline, self.output_dir, prompt_id, derive=False)
             try:
-                # Run the blocking Pillow conversion in a thread
-                def _save_task():
-                    img = Image.open(io.BytesIO(image_bytes))
-                    img.save(filepath, "WEBP")
-                
-                await asyncio.to_thread(_save_task)
-                saved_images.append(filepath)
-                logger.debug(f"Saved image: {filename}")
-            except Exception as e:
-                logger.error(f"Error saving image {filename}: {e}")
-
-        return saved_images
+                images_dict = await backend.connection.wait_for_images(
+                    prompt_id, timeout=self.execution_timeout, listener=on_event, on_image=lambda node, data: self._on_image(stream, node, data)
+                )
+            except Exception:
+                await stream.finish()
+                stream.close()
+                raise
+
+        received_at = time.perf_counter()
+        first_image_at = stream.first_image_at
+        # Frames a connection collected instead of streaming are saved now
+        for image_data in images_dict.get(OUTPUT_NODE, []):
+            stream.add(image_data)
+        logger.info(f"Received {len(stream)} image(s) from ComfyUI")
+
+        notify('saving', {'images': len(stream)})
+        saved_paths = await stream.finish()
+        if collected is not None:
+            collected.extend(saved_paths)
+        saved_at = time.perf_counter()
+        timings = (model_name, len(saved_paths), stream.bytes_received, queued_at, first_image_at, received_at, saved_at)
+
+        if split is not None:
+            stream.close()
+            results = []
+            for part in self._split(saved_paths, split):
+                results.append(await self._compose(part) if part else None)
+            self._record_timings(*timings)
+            return results
+
+        result = await self._stream_result(stream, saved_paths)
+        if result is None:
+            raise Exception("[Internal Service Error] No images were generated")
+        self._record_timings(*timings)
+        return [result]
+
+    @staticmethod
+    def _record_queue_prompt(model_name: str, prompt_id: str, started: float, queued_at: float):
+        GENERATION_STAGE_SECONDS.observe(queued_at - started, stage="queue_prompt", model=model_name)
+        span = current_span()
+        if span.recording:
+            span.set_attribute("prompt_id", prompt_id)
+            span.record("queue_prompt", perf_to_ns(started), perf_to_ns(queued_at), {"prompt_id": prompt_id})
+
+    def _record_timings(
+        self,
+        model_name: str,
+        images: int,
+        received_bytes: int,
+        queued_at: float,
+        first_image_at: Optional[float],
+        received_at: float,
+        saved_at: float
+    ):
+        """
+        Records how long ComfyUI took until the first image, how long the rest took to arrive,
+        how long saving took, and how long the grid took (until now), in the metrics and,
+        for wait estimates, in the timing stats.
+        """
+        now = time.perf_counter()
+        # Without a streamed image, the whole wait counts as execution
+        first_image_at = first_image_at or received_at
+        GENERATION_STAGE_SECONDS.observe(first_image_at - queued_at, stage="execution", model=model_name)
+        GENERATION_STAGE_SECONDS.observe(received_at - first_image_at, stage="transfer", model=model_name)
+        GENERATION_STAGE_SECONDS.observe(saved_at - received_at, stage="encode", model=model_name)
+        GENERATION_STAGE_SECONDS.observe(now - saved_at, stage="grid", model=model_name)
+        RECEIVED_BYTES.observe(received_bytes, model=model_name)
+        span = current_span()
+        if span.recording:
+            span.record("execution", perf_to_ns(queued_at), perf_to_ns(first_image_at), {"model": model_name})
+            span.record("transfer", perf_to_ns(first_image_at), perf_to_ns(received_at), {"images": images, "bytes": received_bytes})
+            span.record("encode", perf_to_ns(received_at), perf_to_ns(saved_at), {"images": images})
+            span.record("grid", perf_to_ns(saved_at), perf_to_ns(now))
+        if self.timing_stats is None or not images:
+            return
+        self.timing_stats.record(model_name, 'execution', first_image_at - queued_at, images)
+        self.timing_stats.record(model_name, 'transfer', received_at - first_image_at, images)
+        self.timing_stats.record(model_name, 'encode', now - received_at, images)
+
+    @staticmethod
+    async def _stream_result(stream: ImageStream, saved_paths: List[str]) -> Optional[str]:
+        """
+        The image, or the grid of all images, saved by a stream; None if it saved nothing.
+        """
+        # Generate grid
+        if len(saved_paths) > 1:
+            logger.info(f"Generating image grid from {len(saved_paths)} images")
+            return await stream.save_grid(saved_paths)
+        stream.close()
+        if not saved_paths:
+            return None
+        if stream.grid is not None and stream.derive and stream.pipeline.derivatives:
+            # Derivatives were left to the grid that was expected; the lone image needs its own
+            pipeline = stream.pipeline
+            await asyncio.get_running_loop().run_in_executor(pipeline.executor, pipeline.derive_file, saved_paths[0])
+        return saved_paths[0]
+
+    @staticmethod
+    def _split(paths: List[str], counts: List[int]) -> List[List[str]]:
+        parts, offset = [], 0
+        for count in counts:
+            parts.append(paths[offset:offset + count])
+            offset += count
+        return parts
+
+    async def _compose(self, paths: List[str]) -> str:
+        """
+        Result of one request from its saved images: the image itself, or a grid read from the files.
+        """
+        derive = self.pipeline.save_derivatives if self.pipeline.derivatives else None
+        if len(paths) == 1:
+            if derive is not None:
+                await asyncio.get_running_loop().run_in_executor(self.pipeline.executor, self.pipeline.derive_file, paths[0])
+            return paths[0]
+        return await ImageGrid.generate_image_grid(
+            paths, encoder=self.pipeline.encoder, preview_width=self.grid_preview_width or None, derive=derive
+        )
+
+    def _result_cache_key(self, filtered_prompt: Dict, workflow: Dict) -> Optional[str]:
+        if self.result_cache is None or filtered_prompt.get('seed', -1) == -1:
+            return None
+        encoder = self.pipeline.encoder
+        return cache_key(workflow, {
+            'format': encoder.format,
+            'quality': encoder.quality,
+            'method': encoder.method,
+            'lossless': encoder.lossless,
+            'derivatives': self.pipeline.derivatives,
+            'preview': self.grid_preview_width
+        })
+
+    @staticmethod
+    def _on_image(stream: ImageStream, node: str, image_data: bytes):
+        if node == OUTPUT_NODE:
+            stream.add(image_data)
+
+    def _create_grid(self, workflow: Dict) -> Optional[GridBuilder]:
+        """
+        Grid sized from the workflow's latent batch, or None for a single image.
+        """
+        latent = next((node['inputs'] for node in workflow.values() if 'batch_size' in node.get('inputs', {})), None)
+        if latent is None or not isinstance(latent['batch_size'], int) or latent['batch_size'] < 2:
+            return None
+        # The cell size comes from the first decoded image, since the output may be upscaled
+        return GridBuilder(latent['batch_size'], preview_width=self.grid_preview_width)
 
     async def unload_models(self):
-        client = ComfyUIClient(self.comfyui_address, self.comfyui_port)
-        try:
-            await client.unload_models()
-        finally:
-            await client.close()
+        await self.pool.unload_models()
+
+    async def prewarm(self, model_name: str, backend, timeout: Optional[float] = None):
+        """
+        Loads a model on `backend` with a one-step, one-image run of its workflow whose output is dropped.
+        The backend must be reserved with `pool.reserve()`.
+        """
+        filtered_prompt = {**PromptParser.parse_input(""), 'model': model_name, 'count': 1, 'width': 64, 'height': 64, 'steps': 1}
+        model_name, workflow = self.prepare_workflow(filtered_prompt)
+        await self.pool.prewarm(backend, model_name, workflow, timeout)
+
+    async def close(self):
+        """
+        Closes the shared ComfyUI connections and the encoder pool, and saves the result cache index.
+        """
+        await self.pool.close()
+        self.pipeline.shutdown()
+        if self.result_cache is not None:
+            self.result_cache.save()
@@ -1,19 +1,142 @@
 import math
 import logging
-from PIL import Image
-from typing import List
+import threading
+from PIL import Image, ImageOps
+from typing import Callable, List, Optional, Tuple
 import os
 
 logger = logging.getLogger(__name__)
 
+class GridBuilder:
+    """
+    Composes a grid one tile at a time, so source images can be released as soon as
+    they are pasted. Tiles whose size differs from the cell size are scaled to fit and
+    letterboxed on black. When `preview_width` is set, a downscaled copy of the grid is built
+    in the same pass.
+    """
+    def __init__(
+        self,
+        count: int,
+        tile_size: Optional[Tuple[int, int]] = None,
+        preview_width: Optional[int] = None
+    ):
+        if count < 1:
+            raise ValueError("A grid needs at least one tile")
+        self.count = count
+        self.cols = math.ceil(math.sqrt(count))
+        self.rows = math.ceil(count / self.cols)
+        self.tile_size = tile_size
+        self.preview_width = preview_width
+        self.added = 0
+        self.canvas: Optional[Image.Image] = None
+        self.preview: Optional[Image.Image] = None
+        self._preview_tile: Optional[Tuple[int, int]] = None
+        # Tiles may be pasted from several encoder threads
+        self._lock = threading.Lock()
+
+    @property
+    def complete(self) -> bool:
+        return self.added == self.count
+
+    def fits(self, index: int) -> bool:
+        return 0 <= index < self.count
+
+    def add(self, index: int, image: Image.Image):
+        """
+        Pastes `image` into cell `index`. The caller keeps ownership of the image.
+        """
+        if not self.fits(index):
+            raise IndexError(f"Tile {index} does not fit in a grid of {self.count}")
+        with self._lock:
+            if self.canvas is None:
+                self._allocate(image.size)
+            width, height = self.tile_size
+            tile = image if image.size == self.tile_size else ImageOps.contain(image, self.tile_size)
+            x = (index % self.cols) * width + (width - tile.size[0]) // 2
+            y = (index // self.cols) * height + (height - tile.size[1]) // 2
+            self.canvas.paste(tile, (x, y))
+
+            if self.preview is not None:
+                preview_width, preview_height = self._preview_tile
+                small = ImageOps.contain(tile, self._preview_tile)
+                self.preview.paste(small, (
+                    (index % self.cols) * preview_width + (preview_width - small.size[0]) // 2,
+                    (index // self.cols) * preview_height + (preview_height - small.size[1]) // 2
+                ))
+                small.close()
+            if tile is not image:
+                tile.close()
+            self.added += 1
+
+    def _allocate(self, first_size: Tuple[int, int]):
+        # Without a configured cell size, the first tile to arrive sets it
+        if self.tile_size is None:
+            self.tile_size = first_size
+        width, height = self.tile_size
+        self.canvas = Image.new('RGB', (self.cols * width, self.rows * height))
+        if self.preview_width and self.preview_width < self.cols * width:
+            preview_tile_width = max(1, self.preview_width // self.cols)
+            preview_tile_height = max(1, round(height * preview_tile_width / width))
+            self._preview_tile = (preview_tile_width, preview_tile_height)
+            self.preview = Image.new(
+                'RGB', (self.cols * preview_tile_width, self.rows * preview_tile_height)
+            )
+
+    def save(self, path: str, encoder=None, preview_path: Optional[str] = None) -> Tuple[str, Optional[str]]:
+        """
+        Writes the grid (and the preview, if one was built) and returns their paths.
+        """
+        if self.canvas is None:
+            raise ValueError("No tiles were added to the grid")
+        ImageGrid.save_image(self.canvas, path, encoder)
+        if self.preview is not None and preview_path:
+            ImageGrid.save_image(self.preview, preview_path, encoder)
+        else:
+            preview_path = None
+        return path, preview_path
+
+    def close(self):
+        for image in (self.canvas, self.preview):
+            if image is not None:
+                image.close()
+        self.canvas = self.preview = None
+
 class ImageGrid:
     """
     Handles the creation of a tiled grid from multiple individual images.
     """
     @staticmethod
-    async def generate_image_grid(image_paths: List[str], output_path: str = None) -> str:
+    def grid_path(first_image_path: str) -> str:
+        """
+        Grid filename derived from the first image path.
+        """
+        name, ext = os.path.splitext(first_image_path)
+        return f"{name}_grid{ext}"
+
+    @staticmethod
+    def preview_path(grid_path: str) -> str:
+        name, ext = os.path.splitext(grid_path)
+        return f"{name}_preview{ext}"
+
+    @staticmethod
+    def save_image(image: Image.Image, path: str, encoder=None):
+        if encoder is not None:
+            encoder.save(image, path)
+        else:
+            image.save(path, "WEBP")
+
+    @staticmethod
+    async def generate_image_grid(
+        image_paths: List[str],
+        output_path: str = None,
+        encoder=None,
+        preview_width: Optional[int] = None,
+        derive: Optional[Callable[[Image.Image, str], object]] = None
+    ) -> str:
         """
-        Creates a vertical or square grid from individual images.
+        Creates a vertical or square grid from individual images, reading them one at a time.
+        `encoder` (an ImageEncoder) controls the output format, and `derive` is called with
+        the finished grid and its path (e.g. to save downscaled copies).
         """
         if not image_paths:
             raise ValueError("No images provided for grid generation")
@@ -21,39 +144,27 @@ class ImageGrid:
         import asyncio
 
         def _create_grid():
-            images = [Image.open(p) for p in image_paths]
-            count = len(images)
-            
+            count = len(image_paths)
+
             if count == 1:
                 return image_paths[0]
 
-            # Calculate grid dimensions
-            cols = math.ceil(math.sqrt(count))
-            rows = math.ceil(count / cols)
-
-            # Assume all images are the same size as the first one
-            width, height = images[0].size
-            
-            grid_width = cols * width
-            grid_height = rows * height
-            
-            grid_image = Image.new('RGB', (grid_width, grid_height))
-            
-            for i, img in enumerate(images):
-                x = (i % cols) * width
-                y = (i // cols) * height
-                grid_image.paste(img, (x, y))
-            
-            target_path = output_path
-            if not target_path:
-                # Generate a grid filename based on the first image path
-                dir_name = os.path.dirname(image_paths[0])
-                base_name = os.path.basename(image_paths[0])
-                name, ext = os.path.splitext(base_name)
-                target_path = os.path.join(dir_name, f"{name}_grid{ext}")
-
-            grid_image.save(target_path, "WEBP")
-            return target_path
+            builder = GridBuilder(count, preview_width=preview_width)
+            try:
+                for i, path in enumerate(image_paths):
+                    img = Image.open(path)
+                    try:
+                        builder.add(i, img)
+                    finally:
+                        img.close()
+
+                target_path = output_path or ImageGrid.grid_path(image_paths[0])
+                builder.save(target_path, encoder, ImageGrid.preview_path(target_path))
+                if derive is not None:
+                    derive(builder.canvas, target_path)
+                return target_path
+            finally:
+                builder.close()
 
         result_path = await asyncio.to_thread(_create_grid)
         logger.info(f"Image grid saved to: {result_path}")
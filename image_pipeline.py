@@ -0,0 +1,253 @@
+import asyncio
+import io
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, features
+
+from filename_utils import get_derivative_path, get_image_filename
+from image_grid import GridBuilder, ImageGrid
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+IMAGE_STAGE_SECONDS = REGISTRY.histogram(
+    "image_stage_duration_seconds", "Time spent per image in each pipeline stage", ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+
+def parse_derivatives(spec: str) -> Dict[str, int]:
+    """
+    Parses a comma-separated list of 'name:max_edge' entries (e.g. 'thumb:256,medium:1024').
+    """
+    derivatives = {}
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, _, size = entry.partition(':')
+        name = name.strip()
+        if not name or name == "full" or not size.strip().isdigit() or int(size) < 1:
+            raise ValueError(f"Invalid image derivative '{entry}'; expected name:max_edge")
+        derivatives[name] = int(size)
+    return derivatives
+
+class ImageEncoder:
+    """
+    Output encoding settings. `png` writes the PNG bytes received from ComfyUI as-is,
+    without decoding or re-encoding them.
+    """
+    FORMATS = {"webp": "WEBP", "avif": "AVIF", "png": "PNG"}
+
+    def __init__(self, format: str = "webp", quality: int = 80, method: int = 4, lossless: bool = False):
+        format = format.lower()
+        if format not in self.FORMATS:
+            raise ValueError(f"Unsupported image format '{format}'. Available: {', '.join(self.FORMATS)}")
+        if format == "avif" and not features.check("avif"):
+            raise ValueError("AVIF output requires Pillow built with libavif")
+        self.format = format
+        self.quality = quality
+        self.method = method
+        self.lossless = lossless
+
+    @property
+    def extension(self) -> str:
+        return self.format
+
+    @property
+    def passthrough(self) -> bool:
+        return self.format == "png"
+
+    def save(self, image: Image.Image, path: str):
+        """
+        Encodes a decoded image to `path` with the configured settings.
+        """
+        if self.format == "webp":
+            image.save(path, "WEBP", quality=self.quality, method=self.method, lossless=self.lossless)
+        elif self.format == "avif":
+            image.save(path, "AVIF", quality=self.quality)
+        else:
+            image.save(path, "PNG")
+
+class ImagePipeline:
+    """
+    Decodes and encodes the images returned by ComfyUI on a bounded thread pool, so several
+    images of a batch are processed in parallel without blocking the event loop. Prompts are
+    saved through an `ImageStream`, which hands each decoded image to the grid step instead of
+    re-reading files.
+    `derivatives` maps a name to the longest edge of a downscaled copy saved next to the result.
+    """
+    def __init__(
+        self,
+        encoder: Optional[ImageEncoder] = None,
+        max_workers: int = 2,
+        derivatives: Optional[Dict[str, int]] = None
+    ):
+        self.encoder = encoder or ImageEncoder()
+        self.derivatives = derivatives or {}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-encode")
+
+    def _process(
+        self, image_bytes: bytes, filepath: str, keep_decoded: bool, derive: bool = False
+    ) -> Tuple[str, Optional[Image.Image]]:
+        derive = derive and bool(self.derivatives)
+        image = None
+        if self.encoder.passthrough:
+            started = time.perf_counter()
+            with open(filepath, "wb") as f:
+                f.write(image_bytes)
+            IMAGE_STAGE_SECONDS.observe(time.perf_counter() - started, stage="encode")
+
+        if keep_decoded or derive or not self.encoder.passthrough:
+            started = time.perf_counter()
+            image = Image.open(io.BytesIO(image_bytes))
+            image.load()
+            IMAGE_STAGE_SECONDS.observe(time.perf_counter() - started, stage="decode")
+
+        if not self.encoder.passthrough:
+            started = time.perf_counter()
+            self.encoder.save(image, filepath)
+            IMAGE_STAGE_SECONDS.observe(time.perf_counter() - started, stage="encode")
+
+        if derive:
+            self.save_derivatives(image, filepath)
+        if image is not None and not keep_decoded:
+            image.close()
+            image = None
+        return filepath, image
+
+    def save_derivatives(self, image: Image.Image, filepath: str) -> Dict[str, str]:
+        """
+        Saves every configured derivative of an already decoded image and returns their paths.
+        Each one is downscaled from the next larger one rather than from the full image.
+        """
+        paths = {}
+        source = image
+        for name, size in sorted(self.derivatives.items(), key=lambda item: -item[1]):
+            started = time.perf_counter()
+            scale = min(1.0, size / max(source.size))
+            target = (max(1, round(source.size[0] * scale)), max(1, round(source.size[1] * scale)))
+            resized = source.resize(target, Image.LANCZOS, reducing_gap=2.0) if target != source.size else source.copy()
+            IMAGE_STAGE_SECONDS.observe(time.perf_counter() - started, stage="resize")
+            paths[name] = get_derivative_path(filepath, name)
+            started = time.perf_counter()
+            self.encoder.save(resized, paths[name])
+            IMAGE_STAGE_SECONDS.observe(time.perf_counter() - started, stage="encode")
+            if source is not image:
+                source.close()
+            source = resized
+        if source is not image:
+            source.close()
+        return paths
+
+    def derive_file(self, filepath: str) -> Dict[str, str]:
+        """
+        Saves the derivatives of an image that is only on disk. Blocking; run it on the executor.
+        """
+        with Image.open(filepath) as image:
+            image.load()
+            return self.save_derivatives(image, filepath)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+class ImageStream:
+    """
+    Saves the images of one prompt as they arrive from ComfyUI rather than after the prompt
+    finishes. With a `grid`, each decoded image is pasted into it and released right away,
+    so at most one image per encoder thread is held in memory.
+    """
+    def __init__(
+        self,
+        pipeline: ImagePipeline,
+        output_dir: str,
+        prompt_id: str,
+        grid: Optional[GridBuilder] = None,
+        derive: bool = True
+    ):
+        self.pipeline = pipeline
+        self.derive = derive
+        self.output_dir = output_dir
+        self.prompt_id = prompt_id
+        self.grid = grid
+        self._tasks: List[asyncio.Future] = []
+        # perf_counter() time the first image arrived, and the encoded size of all of them
+        self.first_image_at: Optional[float] = None
+        self.bytes_received = 0
+        os.makedirs(output_dir, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def add(self, image_bytes: bytes):
+        index = len(self._tasks)
+        if index == 0:
+            self.first_image_at = time.perf_counter()
+        self.bytes_received += len(image_bytes)
+        filepath = os.path.join(
+            self.output_dir, get_image_filename(self.prompt_id, index + 1, self.pipeline.encoder.extension)
+        )
+        loop = asyncio.get_running_loop()
+        self._tasks.append(loop.run_in_executor(self.pipeline.executor, self._process, image_bytes, filepath, index))
+
+    def _process(self, image_bytes: bytes, filepath: str, index: int) -> str:
+        grid = self.grid if self.grid is not None and self.grid.fits(index) else None
+        # A single image is the job's result, so its derivatives come from this same decode
+        path, image = self.pipeline._process(image_bytes, filepath, grid is not None, derive=self.derive and self.grid is None and index == 0)
+        if image is not None:
+            try:
+                started = time.perf_counter()
+                grid.add(index, image)
+                IMAGE_STAGE_SECONDS.observe(time.perf_counter() - started, stage="grid")
+            finally:
+                image.close()
+        return path
+
+    async def finish(self) -> List[str]:
+        """
+        Waits for every image added so far and returns the saved paths in arrival order.
+        """
+        paths = []
+        for result in await asyncio.gather(*self._tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.error(f"Error saving image: {result}")
+                continue
+            paths.append(result)
+            logger.debug(f"Saved image: {os.path.basename(result)}")
+        return paths
+
+    async def save_grid(self, paths: List[str]) -> str:
+        """
+        Writes the grid of `paths`. Uses the tiles pasted while streaming when all of them
+        made it in, otherwise composes the grid from the saved files.
+        """
+        encoder = self.pipeline.encoder
+        derive = self.pipeline.save_derivatives if self.pipeline.derivatives else None
+        grid_path = ImageGrid.grid_path(paths[0])
+        try:
+            if self.grid is None or not self.grid.complete or len(paths) != self.grid.count:
+                return await ImageGrid.generate_image_grid(
+                    paths, grid_path, encoder=encoder,
+                    preview_width=self.grid.preview_width if self.grid else None, derive=derive
+                )
+
+            def _save():
+                self.grid.save(grid_path, encoder, ImageGrid.preview_path(grid_path))
+                if derive is not None:
+                    derive(self.grid.canvas, grid_path)
+
+            loop = asyncio.get_running_loop()
+            started = time.perf_counter()
+            await loop.run_in_executor(self.pipeline.executor, _save)
+            IMAGE_STAGE_SECONDS.observe(time.perf_counter() - started, stage="encode")
+            logger.info(f"Image grid saved to: {grid_path}")
+            return grid_path
+        finally:
+            self.close()
+
+    def close(self):
+        if self.grid is not None:
+            self.grid.close()
@@ -0,0 +1,102 @@
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from job_store import Job
+
+logger = logging.getLogger(__name__)
+
+def coalesce_key(filtered_prompt: Dict[str, Any], model_name: Optional[str]) -> Optional[str]:
+    """
+    Canonical form of a parsed request, or None when it cannot be shared.
+    Only requests with an explicit seed are deterministic enough to run once for everyone.
+    """
+    if filtered_prompt.get('seed', -1) == -1:
+        return None
+    return json.dumps({**filtered_prompt, 'model': model_name}, sort_keys=True, separators=(",", ":"))
+
+def merge_key(filtered_prompt: Dict[str, Any], model_name: Optional[str]) -> Optional[str]:
+    """
+    Canonical form of a request without its image count, or None when it cannot be merged.
+    Requests with the same key can run as one prompt with a larger batch size. An explicit
+    seed pins the exact images, which a shared batch would change, so those are never merged.
+    """
+    if filtered_prompt.get('seed', -1) != -1:
+        return None
+    shared = {k: v for k, v in filtered_prompt.items() if k not in ('count', 'seed')}
+    return json.dumps({**shared, 'model': model_name}, sort_keys=True, separators=(",", ":"))
+
+class JobCoalescer:
+    """
+    Tracks queued and running jobs by their canonical parameters, so an identical request
+    attaches to the execution already under way instead of running again. Attached jobs
+    keep their own id and nick and receive the primary job's events and result.
+    Jobs can also be merged into a primary job: they run in its ComfyUI prompt as part of
+    a larger batch and each receive their own share of the images.
+    """
+    def __init__(self):
+        self._primaries: Dict[str, Job] = {}
+        self._keys: Dict[str, str] = {}
+        self._followers: Dict[str, List[Job]] = {}
+        self._attached_to: Dict[str, Job] = {}
+        # Image counts of merged jobs and of the primaries they were merged into
+        self._counts: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._primaries)
+
+    def attach(self, job: Job, key: Optional[str]) -> Optional[Job]:
+        """
+        Attaches `job` to a queued or running job with the same key and returns that job,
+        or registers `job` as the one to run and returns None.
+        """
+        if key is None:
+            return None
+        primary = self._primaries.get(key)
+        if primary is None:
+            self._primaries[key] = job
+            self._keys[job.id] = key
+            return None
+        self._followers.setdefault(primary.id, []).append(job)
+        self._attached_to[job.id] = primary
+        logger.info(f"Job {job.id} for {job.nick} attached to identical job {primary.id}")
+        return primary
+
+    def merge(self, primary: Job, job: Job, primary_count: int, count: int):
+        """
+        Merges `job` into `primary`'s execution, adding `count` images to its batch.
+        """
+        self._counts.setdefault(primary.id, primary_count)
+        self._counts[job.id] = count
+        self._followers.setdefault(primary.id, []).append(job)
+        self._attached_to[job.id] = primary
+        logger.info(f"Job {job.id} for {job.nick} merged into job {primary.id}")
+
+    def merged_group(self, job: Job) -> Optional[List[Tuple[Job, int]]]:
+        """
+        The job and the jobs merged into it with their image counts, in batch order, or None.
+        """
+        if job.id not in self._counts:
+            return None
+        merged = [f for f in self._followers.get(job.id, []) if f.id in self._counts]
+        return [(member, self._counts[member.id]) for member in [job] + merged]
+
+    def followers(self, job: Job) -> List[Job]:
+        return self._followers.get(job.id, [])
+
+    def primary_of(self, job: Job) -> Optional[Job]:
+        return self._attached_to.get(job.id)
+
+    def release(self, job: Job) -> List[Job]:
+        """
+        Unregisters a job that has finished and returns the jobs attached to it.
+        """
+        key = self._keys.pop(job.id, None)
+        if key is not None and self._primaries.get(key) is job:
+            del self._primaries[key]
+        self._counts.pop(job.id, None)
+        followers = self._followers.pop(job.id, [])
+        for follower in followers:
+            self._attached_to.pop(follower.id, None)
+            self._counts.pop(follower.id, None)
+        return followers
@@ -0,0 +1,59 @@
+import heapq
+import logging
+from typing import Hashable, List, Optional, Sequence, Tuple
+
+from timing_stats import TimingStats
+
+logger = logging.getLogger(__name__)
+
+class EtaEstimator:
+    """
+    Estimates when queued jobs will start and finish from the recorded run times of
+    earlier jobs for the same model (see TimingStats).
+    """
+    def __init__(self, stats: TimingStats, workers: int = 1, default_seconds: float = 30.0):
+        self.stats = stats
+        self.workers = max(1, workers)
+        # Per-image time assumed before any job has been timed
+        self.default_seconds = default_seconds
+
+    def expected(self, model: Optional[Hashable], images: int) -> float:
+        """
+        Expected run time in seconds of a job for `model` producing `images` images.
+        """
+        expected = self.stats.expected_run(model, images)
+        if expected is not None:
+            return expected
+        # Unknown model: the average over timed models is a better guess than the default
+        known = [self.stats.expected_run(other, 1) for other in self.stats.models()]
+        known = [seconds for seconds in known if seconds is not None]
+        per_image = sum(known) / len(known) if known else self.default_seconds
+        return per_image * max(1, images)
+
+    def remaining(self, model: Optional[Hashable], images: int, elapsed: float) -> float:
+        """
+        Expected seconds until a running job finishes.
+        """
+        return max(0.0, self.expected(model, images) - elapsed)
+
+    def schedule(
+        self,
+        running: Sequence[Tuple[Optional[Hashable], int, float]],
+        queued: Sequence[Tuple[Optional[Hashable], int]]
+    ) -> List[Tuple[float, float]]:
+        """
+        Seconds from now until each queued job (model, images), in dispatch order, is expected
+        to start and to finish. `running` lists the jobs in progress as (model, images, seconds
+        elapsed). Jobs are assigned to whichever worker is expected to be free first.
+        """
+        free_at = sorted(self.remaining(model, images, elapsed) for model, images, elapsed in running)[:self.workers]
+        free_at += [0.0] * (self.workers - len(free_at))
+        heapq.heapify(free_at)
+
+        estimates = []
+        for model, images in queued:
+            start = heapq.heappop(free_at)
+            finish = start + self.expected(model, images)
+            estimates.append((start, finish))
+            heapq.heappush(free_at, finish)
+        return estimates
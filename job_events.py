@@ -0,0 +1,68 @@
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Event types after which a job's stream ends
+FINAL_EVENTS = ("completed", "failed")
+
+def format_sse(event_type: str, data: Any) -> str:
+    """
+    Formats an event as a Server-Sent Events message.
+    """
+    return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+class JobEventBroker:
+    """
+    Fans out job lifecycle events (queue position, node execution, sampler progress, result)
+    to the clients streaming them. Publishing to a job nobody listens to costs a dict lookup.
+    """
+    def __init__(self, max_pending: int = 256):
+        self.max_pending = max_pending
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._positions: Dict[str, int] = {}
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        subscription = asyncio.Queue(self.max_pending)
+        self._subscribers.setdefault(job_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, job_id: str, subscription: asyncio.Queue):
+        subscribers = self._subscribers.get(job_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._subscribers[job_id]
+            self._positions.pop(job_id, None)
+
+    def has_subscribers(self, job_id: Optional[str] = None) -> bool:
+        return bool(self._subscribers) if job_id is None else job_id in self._subscribers
+
+    def publish(self, job_id: str, event_type: str, data: Dict):
+        for subscription in self._subscribers.get(job_id, ()):
+            if subscription.full():
+                # A slow client loses its oldest progress update rather than blocking the worker
+                subscription.get_nowait()
+            subscription.put_nowait((event_type, data))
+
+    def publish_position(self, job_id: str, position: int):
+        """
+        Publishes a queue position only when it differs from the last one sent for the job.
+        """
+        if job_id not in self._subscribers or self._positions.get(job_id) == position:
+            return
+        self._positions[job_id] = position
+        self.publish(job_id, "queue", {"position": position})
+
+    @staticmethod
+    async def next_event(subscription: asyncio.Queue, keepalive: float) -> Optional[Tuple[str, Dict]]:
+        """
+        Waits for the next event, returning None if nothing arrived within `keepalive` seconds.
+        """
+        try:
+            return await asyncio.wait_for(subscription.get(), keepalive)
+        except asyncio.TimeoutError:
+            return None
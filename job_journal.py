@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    nick TEXT NOT NULL,
+    raw_message TEXT,
+    status TEXT NOT NULL,
+    prompt_id TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+UPSERT = """
+INSERT INTO jobs (id, nick, raw_message, status, prompt_id, result, error, created_at, updated_at)
+VALUES (:id, :nick, :raw_message, :status, :prompt_id, :result, :error, :created_at, :updated_at)
+ON CONFLICT(id) DO UPDATE SET
+    raw_message = COALESCE(excluded.raw_message, jobs.raw_message),
+    status = excluded.status,
+    prompt_id = COALESCE(excluded.prompt_id, jobs.prompt_id),
+    result = excluded.result,
+    error = excluded.error,
+    updated_at = excluded.updated_at
+"""
+
+class JobJournal:
+    """
+    Optional SQLite (WAL mode) persistence for the job queue and registry, so queued and
+    running jobs survive a restart. Writes are buffered and flushed in batches from a
+    background task; several updates to the same job within a batch collapse into one row write.
+    """
+    def __init__(self, path: str, flush_interval: float = 0.2, retention: float = 3600.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending: Dict[str, Dict] = {}
+        # The batch write in progress; it keeps running in its thread even if the flush awaiting it is cancelled
+        self._writing: Optional[asyncio.Task] = None
+        self._last_purge = 0.0
+
+    def open(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(SCHEMA)
+        self._conn.commit()
+        logger.info(f"Job journal opened at {self.path}")
+
+    def record(self, job, prompt_id: Optional[str] = None):
+        """
+        Buffers the job's current state for the next batch write.
+        """
+        now = time.time()
+        previous = self._pending.get(job.id)
+        self._pending[job.id] = {
+            "id": job.id,
+            "nick": job.nick,
+            "raw_message": job.raw_message or (previous["raw_message"] if previous else None),
+            "status": job.status,
+            "prompt_id": prompt_id or (previous["prompt_id"] if previous else None),
+            "result": job.result,
+            "error": job.error,
+            "created_at": previous["created_at"] if previous else now,
+            "updated_at": now
+        }
+
+    async def flush(self):
+        if not self._pending or self._conn is None:
+            return
+        rows, self._pending = self._pending, {}
+        self._writing = asyncio.create_task(self._write_batch(rows))
+        await asyncio.shield(self._writing)
+
+    async def _write_batch(self, rows: Dict[str, Dict]):
+        try:
+            await asyncio.to_thread(self._write, list(rows.values()))
+        except Exception:
+            # Keep the rows for the next flush, merged under any update recorded meanwhile
+            for job_id, row in rows.items():
+                newer = self._pending.get(job_id)
+                if newer is None:
+                    self._pending[job_id] = row
+                    continue
+                newer["created_at"] = row["created_at"]
+                for key in ("raw_message", "prompt_id"):
+                    if newer[key] is None:
+                        newer[key] = row[key]
+            raise
+
+    def _write(self, rows: List[Dict]):
+        with self._conn:
+            self._conn.executemany(UPSERT, rows)
+        logger.debug(f"Persisted {len(rows)} job update(s)")
+
+    def purge(self):
+        """
+        Deletes finished jobs older than the retention period.
+        """
+        cutoff = time.time() - self.retention
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN ('completed', 'failed') AND updated_at < ?", (cutoff,)
+            )
+        self._last_purge = time.monotonic()
+
+    def load(self) -> List[Dict]:
+        """
+        Returns every stored job, oldest first.
+        """
+        self._conn.row_factory = sqlite3.Row
+        try:
+            return [dict(row) for row in self._conn.execute("SELECT * FROM jobs ORDER BY created_at, rowid")]
+        finally:
+            self._conn.row_factory = None
+
+    async def run(self):
+        """
+        Flushes buffered writes every `flush_interval` seconds and purges old jobs now and then.
+        """
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - self._last_purge > 300:
+                    await asyncio.to_thread(self.purge)
+            except Exception as e:
+                logger.error(f"Failed to persist jobs: {e}")
+
+    async def close(self):
+        if self._conn is None:
+            return
+        if self._writing is not None and not self._writing.done():
+            try:
+                await self._writing
+            except Exception as e:
+                logger.error(f"Failed to persist jobs: {e}")
+        await self.flush()
+        self._conn.close()
+        self._conn = None
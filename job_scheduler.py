@@ -0,0 +1,426 @@
+import asyncio
+import itertools
+import json
+import logging
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+class _Entry:
+    """
+    A queued job together with its scheduling key and bookkeeping.
+    """
+    __slots__ = ("job", "key", "bypassed", "user", "start", "rank")
+
+    def __init__(self, job: Any, key: Optional[Hashable], bypassed: int = 0):
+        self.job = job
+        self.key = key
+        self.bypassed = bypassed
+        # Set by the fair-share scheduler: owner, virtual start time and dispatch rank
+        self.user: Optional[Hashable] = None
+        self.start = 0.0
+        self.rank: Tuple = ()
+
+    def copy(self) -> "_Entry":
+        entry = _Entry(self.job, self.key, self.bypassed)
+        entry.user, entry.start, entry.rank = self.user, self.start, self.rank
+        return entry
+
+class JobScheduler:
+    """
+    Drop-in replacement for asyncio.Queue that decides which queued job runs next.
+    The base class dispatches in strict arrival (FIFO) order; subclasses override
+    `_select` to reorder the pending jobs.
+    """
+    def __init__(self, key_func: Optional[Callable[[Any], Optional[Hashable]]] = None):
+        self.key_func = key_func
+        self.current_key: Optional[Hashable] = None
+        self._pending: List[_Entry] = []
+        self._getters: Deque[asyncio.Future] = deque()
+        self._putters: List[asyncio.Future] = []
+        self._unfinished = 0
+
+    def qsize(self) -> int:
+        return len(self._pending)
+
+    def empty(self) -> bool:
+        return not self._pending
+
+    def admits(self, jobs: List[Any]) -> bool:
+        """
+        Whether the jobs may be queued now; the base scheduler has no limits.
+        """
+        return True
+
+    def put_nowait(self, job: Any) -> None:
+        self._pending.append(self._make_entry(job))
+        self._unfinished += 1
+        self._wakeup_next()
+        self._notify_put()
+
+    async def put(self, job: Any) -> None:
+        self.put_nowait(job)
+
+    def put_many_nowait(self, jobs: List[Any]) -> None:
+        """
+        Queues several jobs at once; no worker can take one of them before all are queued.
+        """
+        entries = [self._make_entry(job) for job in jobs]
+        self._pending.extend(entries)
+        self._unfinished += len(entries)
+        for _ in entries:
+            self._wakeup_next()
+        self._notify_put()
+
+    async def put_many(self, jobs: List[Any]) -> None:
+        self.put_many_nowait(jobs)
+
+    async def get(self) -> Any:
+        """
+        Waits until a job is pending, then removes and returns the one chosen by the scheduling policy.
+        """
+        while not self._has_eligible():
+            getter = asyncio.get_running_loop().create_future()
+            self._getters.append(getter)
+            try:
+                await getter
+            except BaseException:
+                getter.cancel()
+                try:
+                    self._getters.remove(getter)
+                except ValueError:
+                    pass
+                if self._pending and not getter.cancelled():
+                    self._wakeup_next()
+                raise
+        return self.get_nowait()
+
+    def get_nowait(self) -> Any:
+        if not self._pending:
+            raise asyncio.QueueEmpty
+        index = self._select(self._pending, self.current_key)
+        if index is None:
+            # Everything queued belongs to users already at their limit
+            raise asyncio.QueueEmpty
+        entry = self._take(self._pending, index)
+        if entry.key != self.current_key:
+            logger.info(f"Scheduler switching from {self.current_key} to {entry.key}")
+        self.current_key = entry.key
+        self._dispatched(entry)
+        return entry.job
+
+    def take_matching(self, key: Optional[Hashable], predicate: Callable[[Any], bool], limit: int) -> List[Any]:
+        """
+        Removes and returns up to `limit` queued jobs with scheduling key `key` that satisfy
+        `predicate`, oldest first. Every job taken counts as overtaking the older jobs left in
+        the queue, and taking stops at the first of them that may not be overtaken any more.
+        """
+        taken = []
+        passed: List[_Entry] = []
+        for entry in list(self._pending):
+            if len(taken) >= limit:
+                break
+            if entry.key == key and self._eligible(entry) and predicate(entry.job):
+                if not all(self._may_overtake(older) for older in passed):
+                    break
+                for older in passed:
+                    older.bypassed += 1
+                self._pending.remove(entry)
+                self._dispatched(entry)
+                taken.append(entry.job)
+            else:
+                passed.append(entry)
+        return taken
+
+    async def wait_for_put(self, timeout: float) -> bool:
+        """
+        Waits up to `timeout` seconds for a job to be queued; returns whether one was.
+        """
+        putter = asyncio.get_running_loop().create_future()
+        self._putters.append(putter)
+        try:
+            await asyncio.wait_for(putter, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            if putter in self._putters:
+                self._putters.remove(putter)
+
+    def task_done(self, job: Any = None) -> None:
+        """
+        Marks a dispatched job as finished. Pass the job so per-user running limits are released.
+        """
+        if self._unfinished <= 0:
+            raise ValueError("task_done() called too many times")
+        self._unfinished -= 1
+        if job is not None:
+            self._finished(job)
+
+    def position(self, job: Any) -> Optional[int]:
+        """
+        Returns the 1-based position the job will be dispatched at, or None if it is not queued.
+        """
+        for index, queued in enumerate(self.planned_order()):
+            if queued is job:
+                return index + 1
+        return None
+
+    def planned_order(self) -> List[Any]:
+        """
+        Simulates the scheduling policy over the current queue and returns jobs in expected dispatch order.
+        """
+        return [job for job, _ in self.planned_schedule()]
+
+    def planned_schedule(self) -> List[Tuple[Any, Optional[Hashable]]]:
+        """
+        Like planned_order, with each job's scheduling key.
+        """
+        pending = [entry.copy() for entry in self._pending]
+        current_key = self.current_key
+        order = []
+        while pending:
+            entry = self._take(pending, self._select(pending, current_key) or 0)
+            current_key = entry.key
+            order.append((entry.job, entry.key))
+        return order
+
+    def _make_entry(self, job: Any) -> _Entry:
+        return _Entry(job, self.key_func(job) if self.key_func else None)
+
+    def _select(self, pending: List[_Entry], current_key: Optional[Hashable]) -> Optional[int]:
+        """
+        Index of the pending job to run next, or None if none of them may run yet.
+        """
+        return 0
+
+    def _eligible(self, entry: _Entry) -> bool:
+        return True
+
+    def _may_overtake(self, entry: _Entry) -> bool:
+        """
+        Whether a later job may still run before this queued one.
+        """
+        return True
+
+    def _has_eligible(self) -> bool:
+        return bool(self._pending)
+
+    def _dispatched(self, entry: _Entry) -> None:
+        pass
+
+    def _finished(self, job: Any) -> None:
+        pass
+
+    @staticmethod
+    def _take(pending: List[_Entry], index: int) -> _Entry:
+        # Every job that was queued ahead of the chosen one has now been overtaken once more
+        for overtaken in pending[:index]:
+            overtaken.bypassed += 1
+        return pending.pop(index)
+
+    def _notify_put(self) -> None:
+        putters, self._putters = self._putters, []
+        for putter in putters:
+            if not putter.done():
+                putter.set_result(None)
+
+    def _wakeup_next(self) -> None:
+        while self._getters:
+            getter = self._getters.popleft()
+            if not getter.done():
+                getter.set_result(None)
+                break
+
+class ModelAffinityScheduler(JobScheduler):
+    """
+    Keeps running jobs for the currently loaded model back to back to avoid checkpoint reloads.
+    A job may be overtaken by at most `starvation_limit` later jobs before it is forced to run next.
+    """
+    def __init__(self, key_func: Optional[Callable[[Any], Optional[Hashable]]] = None, starvation_limit: int = 8):
+        super().__init__(key_func)
+        self.starvation_limit = starvation_limit
+
+    def _select(self, pending: List[_Entry], current_key: Optional[Hashable]) -> int:
+        for index, entry in enumerate(pending):
+            if entry.key == current_key or entry.bypassed >= self.starvation_limit:
+                return index
+        # Nothing queued for the current model: switch to the oldest job
+        return 0
+
+    def _may_overtake(self, entry: _Entry) -> bool:
+        return entry.bypassed < self.starvation_limit
+
+class FairSharePolicy:
+    """
+    Per-user settings of the fair-share scheduler. Each user has a weight (share of the
+    generation time relative to other users), a priority class, and limits on queued and
+    running jobs (0 means unlimited). `users` maps a nick to overrides of any of these.
+    Priority classes are listed from most to least urgent.
+    """
+    SETTINGS = ("weight", "priority", "max_queued", "max_running")
+
+    def __init__(
+        self,
+        weight: float = 1.0,
+        priority: str = "normal",
+        max_queued: int = 0,
+        max_running: int = 0,
+        priorities: Sequence[str] = ("high", "normal", "low"),
+        users: Optional[Dict[str, Dict[str, Any]]] = None
+    ):
+        self.priorities = list(priorities)
+        self.defaults = {"weight": weight, "priority": priority, "max_queued": max_queued, "max_running": max_running}
+        self.users = users or {}
+        for name, settings in [("defaults", self.defaults)] + list(self.users.items()):
+            self._validate(name, settings)
+
+    @classmethod
+    def from_file(cls, path: str, **defaults) -> "FairSharePolicy":
+        """
+        Loads a JSON policy: {"priorities": [...], "defaults": {...}, "users": {"nick": {...}}}.
+        Defaults given here (e.g. from the environment) apply unless the file overrides them.
+        """
+        with open(path, 'r') as f:
+            data = json.load(f)
+        unknown = set(data) - {"priorities", "defaults", "users"}
+        if unknown:
+            raise ValueError(f"Unknown scheduler policy section(s): {', '.join(sorted(unknown))}")
+        defaults.update(data.get("defaults", {}))
+        if "priorities" in data:
+            defaults["priorities"] = data["priorities"]
+        return cls(users=data.get("users", {}), **defaults)
+
+    def _validate(self, name: str, settings: Dict[str, Any]):
+        unknown = set(settings) - set(self.SETTINGS)
+        if unknown:
+            raise ValueError(f"Unknown scheduler setting(s) for {name}: {', '.join(sorted(unknown))}")
+        if "weight" in settings and not settings["weight"] > 0:
+            raise ValueError(f"Weight for {name} must be positive")
+        if "priority" in settings and settings["priority"] not in self.priorities:
+            raise ValueError(
+                f"Unknown priority '{settings['priority']}' for {name}. Available: {', '.join(self.priorities)}"
+            )
+        for limit in ("max_queued", "max_running"):
+            if limit in settings and (not isinstance(settings[limit], int) or settings[limit] < 0):
+                raise ValueError(f"{limit} for {name} must be a non-negative integer")
+
+    def get(self, user: Optional[Hashable], setting: str) -> Any:
+        return self.users.get(user, {}).get(setting, self.defaults[setting])
+
+    def priority_rank(self, user: Optional[Hashable]) -> int:
+        return self.priorities.index(self.get(user, "priority"))
+
+class FairShareScheduler(JobScheduler):
+    """
+    Weighted fair queuing across users (start-time fair queuing, a close relative of deficit
+    round robin). Each job is tagged on arrival with a virtual finish time: its cost (e.g. the
+    number of images) divided by its user's weight, counted from the later of the user's
+    previous tag and the current virtual time. Jobs run in tag order, so a user who queues
+    many jobs at once is interleaved with everyone else instead of going first, and an idle
+    user cannot build up credit. Higher priority classes always run first. Users at their
+    `max_running` limit are skipped until one of their jobs finishes.
+    """
+    def __init__(
+        self,
+        key_func: Optional[Callable[[Any], Optional[Hashable]]] = None,
+        user_func: Optional[Callable[[Any], Optional[Hashable]]] = None,
+        cost_func: Optional[Callable[[Any], float]] = None,
+        policy: Optional[FairSharePolicy] = None
+    ):
+        super().__init__(key_func)
+        self.user_func = user_func or (lambda job: None)
+        self.cost_func = cost_func or (lambda job: 1)
+        self.policy = policy or FairSharePolicy()
+        self.virtual_time = 0.0
+        self._last_finish: Dict[Optional[Hashable], float] = {}
+        self._queued: Dict[Optional[Hashable], int] = {}
+        self._running: Dict[Optional[Hashable], int] = {}
+        self._sequence = itertools.count()
+
+    def admits(self, jobs: List[Any]) -> bool:
+        added: Dict[Optional[Hashable], int] = {}
+        for job in jobs:
+            user = self.user_func(job)
+            added[user] = added.get(user, 0) + 1
+        for user, count in added.items():
+            limit = self.policy.get(user, "max_queued")
+            if limit and self._queued.get(user, 0) + count > limit:
+                return False
+        return True
+
+    def queued_for(self, user: Optional[Hashable]) -> int:
+        return self._queued.get(user, 0)
+
+    def running_for(self, user: Optional[Hashable]) -> int:
+        return self._running.get(user, 0)
+
+    def planned_schedule(self) -> List[Tuple[Any, Optional[Hashable]]]:
+        # Running limits are assumed to free up in time, so the plan is the tag order
+        return [(entry.job, entry.key) for entry in sorted(self._pending, key=lambda entry: entry.rank)]
+
+    def _make_entry(self, job: Any) -> _Entry:
+        entry = super()._make_entry(job)
+        user = self.user_func(job)
+        cost = max(1.0, float(self.cost_func(job)))
+        entry.user = user
+        entry.start = max(self.virtual_time, self._last_finish.get(user, 0.0))
+        finish = entry.start + cost / self.policy.get(user, "weight")
+        self._last_finish[user] = finish
+        self._queued[user] = self._queued.get(user, 0) + 1
+        entry.rank = (self.policy.priority_rank(user), finish, next(self._sequence))
+        return entry
+
+    def _select(self, pending: List[_Entry], current_key: Optional[Hashable]) -> Optional[int]:
+        best = None
+        for index, entry in enumerate(pending):
+            if self._eligible(entry) and (best is None or entry.rank < pending[best].rank):
+                best = index
+        return best
+
+    def _eligible(self, entry: _Entry) -> bool:
+        limit = self.policy.get(entry.user, "max_running")
+        return not limit or self._running.get(entry.user, 0) < limit
+
+    def _has_eligible(self) -> bool:
+        return any(self._eligible(entry) for entry in self._pending)
+
+    def _dispatched(self, entry: _Entry) -> None:
+        user = entry.user
+        self.virtual_time = max(self.virtual_time, entry.start)
+        self._running[user] = self._running.get(user, 0) + 1
+        self._queued[user] -= 1
+        if not self._queued[user]:
+            del self._queued[user]
+            # Tags behind the virtual time no longer matter; forget idle users
+            if self._last_finish.get(user, 0.0) <= self.virtual_time:
+                self._last_finish.pop(user, None)
+
+    def _finished(self, job: Any) -> None:
+        user = self.user_func(job)
+        if self._running.get(user, 0) <= 0:
+            return
+        self._running[user] -= 1
+        if not self._running[user]:
+            del self._running[user]
+        if self._pending:
+            # A job held back by this user's running limit may be able to run now
+            self._wakeup_next()
+
+SCHEDULERS = {
+    "fifo": JobScheduler,
+    "affinity": ModelAffinityScheduler,
+    "fair": FairShareScheduler,
+}
+
+def create_scheduler(name: str, key_func: Optional[Callable[[Any], Optional[Hashable]]] = None, **options) -> JobScheduler:
+    """
+    Instantiates a scheduler by its configured name (e.g. 'fifo', 'affinity').
+    """
+    scheduler_class = SCHEDULERS.get(name.lower())
+    if scheduler_class is None:
+        raise ValueError(f"Unknown job scheduler '{name}'. Available: {', '.join(SCHEDULERS)}")
+    if scheduler_class is JobScheduler:
+        return scheduler_class(key_func)
+    return scheduler_class(key_func, **options)
@@ -0,0 +1,148 @@
+import asyncio
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = ("completed", "failed")
+
+class Job:
+    """
+    A queued generation request. Kept compact because finished jobs stay registered until evicted:
+    the completion event is only allocated when someone waits on it, and the raw message is
+    dropped once the job has finished.
+    """
+    __slots__ = (
+        "id", "raw_message", "nick", "status", "result", "error", "created_at", "finished_at", "model", "images", "_event"
+    )
+
+    def __init__(self, raw_message: str, nick: str):
+        self.id = str(uuid.uuid4())
+        self.raw_message = raw_message
+        self.nick = nick
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        # Model and image count, resolved from the message once when the job is submitted
+        self.model: Optional[str] = None
+        self.images: Optional[int] = None
+        self._event: Optional[asyncio.Event] = None
+
+    @property
+    def event(self) -> asyncio.Event:
+        if self._event is None:
+            self._event = asyncio.Event()
+            if self.finished:
+                self._event.set()
+        return self._event
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def finish(self, status: str, result: Optional[str] = None, error: Optional[str] = None):
+        """
+        Records the outcome, wakes any waiters and releases what is no longer needed.
+        """
+        self.status = status
+        self.result = result
+        self.error = error
+        self.finished_at = time.monotonic()
+        self.raw_message = None
+        if self._event is not None:
+            self._event.set()
+            # Woken waiters keep their own reference; later lookups get a fresh, already-set event
+            self._event = None
+
+class JobStore:
+    """
+    Registry of jobs by id. Queued and running jobs are always kept. Finished jobs are
+    evicted once older than `ttl` seconds, or least recently looked up first when more
+    than `max_finished` are kept. Ids of evicted jobs are remembered (up to `max_expired`)
+    so a lookup can tell an expired job from an unknown id.
+    """
+    def __init__(self, ttl: float = 3600.0, max_finished: int = 1000, max_expired: int = 10000):
+        self.ttl = ttl
+        self.max_finished = max_finished
+        self.max_expired = max_expired
+        self._active: Dict[str, Job] = {}
+        self._finished: "OrderedDict[str, Job]" = OrderedDict()
+        self._expired: "OrderedDict[str, None]" = OrderedDict()
+
+    def __setitem__(self, job_id: str, job: Job):
+        if job.finished:
+            self._finished[job_id] = job
+            self._finished.move_to_end(job_id)
+            self.evict()
+        else:
+            self._active[job_id] = job
+
+    def __getitem__(self, job_id: str) -> Job:
+        job = self.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        return job
+
+    def __contains__(self, job_id: str) -> bool:
+        return self.get(job_id) is not None
+
+    def __len__(self) -> int:
+        return len(self._active) + len(self._finished)
+
+    def __iter__(self) -> Iterator[str]:
+        yield from list(self._active)
+        yield from list(self._finished)
+
+    def get(self, job_id: str, default: Optional[Job] = None) -> Optional[Job]:
+        job = self._active.get(job_id)
+        if job is not None:
+            return job
+        job = self._finished.get(job_id)
+        if job is None:
+            return default
+        if self._is_stale(job, time.monotonic()):
+            self._expire(job_id)
+            return default
+        self._finished.move_to_end(job_id)
+        return job
+
+    def count_by_status(self) -> Dict[str, int]:
+        """
+        Number of registered jobs per status, including finished jobs not yet evicted.
+        """
+        counts: Dict[str, int] = {}
+        for job in list(self._active.values()) + list(self._finished.values()):
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+    def is_expired(self, job_id: str) -> bool:
+        return job_id in self._expired
+
+    def mark_finished(self, job: Job):
+        """
+        Moves a job that just finished into the evictable set.
+        """
+        self._active.pop(job.id, None)
+        self[job.id] = job
+
+    def evict(self):
+        now = time.monotonic()
+        for job_id in [job_id for job_id, job in self._finished.items() if self._is_stale(job, now)]:
+            self._expire(job_id)
+        while len(self._finished) > self.max_finished:
+            self._expire(next(iter(self._finished)))
+
+    def _is_stale(self, job: Job, now: float) -> bool:
+        return job.finished_at is not None and now - job.finished_at > self.ttl
+
+    def _expire(self, job_id: str):
+        self._finished.pop(job_id, None)
+        self._expired[job_id] = None
+        if len(self._expired) > self.max_expired:
+            self._expired.popitem(last=False)
+        logger.debug(f"Evicted finished job {job_id}")
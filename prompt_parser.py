@@ -1,78 +1,155 @@
 import re
 import logging
-from typing import Dict, Any
+from typing import Any, Callable, Dict, Optional, Sequence
 
 logger = logging.getLogger(__name__)
 
+def _integer(minimum: Optional[int] = None, maximum: Optional[int] = None) -> Callable[[str], int]:
+    def convert(value: str) -> int:
+        number = int(value)
+        if (minimum is not None and number < minimum) or (maximum is not None and number > maximum):
+            raise ValueError(f"{number} is outside {minimum}..{maximum}")
+        return number
+    return convert
+
+def _decimal(minimum: float, maximum: float) -> Callable[[str], float]:
+    def convert(value: str) -> float:
+        number = float(value)
+        if not minimum <= number <= maximum:
+            raise ValueError(f"{number} is outside {minimum}..{maximum}")
+        return number
+    return convert
+
+_NAME = re.compile(r"[\w.+-]+")
+
+def _name(value: str) -> str:
+    if not _NAME.fullmatch(value):
+        raise ValueError(f"'{value}' is not a valid name")
+    return value.lower()
+
+_RATIO = re.compile(r"(\d+(?:\.\d+)?)\s*[:x/]\s*(\d+(?:\.\d+)?)")
+
+def _aspect_ratio(value: str) -> float:
+    """
+    Width divided by height, from "16:9", "16x9", "16/9" or "1.78".
+    """
+    match = _RATIO.fullmatch(value)
+    ratio = float(match.group(1)) / float(match.group(2)) if match and float(match.group(2)) else float(value)
+    if not 0.25 <= ratio <= 4:
+        raise ValueError(f"aspect ratio {ratio:.2f} is outside 1:4..4:1")
+    return round(ratio, 4)
+
+class Modifier:
+    """
+    A prompt option: the result key it sets, the flags that set it, how its value is
+    converted, and the value when it is not given.
+    """
+    __slots__ = ("key", "flags", "convert", "default")
+
+    def __init__(self, key: str, flags: Sequence[str], convert: Callable[[str], Any] = str, default: Any = None):
+        self.key = key
+        self.flags = tuple(flags)
+        self.convert = convert
+        self.default = default
+
 class PromptParser:
     """
     Parses user input message into structured image generation parameters.
     Supports various flags (e.g., --width, --height, --model) and their short aliases.
+    Values may be quoted ("..." or '...') to contain text that looks like a flag. When a
+    modifier is given more than once, the last value wins. Unknown --flags are rejected.
     """
-    
-    MODIFIER_MAP = {
-        'width': ['--width', '-w'],
-        'height': ['--height', '-h'],
-        'model': ['--model', '-m'],
-        'negative_prompt': ['--no', '--negative', '-n'],
-        'count': ['--count', '-c'],
-        'seed': ['--seed', '-s']
-    }
+
+    # Every modifier, in one place; the flag table and pattern below are built from it
+    MODIFIERS = (
+        Modifier('width', ['--width', '-w'], _integer()),
+        Modifier('height', ['--height', '-h'], _integer()),
+        Modifier('model', ['--model', '-m']),
+        Modifier('negative_prompt', ['--no', '--negative', '-n']),
+        Modifier('count', ['--count', '-c'], _integer()),
+        Modifier('seed', ['--seed', '-s'], _integer(), default=-1),
+        Modifier('steps', ['--steps'], _integer(1, 200)),
+        Modifier('cfg', ['--cfg'], _decimal(0.0, 30.0)),
+        Modifier('sampler', ['--sampler'], _name),
+        Modifier('scheduler', ['--scheduler'], _name),
+        Modifier('denoise', ['--denoise'], _decimal(0.0, 1.0)),
+        Modifier('aspect_ratio', ['--ar', '--aspect'], _aspect_ratio),
+    )
+
+    # Anything shaped like a flag: a word of one or two dashes and a letter. Patterns start with
+    # a literal character and check the word boundary after it, which lets the regex engine skip
+    # ahead to candidates instead of trying every position of a long message.
+    _FLAG = re.compile(r"(-(?<!\S-)-?[A-Za-z][\w-]*)(?==|\s|$)")
+    # The same with quoted text at a word boundary matched as a whole, so flags inside it are
+    # skipped; only used for messages that open a quote
+    _TOKEN = re.compile(
+        r"""(?:"(?<![^\s=]")(?:[^"\\]|\\.)*"|'(?<![^\s=]')(?:[^'\\]|\\.)*')(?=\s|$)"""
+        r"""|(-(?<!\S-)-?[A-Za-z][\w-]*)(?==|\s|$)"""
+    )
+    _DOUBLE_QUOTE = re.compile(r'"(?<![^\s=]")')
+    _SINGLE_QUOTE = re.compile(r"'(?<![^\s=]')")
+    _FLAGS: Dict[str, Modifier] = {}
+    _DEFAULTS: Dict[str, Any] = {}
+
+    @classmethod
+    def _compile(cls):
+        cls._FLAGS = {flag: modifier for modifier in cls.MODIFIERS for flag in modifier.flags}
+        cls._DEFAULTS = {'prompt': "", **{modifier.key: modifier.default for modifier in cls.MODIFIERS}}
 
     @staticmethod
     def parse_input(input_str: str) -> Dict[str, Any]:
         """
         Parses the input string with modifiers into a structured dict.
+        Raises ValueError for an unknown --flag; a value that does not convert is ignored.
         """
-        result = {
-            'prompt': "",
-            'width': None,
-            'height': None,
-            'model': None,
-            'negative_prompt': None,
-            'count': None,
-            'seed': -1
-        }
-
-        # Flatten all aliases for regex
-        all_aliases = [alias for aliases in PromptParser.MODIFIER_MAP.values() for alias in aliases]
-        alias_pattern = r'(?:^|\s)(' + '|'.join(re.escape(a) for a in all_aliases) + r')(?=[\s=]|$)'
-        
-        matches = list(re.finditer(alias_pattern, input_str))
-        
-        if not matches:
-            result['prompt'] = input_str.strip()
-            return result
+        result = dict(PromptParser._DEFAULTS)
+
+        # Known flags in order; single-dash words that are not flags ("-ish") are prompt text
+        flags = []
+        quoted = ('"' in input_str and PromptParser._DOUBLE_QUOTE.search(input_str)) or \
+            ("'" in input_str and PromptParser._SINGLE_QUOTE.search(input_str))
+        for match in (PromptParser._TOKEN if quoted else PromptParser._FLAG).finditer(input_str):
+            flag = match.group(1)
+            if flag is None:
+                continue
+            modifier = PromptParser._FLAGS.get(flag)
+            if modifier is None:
+                if flag.startswith('--'):
+                    known = ', '.join(PromptParser._FLAGS)
+                    raise ValueError(f"Unknown option '{flag}'. Available: {known}")
+                continue
+            flags.append((modifier, flag, match.start(1), match.end(1)))
 
         # Everything before the first modifier is the prompt
-        result['prompt'] = input_str[:matches[0].start()].strip()
+        result['prompt'] = PromptParser._unquote(input_str[:flags[0][2]] if flags else input_str)
 
-        # Process each modifier
-        for i in range(len(matches)):
-            match = matches[i]
-            flag = match.group(1)
-            start = match.end()
-            
-            # Determine end of value (start of next flag or end of string)
-            end = matches[i+1].start() if i + 1 < len(matches) else len(input_str)
-            value = input_str[start:end].strip()
-            
+        # Each value runs until the next flag
+        for i, (modifier, flag, _, end) in enumerate(flags):
+            value_end = flags[i + 1][2] if i + 1 < len(flags) else len(input_str)
+            value = input_str[end:value_end].strip()
             if value.startswith('='):
                 value = value[1:].strip()
-            
-            PromptParser._apply_modifier(result, flag, value)
+            PromptParser._apply_modifier(result, modifier, flag, PromptParser._unquote(value))
 
         return result
 
     @staticmethod
-    def _apply_modifier(result: Dict, flag: str, value: str):
-        for key, aliases in PromptParser.MODIFIER_MAP.items():
-            if flag in aliases:
-                if key in ['width', 'height', 'count', 'seed']:
-                    try:
-                        result[key] = int(value)
-                    except ValueError:
-                        pass
-                else:
-                    result[key] = value
-                break
+    def _unquote(value: str) -> str:
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+            quote = value[0]
+            return value[1:-1].replace("\\" + quote, quote)
+        return value
+
+    @staticmethod
+    def _apply_modifier(result: Dict, modifier: Modifier, flag: str, value: str):
+        try:
+            converted = modifier.convert(value)
+        except ValueError as e:
+            logger.warning(f"Ignoring {flag} '{value}': {e}")
+            return
+        if result[modifier.key] != modifier.default:
+            logger.debug(f"{flag} given more than once; using the last value")
+        result[modifier.key] = converted
+
+PromptParser._compile()
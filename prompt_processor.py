@@ -1,6 +1,9 @@
+import math
 import random
 import logging
-from typing import Dict, Optional, Any
+from typing import Dict, Optional, Any, Tuple
+
+from workflow_bindings import Binding, apply_bindings, legacy_bindings
 
 logger = logging.getLogger(__name__)
 
@@ -51,67 +54,78 @@ class PromptProcessor:
         prompt_wrapper: Dict,
         model_config: Dict,
         filtered_prompt: Dict,
-        global_defaults: Dict
+        global_defaults: Dict,
+        bindings: Optional[Tuple[Binding, ...]] = None
     ) -> None:
         """
         Maps user-provided prompt data and model-specific configurations 
-        onto the internal ComfyUI workflow nodes.
+        onto the internal ComfyUI workflow nodes, through the workflow's parameter `bindings`
+        (derived from its node ids when not given).
         """
         workflow = prompt_wrapper["workflow"]
-        
-        # Update the workflow data with model configuration
-        if 'Checkpoint' in workflow and model_config.get('checkpointName'):
-            workflow['Checkpoint']['inputs']['ckpt_name'] = model_config['checkpointName']
-
-        if 'UNETLoader' in workflow and model_config.get('unetName'):
-            workflow['UNETLoader']['inputs']['unet_name'] = model_config['unetName']
-
-        if 'CLIPLoader' in workflow and model_config.get('clipName'):
-            workflow['CLIPLoader']['inputs']['clip_name'] = model_config['clipName']
-
-        if 'VAELoader' in workflow and model_config.get('vae'):
-            workflow['VAELoader']['inputs']['vae_name'] = model_config['vae']
-
-        if 'KSampler' in workflow:
-            inputs = workflow['KSampler']['inputs']
-            inputs['steps'] = model_config.get('steps') or global_defaults.get('STEPS', 20)
-            if model_config.get('cfg'):
-                inputs['cfg'] = model_config['cfg']
-            if model_config.get('sampler_name'):
-                inputs['sampler_name'] = model_config['sampler_name']
-            
-            requested_seed = filtered_prompt.get('seed', -1)
-            inputs['seed'] = PromptProcessor.generate_random_seed() if requested_seed == -1 else requested_seed
-
-        if 'EmptyLatentImage' in workflow or 'EmptySD3LatentImage' in workflow:
-            # Handle both node types
-            node_key = 'EmptyLatentImage' if 'EmptyLatentImage' in workflow else 'EmptySD3LatentImage'
-            inputs = workflow[node_key]['inputs']
-            
-            # Priority: User > Model > Global
-            inputs['width'] = filtered_prompt.get('width') or model_config.get('imageWidth') or global_defaults.get('WIDTH', 1024)
-            inputs['height'] = filtered_prompt.get('height') or model_config.get('imageHeight') or global_defaults.get('HEIGHT', 1024)
-            inputs['batch_size'] = filtered_prompt.get('count') or model_config.get('COUNT') or global_defaults.get('COUNT', 1)
+        if bindings is None:
+            bindings = legacy_bindings(workflow)
+        apply_bindings(workflow, bindings, PromptProcessor.resolve_parameters(model_config, filtered_prompt, global_defaults))
+        logger.debug('Workflow updated with model configuration')
 
-        # Handle prompt concatenation
-        if 'PromptConcatenate' in workflow:
-            # If workflow uses PromptConcatenate, update string_a with default prompt and string_b with user prompt
-            workflow['PromptConcatenate']['inputs']['string_a'] = model_config['defaultPositivePrompt']
-            workflow['PromptConcatenate']['inputs']['string_b'] = filtered_prompt.get('prompt') or ''
-        else:
-            # Fallback to direct text assignment for workflows without PromptConcatenate
-            if 'PositivePrompt' in workflow:
-                default_pos = model_config.get('defaultPositivePrompt', '')
-                user_pos = filtered_prompt.get('prompt') or ''
-                workflow['PositivePrompt']['inputs']['text'] = f"{default_pos}, {user_pos}".strip(", ")
+    @staticmethod
+    def resolve_parameters(model_config: Dict, filtered_prompt: Dict, global_defaults: Dict) -> Dict[str, Any]:
+        """
+        Values of the logical workflow parameters (see workflow_bindings.PARAMETERS) for a request.
+        Priority: User > Model > Global. None leaves the workflow's own value.
+        """
+        requested_seed = filtered_prompt.get('seed', -1)
+        width, height = PromptProcessor.resolve_dimensions(model_config, filtered_prompt, global_defaults)
+        default_pos = model_config.get('defaultPositivePrompt', '')
+        user_pos = filtered_prompt.get('prompt') or ''
+        default_neg = model_config.get('defaultNegativePrompt', '')
+        user_neg = filtered_prompt.get('negative_prompt') or ''
+        return {
+            'checkpoint': model_config.get('checkpointName') or None,
+            'unet': model_config.get('unetName') or None,
+            'clip': model_config.get('clipName') or None,
+            'vae': model_config.get('vae') or None,
+            'seed': PromptProcessor.generate_random_seed() if requested_seed == -1 else requested_seed,
+            'steps': filtered_prompt.get('steps') or model_config.get('steps') or global_defaults.get('STEPS', 20),
+            'cfg': filtered_prompt.get('cfg') or model_config.get('cfg') or None,
+            'sampler': filtered_prompt.get('sampler') or model_config.get('sampler_name') or None,
+            'scheduler': filtered_prompt.get('scheduler') or model_config.get('scheduler') or None,
+            'denoise': filtered_prompt.get('denoise'),
+            'width': width,
+            'height': height,
+            'batch_size': filtered_prompt.get('count') or model_config.get('COUNT') or global_defaults.get('COUNT', 1),
+            'prompt': user_pos,
+            'default_prompt': default_pos,
+            'positive_prompt': f"{default_pos}, {user_pos}".strip(", "),
+            'negative_prompt': f"nsfw, nude, {default_neg}, {user_neg}".strip(", "),
+        }
 
-        # Update negative prompt
-        if 'NegativePrompt' in workflow:
-            default_neg = model_config.get('defaultNegativePrompt', '')
-            user_neg = filtered_prompt.get('negative_prompt') or ''
-            workflow['NegativePrompt']['inputs']['text'] = f"nsfw, nude, {default_neg}, {user_neg}".strip(", ")
+    @staticmethod
+    def resolve_dimensions(model_config: Dict, filtered_prompt: Dict, global_defaults: Dict) -> Tuple[int, int]:
+        """
+        Latent width and height for a request. Priority: User > Model > Global. An aspect ratio
+        derives the missing side from a given one, or otherwise keeps the model's pixel count.
+        """
+        width = filtered_prompt.get('width')
+        height = filtered_prompt.get('height')
+        default_width = model_config.get('imageWidth') or global_defaults.get('WIDTH', 1024)
+        default_height = model_config.get('imageHeight') or global_defaults.get('HEIGHT', 1024)
+        ratio = filtered_prompt.get('aspect_ratio')
+        if ratio and not (width and height):
+            if width:
+                height = PromptProcessor._snap(width / ratio)
+            elif height:
+                width = PromptProcessor._snap(height * ratio)
+            else:
+                area = default_width * default_height
+                width = PromptProcessor._snap(math.sqrt(area * ratio))
+                height = PromptProcessor._snap(math.sqrt(area / ratio))
+        return width or default_width, height or default_height
 
-        logger.debug('Workflow updated with model configuration')
+    @staticmethod
+    def _snap(size: float) -> int:
+        # Latent sizes must be multiples of 8; 64 keeps them friendly to every model family
+        return max(64, int(round(size / 64)) * 64)
 
     @staticmethod
     def generate_random_seed() -> int:
@@ -0,0 +1,261 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from filename_utils import get_derivative_path
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+CACHE_REQUESTS = REGISTRY.counter(
+    "result_cache_requests_total", "Result cache lookups by outcome", ["result"]
+)
+CACHE_EVICTIONS = REGISTRY.counter(
+    "result_cache_evictions_total", "Cached results deleted to stay within the size bounds"
+)
+CACHE_BYTES = REGISTRY.gauge(
+    "result_cache_bytes", "Disk space used by cached results"
+)
+CACHE_ENTRIES = REGISTRY.gauge(
+    "result_cache_entries", "Number of cached results"
+)
+
+def cache_key(workflow: Dict, output_options: Optional[Dict] = None) -> str:
+    """
+    Canonical hash of a fully materialized workflow plus the options that shape its output files.
+    """
+    canonical = json.dumps(
+        {"workflow": workflow, "output": output_options or {}},
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+# A content-addressed result or one of its companions
+CONTENT_ADDRESSED = re.compile(r"^[0-9a-f]{64}(_\w+)?\.\w+$")
+
+def content_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class _CacheEntry:
+    __slots__ = ("path", "files")
+
+    def __init__(self, path: str, files: List[str]):
+        self.path = path
+        self.files = files
+
+class ResultCache:
+    """
+    Maps the hash of a deterministic request to the result it produced. Results are
+    renamed after the hash of their content, together with their derivatives, so identical
+    outputs share one file on disk. Least recently used results are deleted once the
+    cached files exceed `max_bytes` or there are more than `max_entries` of them.
+    With `index_path`, the index is saved there and reloaded on startup; content-addressed
+    files in its directory that no saved result references are deleted. An unreadable index
+    is set aside and no files are deleted.
+    """
+    def __init__(
+        self, max_bytes: int, max_entries: int = 1000, companions: Sequence[str] = (),
+        index_path: Optional[str] = None
+    ):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        # Derivative names stored next to a result, moved and evicted along with it
+        self.companions = list(companions)
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        # Entries referencing each file and its size, so deduplicated files are counted and deleted once
+        self._refs: Dict[str, int] = {}
+        self._sizes: Dict[str, int] = {}
+        self.total_bytes = 0
+        self.index_path = index_path
+        # Index writes requested while one is running collapse into one more write
+        self._flushing = False
+        self._dirty = False
+        if index_path:
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str, record_miss: bool = True) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is not None and not os.path.exists(entry.path):
+            # Deleted behind our back
+            self._remove(key, delete_files=False)
+            entry = None
+        if entry is None:
+            if record_miss:
+                CACHE_REQUESTS.inc(result="miss")
+            return None
+        self._entries.move_to_end(key)
+        CACHE_REQUESTS.inc(result="hit")
+        logger.info(f"Result cache hit: {os.path.basename(entry.path)}")
+        return entry.path
+
+    def content_address(self, path: str, tiles: Sequence[str] = ()) -> Tuple[str, List[str]]:
+        """
+        Renames a freshly generated result and its companions after the hash of the result's
+        content and returns the new result path and every file now belonging to it, including
+        the grid's `tiles`, which keep their names. An identical file already on disk is reused.
+        Blocking; run it off the event loop.
+        """
+        directory = os.path.dirname(path)
+        extension = os.path.splitext(path)[1]
+        target = os.path.join(directory, content_hash(path) + extension)
+
+        files = []
+        for name in [None] + self.companions:
+            source = path if name is None else get_derivative_path(path, name)
+            destination = target if name is None else get_derivative_path(target, name)
+            if not os.path.exists(source):
+                continue
+            if os.path.exists(destination):
+                os.remove(source)
+            else:
+                os.replace(source, destination)
+            files.append(destination)
+        files += [tile for tile in tiles if os.path.exists(tile)]
+        return target, files
+
+    def put(self, key: str, path: str, files: List[str]):
+        """
+        Records a content-addressed result under `key` and evicts old results if needed.
+        Call `flush()` afterwards to save the index.
+        """
+        self._add(key, path, files)
+        self.evict()
+
+    def _add(self, key: str, path: str, files: List[str]):
+        for f in files:
+            if f not in self._refs:
+                self._refs[f] = 0
+                self._sizes[f] = os.path.getsize(f)
+                self.total_bytes += self._sizes[f]
+            self._refs[f] += 1
+        if key in self._entries:
+            # Files shared with the new result are still referenced and survive this
+            self._remove(key, delete_files=True)
+        self._entries[key] = _CacheEntry(path, files)
+
+    def evict(self):
+        # The most recent result is always kept, even when it alone exceeds the bound
+        while len(self._entries) > 1 and (self.total_bytes > self.max_bytes or len(self._entries) > self.max_entries):
+            self._remove(next(iter(self._entries)), delete_files=True)
+            CACHE_EVICTIONS.inc()
+        self._update_gauges()
+
+    def save(self):
+        """
+        Writes the index to `index_path`, least recently used first. Blocking; see `flush()`.
+        """
+        if self.index_path:
+            self._write(self._snapshot())
+
+    async def flush(self):
+        """
+        Saves the index from a worker thread. While a write is running, further calls only
+        make it write once more afterwards.
+        """
+        if not self.index_path:
+            return
+        self._dirty = True
+        if self._flushing:
+            return
+        self._flushing = True
+        try:
+            while self._dirty:
+                self._dirty = False
+                await asyncio.to_thread(self._write, self._snapshot())
+        finally:
+            self._flushing = False
+
+    def _snapshot(self) -> List:
+        return [[key, entry.path, list(entry.files)] for key, entry in self._entries.items()]
+
+    def _write(self, entries: List):
+        temp_path = self.index_path + ".tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"entries": entries}, f)
+            os.replace(temp_path, self.index_path)
+        except OSError as e:
+            logger.warning(f"Could not save result cache index {self.index_path}: {e}")
+
+    def load(self):
+        """
+        Restores the index from `index_path`, skipping results deleted since, and deletes the
+        content-addressed files it no longer references so they do not escape the size bound.
+        An unreadable index is renamed aside and the cache starts empty, leaving every file in place.
+        """
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                entries = json.load(f)["entries"]
+            for key, path, files in entries:
+                if os.path.exists(path):
+                    self._add(key, path, [f for f in files if os.path.exists(f)])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self._entries.clear()
+            self._refs.clear()
+            self._sizes.clear()
+            self.total_bytes = 0
+            self._quarantine_index(e)
+            self._update_gauges()
+            return
+
+        referenced = {os.path.normpath(f) for f in self._refs}
+        directory = os.path.dirname(self.index_path) or "."
+        orphans = 0
+        for name in os.listdir(directory) if os.path.isdir(directory) else []:
+            path = os.path.join(directory, name)
+            if CONTENT_ADDRESSED.match(name) and os.path.normpath(path) not in referenced:
+                try:
+                    os.remove(path)
+                    orphans += 1
+                except OSError as e:
+                    logger.warning(f"Could not delete untracked cached result {path}: {e}")
+        self.evict()
+        logger.info(
+            f"Result cache loaded {len(self._entries)} results ({self.total_bytes} bytes), "
+            f"deleted {orphans} untracked files"
+        )
+
+    def _quarantine_index(self, error: Exception):
+        quarantine_path = self.index_path + ".corrupt"
+        try:
+            os.replace(self.index_path, quarantine_path)
+            logger.warning(
+                f"Could not load result cache index {self.index_path}: {error}; moved it to {quarantine_path}, "
+                f"cached files are kept but untracked"
+            )
+        except OSError as e:
+            logger.warning(f"Could not load result cache index {self.index_path}: {error}; nor move it aside: {e}")
+
+    def _remove(self, key: str, delete_files: bool):
+        entry = self._entries.pop(key)
+        for f in entry.files:
+            self._refs[f] -= 1
+            if self._refs[f] > 0:
+                continue
+            del self._refs[f]
+            self.total_bytes -= self._sizes.pop(f)
+            if delete_files:
+                try:
+                    os.remove(f)
+                except OSError as e:
+                    logger.warning(f"Could not delete cached result {f}: {e}")
+        logger.debug(f"Dropped cached result {os.path.basename(entry.path)}")
+        self._update_gauges()
+
+    def _update_gauges(self):
+        CACHE_BYTES.set(self.total_bytes)
+        CACHE_ENTRIES.set(len(self._entries))
@@ -2,7 +2,7 @@ import os
 import asyncio
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, AsyncMock, MagicMock
 
 # Set environment variable before importing app
 os.environ["WEB_DOMAIN"] = "https://test.domain"
@@ -87,3 +87,329 @@ async def test_worker_logic_with_domain():
                 pass
         
         assert job.result == f"{WEB_DOMAIN}/image.webp"
+
+def test_models_and_metrics_endpoints():
+    response = client.get("/models")
+    assert response.status_code == 200
+    assert "paSanctuary" in response.json()["models"]
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "config_reloads_total" in response.text
+    assert "service_queue_depth " in response.text
+    assert "service_active_jobs " in response.text
+
+def test_events_stream_for_finished_job():
+    from app import jobs, Job
+    job = Job("prompt", "nick")
+    job.status = "completed"
+    job.result = "https://test.domain/done.webp"
+    job.event.set()
+    jobs[job.id] = job
+
+    response = client.get(f"/events/{job.id}")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert "event: completed" in response.text
+    assert "done.webp" in response.text
+    assert client.get("/events/unknown").status_code == 404
+
+@pytest.mark.asyncio
+async def test_worker_publishes_progress_events():
+    from app import worker, queue, jobs, events, Job
+
+    async def fake_generate(filtered_prompt, on_event=None):
+        on_event("progress", {"node": "KSampler", "value": 5, "max": 20})
+        return "/path/to/image.webp"
+
+    with patch("app.generator.generate_image", side_effect=fake_generate):
+        job = Job("test prompt", "tester")
+        jobs[job.id] = job
+        subscription = events.subscribe(job.id)
+        with patch.object(queue, 'get', side_effect=[job, asyncio.CancelledError()]), patch.object(queue, 'task_done'):
+            try:
+                await worker()
+            except asyncio.CancelledError:
+                pass
+
+    received = [subscription.get_nowait()[0] for _ in range(subscription.qsize())]
+    assert received == ["processing", "progress", "completed"]
+    events.unsubscribe(job.id, subscription)
+
+def test_expired_job_returns_410():
+    from app import jobs
+    from job_store import Job
+    job = Job("prompt", "nick")
+    job.finish("completed", result="done.webp")
+    jobs[job.id] = job
+    jobs._expire(job.id)
+
+    response = client.get(f"/job/{job.id}")
+    assert response.status_code == 410
+    assert response.json()["detail"] == "Job expired"
+    assert client.get("/job/not-a-real-id").status_code == 404
+
+@pytest.mark.asyncio
+async def test_restore_jobs_requeues_unfinished_work(tmp_path):
+    from app import restore_jobs, queue, jobs
+    from job_journal import JobJournal
+    from job_store import Job
+
+    journal = JobJournal(str(tmp_path / "jobs.db"))
+    journal.open()
+    queued, running, done = Job("queued prompt", "a"), Job("running prompt", "b"), Job("done prompt", "c")
+    running.status = "processing"
+    done.finish("completed", result="https://test.domain/done.webp")
+    journal.record(queued)
+    journal.record(running, prompt_id="old-prompt")
+    journal.record(done)
+    await journal.flush()
+
+    with patch("app.generator.pool.delete_queued_prompts") as mock_delete, patch.object(queue, "put") as mock_put:
+        await restore_jobs(journal)
+
+    assert [call.args[0].id for call in mock_put.call_args_list] == [queued.id, running.id]
+    mock_delete.assert_called_once_with(["old-prompt"])
+    assert jobs[done.id].result == "https://test.domain/done.webp"
+    assert jobs[running.id].status == "queued"
+    await journal.close()
+
+def test_job_state_lists_derivative_urls():
+    from app import jobs
+    from job_store import Job
+    job = Job("prompt", "nick")
+    job.finish("completed", result="https://test.domain/123_abc_1.webp")
+    jobs[job.id] = job
+
+    with patch("app.IMAGE_DERIVATIVES", {"thumb": 256}):
+        response = client.get(f"/job/{job.id}")
+
+    assert response.json()["derivatives"] == {"thumb": "https://test.domain/123_abc_1_thumb.webp"}
+
+@pytest.mark.asyncio
+async def test_identical_seeded_requests_share_one_execution():
+    from app import worker, queue, jobs, submit
+    from job_store import Job
+
+    primary, duplicate, other = Job("a cat --seed 7", "a"), Job("a cat -s 7", "b"), Job("a cat", "c")
+    with patch.object(queue, "put") as mock_put:
+        assert await submit(primary) is None
+        assert await submit(duplicate) is primary
+        assert await submit(other) is None
+    assert [call.args[0] for call in mock_put.call_args_list] == [primary, other]
+
+    with patch("app.generator.generate_image", return_value="/path/to/cat.webp") as mock_gen, \
+            patch.object(queue, 'get', side_effect=[primary, asyncio.CancelledError()]), patch.object(queue, 'task_done'):
+        try:
+            await worker()
+        except asyncio.CancelledError:
+            pass
+
+    mock_gen.assert_called_once()
+    assert jobs[duplicate.id].status == "completed"
+    assert jobs[duplicate.id].result == primary.result
+    assert duplicate.nick == "b"
+
+@pytest.mark.asyncio
+async def test_batch_merges_identical_prompts_and_splits_results():
+    from app import worker, queue, jobs, submit_batch, batch_job_state
+    from job_store import Job
+
+    first, second, other = Job("a dog --count 2", "a"), Job("a dog --count 3", "b"), Job("a bird", "c")
+    with patch.object(queue, "put_many") as mock_put_many:
+        primaries = await submit_batch([first, second, other])
+    assert primaries == [None, first, None]
+    assert mock_put_many.call_args.args[0] == [first, other]
+
+    with patch("app.generator.generate_batch", return_value=["/out/a_grid.webp", "/out/b_grid.webp"]) as mock_batch, \
+            patch.object(queue, 'get', side_effect=[first, asyncio.CancelledError()]), patch.object(queue, 'task_done'):
+        try:
+            await worker()
+        except asyncio.CancelledError:
+            pass
+
+    assert mock_batch.call_args.args[1] == [2, 3]
+    assert jobs[first.id].result == "https://test.domain/a_grid.webp"
+    assert jobs[second.id].result == "https://test.domain/b_grid.webp"
+    assert batch_job_state(second.id)["status"] == "completed"
+
+def test_batch_endpoints():
+    from app import jobs, queue
+
+    with patch.object(queue, "put_many"):
+        response = client.post("/request/batch", json={"requests": [
+            {"message": "a fox --seed 3", "nick": "a"}, {"message": "a fox --seed 3", "nick": "b"}
+        ]})
+    assert response.status_code == 200
+    body = response.json()
+    assert len(body["jobs"]) == 2
+    assert body["jobs"][0]["queue_position"] == body["jobs"][1]["queue_position"]
+
+    for entry in body["jobs"]:
+        jobs[entry["job_id"]].finish("completed", result="https://test.domain/fox.webp")
+    response = client.get(f"/batch/{body['batch_id']}/wait")
+    assert [job["status"] for job in response.json()["jobs"]] == ["completed", "completed"]
+
+    response = client.get(f"/batch/{body['batch_id']}/events")
+    assert response.text.count("event: result") == 2
+    assert "event: done" in response.text
+
+    assert client.get("/batch/unknown").status_code == 404
+    assert client.post("/request/batch", json={"requests": []}).status_code == 422
+
+def test_request_reports_estimated_start_and_enforces_queue_limit():
+    import time
+    from app import queue
+
+    response = client.post("/request", json={"message": "a heron", "nick": "tester"})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["estimated_start"] >= time.time() - 5
+    assert body["estimated_completion"] > body["estimated_start"]
+    state = client.get(f"/job/{body['job_id']}").json()
+    assert state["status"] == "queued"
+    assert state["estimated_completion"] > state["estimated_start"]
+    # No worker runs in these tests; take the job back off the queue
+    job_id = response.json()["job_id"]
+    for job, key in queue.planned_schedule():
+        if job.id == job_id:
+            queue.take_matching(key, lambda queued: queued.id == job_id, 1)
+            queue.task_done(job)
+
+    with patch.object(queue, "admits", return_value=False):
+        response = client.post("/request", json={"message": "a heron", "nick": "tester"})
+    assert response.status_code == 429
+
+def test_queued_jobs_are_parsed_once():
+    from app import queue, queue_estimates
+    from prompt_parser import PromptParser
+
+    with patch("app.PromptParser.parse_input", side_effect=PromptParser.parse_input) as mock_parse:
+        response = client.post("/request", json={"message": "a crane --count 3", "nick": "tester"})
+        job_id = response.json()["job_id"]
+        for _ in range(3):
+            client.get(f"/job/{job_id}")
+            queue_estimates()
+    assert mock_parse.call_count == 1
+
+    for job, key in queue.planned_schedule():
+        if job.id == job_id:
+            assert (job.model, job.images) == (key, 3)
+            queue.take_matching(key, lambda queued: queued.id == job_id, 1)
+            queue.task_done(job)
+
+def test_cached_result_completes_without_queueing():
+    with patch("app.generator.cached_result", return_value="/path/to/output/cached.webp"), \
+            patch("app.queue.put") as mock_put:
+        response = client.post("/request", json={"message": "a crane --seed 7", "nick": "tester"})
+    assert response.json()["queue_position"] == 0
+    mock_put.assert_not_called()
+
+    data = client.get(f"/job/{response.json()['job_id']}").json()
+    assert data["status"] == "completed"
+    assert data["result"] == "https://test.domain/cached.webp"
+
+@pytest.mark.asyncio
+async def test_worker_traces_sampled_jobs():
+    import app as service
+    from tracing import Tracer
+    from app import worker, queue, Job, register
+
+    class Collect:
+        def __init__(self):
+            self.spans = []
+
+        async def export(self, spans, resource):
+            self.spans.extend(spans)
+
+    async def fake_generate(filtered_prompt, on_event=None):
+        on_event("started", {"prompt_id": "p1", "model": "m", "backend": "gpu1:8188"})
+        on_event("executing", {"node": "KSampler"})
+        return "/path/to/image.webp"
+
+    exporter = Collect()
+    with patch.object(service, "tracer", Tracer(1.0, exporters=[exporter])), \
+            patch("app.generator.generate_image", side_effect=fake_generate):
+        job = Job("traced prompt", "tester")
+        register(job)
+        with patch.object(queue, 'get', side_effect=[job, asyncio.CancelledError()]), patch.object(queue, 'task_done'):
+            try:
+                await worker()
+            except asyncio.CancelledError:
+                pass
+        await service.tracer.flush()
+
+    names = [span["name"] for span in exporter.spans]
+    assert names[-1] == "job" and "queue_wait" in names and "parse" in names
+    root = exporter.spans[-1]
+    assert root["events"][0]["name"] == "executing"
+    assert {"key": "backend", "value": {"stringValue": "gpu1:8188"}} in root["attributes"]
+
+@pytest.mark.asyncio
+async def test_prewarm_tasks_are_kept_until_done():
+    import app as service
+    from vram_policy import VramDecision
+
+    release = asyncio.Event()
+
+    async def prewarm(model, backend, timeout=None):
+        await release.wait()
+
+    async def wait_for_put(timeout):
+        await asyncio.sleep(0.01)
+
+    backend = service.generator.pool.backends[0]
+    decision = VramDecision("prewarm", backend, "model1", "forecast")
+    with patch.object(service.queue, "wait_for_put", side_effect=wait_for_put), \
+            patch.object(service.vram_policy, "decide", return_value=[decision]), \
+            patch.object(service.generator, "prewarm", side_effect=prewarm):
+        policy_task = asyncio.create_task(service.run_vram_policy())
+        while not service.prewarm_tasks:
+            await asyncio.sleep(0.01)
+        policy_task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await policy_task
+        tasks = set(service.prewarm_tasks)
+        # Reserved while it runs, so the repeated decision started no second prewarm
+        assert len(tasks) == 1 and backend.in_flight == 1
+        release.set()
+        await asyncio.gather(*tasks)
+    assert not service.prewarm_tasks
+    assert backend.in_flight == 0
+
+@pytest.mark.asyncio
+async def test_vram_policy_skips_unload_of_backend_taken_by_a_job():
+    import app as service
+    from vram_policy import VramDecision
+
+    backend = service.generator.pool.backends[0]
+    backend.loaded_model = "model1"
+    decision = VramDecision("unload", backend, "model1", "idle")
+    picked_up = asyncio.Event()
+
+    async def wait_for_put(timeout):
+        if picked_up.is_set():
+            await asyncio.Event().wait()
+        await asyncio.sleep(0.01)
+
+    def decide(backends, queued_models):
+        # A worker acquires the backend right after the decision was made
+        backend.in_flight += 1
+        picked_up.set()
+        return [decision]
+
+    try:
+        with patch.object(service.queue, "wait_for_put", side_effect=wait_for_put), \
+                patch.object(service.vram_policy, "decide", side_effect=decide), \
+                patch.object(backend.client, "unload_models", new_callable=AsyncMock) as unload_models:
+            policy_task = asyncio.create_task(service.run_vram_policy())
+            await picked_up.wait()
+            await asyncio.sleep(0.02)
+            policy_task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await policy_task
+        unload_models.assert_not_awaited()
+        assert backend.loaded_model == "model1"
+    finally:
+        backend.in_flight = 0
+        backend.loaded_model = None
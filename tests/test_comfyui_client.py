@@ -1,8 +1,7 @@
 import pytest
 import asyncio
-import json
 from unittest.mock import patch, MagicMock, AsyncMock
-from comfyui_client import ComfyUIClient
+from comfyui_client import ComfyUIClient, create_http_session
 
 @patch("aiohttp.ClientSession.post")
 @pytest.mark.asyncio
@@ -42,23 +41,6 @@ async def test_connect_websocket(mock_connect):
     assert ws == mock_ws
     assert client.ws == mock_ws
 
-@pytest.mark.asyncio
-async def test_get_images_from_websocket():
-    client = ComfyUIClient("localhost", 8188)
-    client.ws = AsyncMock()
-    
-    # Sequence of messages: executing node, binary image data, executing None (done)
-    messages = [
-        json.dumps({"type": "executing", "data": {"node": "SaveImageWebsocket", "prompt_id": "id123"}}),
-        b'\x00\x00\x00\x00\x00\x00\x00\x00fake-image-data', # 8 byte header + data
-        json.dumps({"type": "executing", "data": {"node": None, "prompt_id": "id123"}})
-    ]
-    client.ws.recv.side_effect = messages
-    
-    images = await client.get_images_from_websocket("id123")
-    assert "SaveImageWebsocket" in images
-    assert images["SaveImageWebsocket"][0] == b"fake-image-data"
-
 @patch("aiohttp.ClientSession.post")
 @pytest.mark.asyncio
 async def test_unload_models(mock_post):
@@ -71,3 +53,29 @@ async def test_unload_models(mock_post):
     mock_post.assert_called_once()
     # Ensure it called /free
     assert "/free" in mock_post.call_args[0][0]
+
+    mock_response.status = 500
+    mock_response.text.return_value = "busy"
+    with pytest.raises(Exception, match=r"\[ComfyUI API Error\] Failed to unload models"):
+        await client.unload_models()
+
+@pytest.mark.asyncio
+async def test_shared_session_is_reused():
+    session = create_http_session(limit=4, keepalive_timeout=15, total_timeout=30)
+    assert session.connector.limit == 4
+    assert session.timeout.total == 30
+
+    mock_response = AsyncMock()
+    mock_response.status = 200
+    mock_response.json.return_value = {"prompt_id": "shared-id"}
+    with patch.object(session, "post") as mock_post:
+        mock_post.return_value.__aenter__.return_value = mock_response
+        first = ComfyUIClient("localhost", 8188, session=session)
+        second = ComfyUIClient("localhost", 8188, session=session)
+        assert await first.queue_prompt({"test": "prompt"}) == "shared-id"
+        await second.unload_models()
+        assert mock_post.call_count == 2
+
+    # Clients never close a session they were given
+    assert not session.closed
+    await session.close()
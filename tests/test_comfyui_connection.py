@@ -0,0 +1,221 @@
+import asyncio
+import json
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from comfyui_connection import ComfyUIConnection
+
+HEADER = b'\x00\x00\x00\x00\x00\x00\x00\x00'
+
+class FakeWebSocket:
+    """Async-iterable stand-in for a websockets connection fed from a queue."""
+    def __init__(self):
+        self.messages = asyncio.Queue()
+
+    def feed(self, *messages):
+        for message in messages:
+            self.messages.put_nowait(message)
+
+    def disconnect(self):
+        self.messages.put_nowait(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self.messages.get()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+def executing(prompt_id, node):
+    return json.dumps({"type": "executing", "data": {"node": node, "prompt_id": prompt_id}})
+
+def make_connection(*sockets):
+    client = MagicMock()
+    client.ws = None
+    remaining = list(sockets)
+
+    async def connect():
+        client.ws = remaining.pop(0)
+        return client.ws
+
+    async def close():
+        client.ws = None
+
+    client.connect_websocket = AsyncMock(side_effect=connect)
+    client.close = AsyncMock(side_effect=close)
+    client.get_queue = AsyncMock(return_value={"queue_running": [], "queue_pending": []})
+    client.get_history = AsyncMock(return_value={})
+    client.delete_queued_prompts = AsyncMock()
+    client.interrupt = AsyncMock()
+    return ComfyUIConnection(client, reconnect_delay=0.01)
+
+@pytest.mark.asyncio
+async def test_routes_binary_frames_to_executing_prompt():
+    ws = FakeWebSocket()
+    connection = make_connection(ws)
+    await connection.start()
+
+    first = asyncio.create_task(connection.wait_for_images("p1"))
+    second = asyncio.create_task(connection.wait_for_images("p2"))
+    ws.feed(
+        executing("p1", "SaveImageWebsocket"), HEADER + b"one",
+        executing("p1", None),
+        executing("p2", "KSampler"),
+        executing("p2", "SaveImageWebsocket"), HEADER + b"two", HEADER + b"three",
+        executing("p2", None),
+    )
+
+    assert await asyncio.wait_for(first, 1) == {"SaveImageWebsocket": [b"one"]}
+    assert await asyncio.wait_for(second, 1) == {"SaveImageWebsocket": [b"two", b"three"]}
+    await connection.close()
+
+@pytest.mark.asyncio
+async def test_prompt_finished_before_waiting():
+    ws = FakeWebSocket()
+    connection = make_connection(ws)
+    await connection.start()
+
+    ws.feed(executing("fast", "SaveImageWebsocket"), HEADER + b"img", executing("fast", None))
+    await asyncio.sleep(0.01)
+
+    assert await connection.wait_for_images("fast", timeout=1) == {"SaveImageWebsocket": [b"img"]}
+    await connection.close()
+
+@pytest.mark.asyncio
+async def test_execution_error_fails_waiter():
+    ws = FakeWebSocket()
+    connection = make_connection(ws)
+    await connection.start()
+
+    waiter = asyncio.create_task(connection.wait_for_images("bad"))
+    ws.feed(json.dumps({"type": "execution_error", "data": {"prompt_id": "bad", "exception_message": "OOM"}}))
+
+    with pytest.raises(Exception) as cm:
+        await asyncio.wait_for(waiter, 1)
+    assert "OOM" in str(cm.value)
+    await connection.close()
+
+@pytest.mark.asyncio
+async def test_failed_prompt_leaves_no_state_behind():
+    ws = FakeWebSocket()
+    connection = make_connection(ws)
+    await connection.start()
+
+    waiter = asyncio.create_task(connection.wait_for_images("bad"))
+    ws.feed(
+        executing("bad", "KSampler"),
+        json.dumps({"type": "execution_error", "data": {"prompt_id": "bad", "exception_message": "OOM"}}),
+    )
+    with pytest.raises(Exception, match="OOM"):
+        await asyncio.wait_for(waiter, 1)
+    assert connection._running_prompt is None
+
+    # ComfyUI ends every prompt with this, failed ones included
+    ws.feed(executing("bad", None))
+    await asyncio.sleep(0.01)
+    assert "bad" not in connection._prompts
+    assert not connection._abandoned
+    await connection.close()
+
+@pytest.mark.asyncio
+async def test_reconnects_and_keeps_queued_prompts():
+    first_ws, second_ws = FakeWebSocket(), FakeWebSocket()
+    connection = make_connection(first_ws, second_ws)
+    await connection.start()
+
+    interrupted = asyncio.create_task(connection.wait_for_images("running"))
+    queued = asyncio.create_task(connection.wait_for_images("queued"))
+    connection.client.get_queue.return_value = {"queue_running": [], "queue_pending": [[1, "queued", {}, {}, []]]}
+    first_ws.feed(executing("running", "KSampler"))
+    first_ws.disconnect()
+
+    with pytest.raises(Exception) as cm:
+        await asyncio.wait_for(interrupted, 1)
+    assert "Connection lost" in str(cm.value)
+
+    second_ws.feed(executing("queued", "SaveImageWebsocket"), HEADER + b"img", executing("queued", None))
+    assert await asyncio.wait_for(queued, 1) == {"SaveImageWebsocket": [b"img"]}
+    assert connection.client.connect_websocket.call_count == 2
+    await connection.close()
+
+@pytest.mark.asyncio
+async def test_reconnect_fails_prompts_the_server_dropped():
+    first_ws, second_ws = FakeWebSocket(), FakeWebSocket()
+    connection = make_connection(first_ws, second_ws)
+    await connection.start()
+
+    # ComfyUI restarted with an empty queue and no record of either prompt
+    dropped = asyncio.create_task(connection.wait_for_images("dropped"))
+    finished = asyncio.create_task(connection.wait_for_images("finished"))
+    await asyncio.sleep(0)
+    connection.client.get_history.side_effect = lambda prompt_id: {"finished": {}} if prompt_id == "finished" else {}
+    first_ws.disconnect()
+
+    with pytest.raises(Exception, match="dropped by ComfyUI"):
+        await asyncio.wait_for(dropped, 1)
+    with pytest.raises(Exception, match="finished while the connection was lost"):
+        await asyncio.wait_for(finished, 1)
+    await connection.close()
+
+@pytest.mark.asyncio
+async def test_wait_for_images_times_out():
+    connection = make_connection(FakeWebSocket())
+    await connection.start()
+    with pytest.raises(Exception, match=r"\[ComfyUI Timeout Error\]"):
+        await connection.wait_for_images("stuck", timeout=0.01)
+    assert "stuck" not in connection._prompts
+    connection.client.delete_queued_prompts.assert_awaited_once_with(["stuck"])
+    connection.client.interrupt.assert_not_awaited()
+    await connection.close()
+
+@pytest.mark.asyncio
+async def test_timeout_interrupts_running_prompt():
+    connection = make_connection(FakeWebSocket())
+    connection.client.get_queue.return_value = {"queue_running": [[0, "stuck", {}]], "queue_pending": []}
+    await connection.start()
+    with pytest.raises(Exception, match=r"\[ComfyUI Timeout Error\]"):
+        await connection.wait_for_images("stuck", timeout=0.01)
+    connection.client.interrupt.assert_awaited_once_with("stuck")
+    await connection.close()
+
+@pytest.mark.asyncio
+async def test_drops_output_of_timed_out_prompt():
+    ws = FakeWebSocket()
+    connection = make_connection(ws)
+    await connection.start()
+    with pytest.raises(Exception, match=r"\[ComfyUI Timeout Error\]"):
+        await connection.wait_for_images("p1", timeout=0.01)
+
+    second = asyncio.create_task(connection.wait_for_images("p2"))
+    ws.feed(
+        executing("p1", "SaveImageWebsocket"), HEADER + b"late",
+        executing("p1", None),
+        executing("p2", "SaveImageWebsocket"), HEADER + b"two",
+        executing("p2", None),
+    )
+
+    assert await asyncio.wait_for(second, 1) == {"SaveImageWebsocket": [b"two"]}
+    assert "p1" not in connection._prompts
+    assert not connection._abandoned
+    await connection.close()
+
+@pytest.mark.asyncio
+async def test_streams_image_frames_to_listener():
+    ws = FakeWebSocket()
+    connection = make_connection(ws)
+    await connection.start()
+
+    received = []
+    waiter = asyncio.create_task(
+        connection.wait_for_images("p1", on_image=lambda node, data: received.append((node, data)))
+    )
+    await asyncio.sleep(0)
+    ws.feed(
+        executing("p1", "SaveImageWebsocket"), HEADER + b"one", HEADER + b"two",
+        executing("p1", None),
+    )
+
+    assert await asyncio.wait_for(waiter, 1) == {}
+    assert received == [("SaveImageWebsocket", b"one"), ("SaveImageWebsocket", b"two")]
+    await connection.close()
@@ -0,0 +1,179 @@
+import asyncio
+import pytest
+from comfyui_pool import ComfyUIPool, parse_backends
+from fake_comfyui import FakeComfyUI
+
+def make_prompt(checkpoint):
+    return {
+        "Checkpoint": {"inputs": {"ckpt_name": checkpoint}, "class_type": "CheckpointLoaderSimple"},
+        "EmptyLatentImage": {"inputs": {"width": 64, "height": 64, "batch_size": 2}, "class_type": "EmptyLatentImage"},
+        "KSampler": {"inputs": {}, "class_type": "KSampler"},
+        "SaveImageWebsocket": {"inputs": {}, "class_type": "SaveImageWebsocket"},
+    }
+
+async def run_job(pool, model):
+    async with pool.acquire(model) as backend:
+        prompt_id = await backend.client.queue_prompt(make_prompt(model))
+        images = await backend.connection.wait_for_images(prompt_id, timeout=5)
+    return backend, images
+
+def test_parse_backends():
+    assert parse_backends("gpu1:8188, gpu2:9000,gpu3") == [("gpu1", 8188), ("gpu2", 9000), ("gpu3", 8188)]
+    assert parse_backends("") == []
+
+def test_select_prefers_warm_then_least_loaded():
+    pool = ComfyUIPool([("a", 1), ("b", 2), ("c", 3)])
+    a, b, c = pool.backends
+    b.loaded_model = "sdxl"
+    assert pool.select("sdxl") is b
+
+    # A busy warm node loses to an idle cold one once it has more than one job ahead
+    b.in_flight = 2
+    assert pool.select("sdxl") is a
+    a.in_flight = 1
+    a.latency, c.latency = 5.0, 1.0
+    assert pool.select("lumina") is c
+
+    pool.mark_unhealthy(c)
+    assert pool.select("lumina") is a
+
+def test_pool_requires_backends():
+    with pytest.raises(ValueError):
+        ComfyUIPool([])
+
+@pytest.mark.asyncio
+async def test_dispatch_across_fake_servers():
+    servers = [FakeComfyUI(), FakeComfyUI()]
+    ports = [await server.start() for server in servers]
+    pool = ComfyUIPool([("127.0.0.1", port) for port in ports])
+    try:
+        first, images = await run_job(pool, "modelA")
+        assert len(images["SaveImageWebsocket"]) == 2
+        assert first.loaded_model == "modelA"
+        assert first.latency is not None
+
+        # Jobs for a different model go to the other, idle node; the warm node keeps its model
+        results = await asyncio.gather(run_job(pool, "modelB"), run_job(pool, "modelA"))
+        assert results[0][0] is not first
+        assert results[1][0] is first
+        assert servers[ports.index(first.port)].loaded_model == "modelA"
+    finally:
+        await pool.close()
+        for server in servers:
+            await server.stop()
+
+@pytest.mark.asyncio
+async def test_unhealthy_backend_is_evicted_and_retried():
+    servers = [FakeComfyUI(), FakeComfyUI()]
+    ports = [await server.start() for server in servers]
+    pool = ComfyUIPool([("127.0.0.1", port) for port in ports], retry_delay=0.05)
+    try:
+        await servers[1].stop()
+        await pool.check_all()
+        alive, dead = pool.backends
+        assert alive.healthy and not dead.healthy
+
+        for _ in range(3):
+            backend, _ = await run_job(pool, "modelA")
+            assert backend is alive
+
+        await servers[1].start(port=ports[1])
+        await asyncio.sleep(0.06)
+        await pool.check_all()
+        assert dead.healthy
+    finally:
+        await pool.close()
+        for server in servers:
+            await server.stop()
+
+def test_error_kind():
+    from comfyui_pool import error_kind
+    assert error_kind(Exception("[ComfyUI Execution Error] out of memory")) == "execution"
+    assert error_kind(Exception("[ComfyUI WebSocket Error] Connection closed")) == "websocket"
+    assert error_kind(ValueError("boom")) == "other"
+
+@pytest.mark.asyncio
+async def test_failures_and_unloads_are_counted():
+    from comfyui_pool import COMFYUI_ERRORS, VRAM_UNLOADS
+    server = FakeComfyUI()
+    port = await server.start()
+    pool = ComfyUIPool([("127.0.0.1", port)])
+    try:
+        errors = COMFYUI_ERRORS.value(model="modelA", kind="api")
+        with pytest.raises(Exception):
+            async with pool.acquire("modelA"):
+                raise Exception("[ComfyUI API Error] Failed to queue prompt.")
+        assert COMFYUI_ERRORS.value(model="modelA", kind="api") == errors + 1
+
+        await run_job(pool, "modelA")
+        backend = pool.backends[0]
+        unloads = VRAM_UNLOADS.value(backend=backend.name, model="modelA")
+        await pool.unload_models()
+        assert VRAM_UNLOADS.value(backend=backend.name, model="modelA") == unloads + 1
+    finally:
+        await pool.close()
+        await server.stop()
+
+@pytest.mark.asyncio
+async def test_prewarm_loads_model_and_unload_frees_it():
+    server = FakeComfyUI()
+    port = await server.start()
+    pool = ComfyUIPool([("127.0.0.1", port)])
+    backend = pool.backends[0]
+    try:
+        assert pool.reserve(backend)
+        try:
+            await pool.prewarm(backend, "modelB", make_prompt("modelB"), timeout=5)
+        finally:
+            pool.release(backend)
+        assert backend.loaded_model == "modelB" and server.loaded_model == "modelB"
+        assert backend.in_flight == 0
+
+        # The next job for the model goes to the warm node without another checkpoint load
+        loads = server.model_loads
+        await run_job(pool, "modelB")
+        assert server.model_loads == loads
+
+        await pool.unload(backend)
+        assert backend.loaded_model is None and server.loaded_model is None
+    finally:
+        await pool.close()
+        await server.stop()
+
+@pytest.mark.asyncio
+async def test_failed_unload_keeps_model():
+    from unittest.mock import AsyncMock
+    from comfyui_pool import VRAM_UNLOADS
+    pool = ComfyUIPool([("gpu", 8188)])
+    backend = pool.backends[0]
+    backend.loaded_model = "modelA"
+    backend.client.unload_models = AsyncMock(side_effect=Exception("[ComfyUI API Error] Failed to unload models"))
+    unloads = VRAM_UNLOADS.value(backend=backend.name, model="modelA")
+
+    with pytest.raises(Exception):
+        await pool.unload(backend)
+    await pool.unload_models()
+    assert backend.loaded_model == "modelA" and backend.unknown_models
+    assert VRAM_UNLOADS.value(backend=backend.name, model="modelA") == unloads
+
+    backend.client.unload_models = AsyncMock()
+    await pool.unload(backend)
+    assert backend.loaded_model is None and not backend.unknown_models
+
+@pytest.mark.asyncio
+async def test_unload_skips_backend_taken_by_a_job():
+    from unittest.mock import AsyncMock
+    pool = ComfyUIPool([("gpu", 8188)])
+    backend = pool.backends[0]
+    backend.loaded_model = "modelA"
+    backend.client.unload_models = AsyncMock()
+
+    backend.in_flight = 1
+    assert not pool.reserve(backend)
+    assert not await pool.unload(backend)
+    backend.client.unload_models.assert_not_awaited()
+    assert backend.loaded_model == "modelA"
+
+    backend.in_flight = 0
+    assert await pool.unload(backend)
+    assert backend.loaded_model is None and backend.in_flight == 0
@@ -0,0 +1,69 @@
+import json
+import os
+import tempfile
+import unittest
+from config_store import ModelConfigStore, CONFIG_RELOADS
+
+VALID_CONFIG = {
+    "modelA": {"workflow": "SDXL", "checkpointName": "a.safetensors"},
+    "DEFAULTS": {"MODEL": "modelA"}
+}
+
+class TestModelConfigStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "modelConfiguration.json")
+        self.write(VALID_CONFIG)
+        self.store = ModelConfigStore(self.path)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, data, bump=0):
+        with open(self.path, "w") as f:
+            f.write(data if isinstance(data, str) else json.dumps(data))
+        if bump:
+            stat = os.stat(self.path)
+            os.utime(self.path, ns=(stat.st_mtime_ns + bump, stat.st_mtime_ns + bump))
+
+    def test_snapshot_is_swapped_on_change(self):
+        before = self.store.snapshot()
+        self.assertFalse(self.store.check_for_changes())
+
+        self.write({**VALID_CONFIG, "modelB": {"workflow": "SDXL"}}, bump=10**9)
+        self.assertTrue(self.store.check_for_changes())
+
+        after = self.store.snapshot()
+        self.assertIn("modelB", after)
+        # Holders of the old snapshot keep a consistent view
+        self.assertNotIn("modelB", before)
+
+    def test_invalid_config_keeps_previous_snapshot(self):
+        before = self.store.snapshot()
+        failures = CONFIG_RELOADS.value(kind="models", result="failure")
+
+        self.write({"modelA": {"workflow": "does-not-exist"}}, bump=10**9)
+        self.assertFalse(self.store.check_for_changes())
+        self.assertIs(self.store.snapshot(), before)
+        self.assertEqual(CONFIG_RELOADS.value(kind="models", result="failure"), failures + 1)
+
+        # The broken version is not retried until the file changes again
+        self.assertFalse(self.store.check_for_changes())
+        self.assertEqual(CONFIG_RELOADS.value(kind="models", result="failure"), failures + 1)
+
+    def test_validate(self):
+        with self.assertRaises(ValueError):
+            ModelConfigStore.validate({"DEFAULTS": {}})
+        with self.assertRaises(ValueError):
+            ModelConfigStore.validate({"modelA": {"workflow": "SDXL"}, "DEFAULTS": {"MODEL": "missing"}})
+        with self.assertRaises(ValueError):
+            ModelConfigStore.validate({"modelA": {"checkpointName": "a.safetensors"}})
+        ModelConfigStore.validate(VALID_CONFIG)
+
+    def test_repository_config_is_valid(self):
+        config_path = os.path.join(os.path.dirname(__file__), "..", "config", "modelConfiguration.json")
+        configs = ModelConfigStore(config_path).snapshot()
+        self.assertIn("DEFAULTS", configs)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from comfyui_client import ComfyUIClient
+from comfyui_connection import ComfyUIConnection
+from fake_comfyui import FakeComfyUI
+
+def make_prompt(checkpoint="modelA"):
+    return {
+        "Checkpoint": {"inputs": {"ckpt_name": checkpoint}, "class_type": "CheckpointLoaderSimple"},
+        "KSampler": {"inputs": {}, "class_type": "KSampler"},
+        "SaveImageWebsocket": {"inputs": {}, "class_type": "SaveImageWebsocket"},
+    }
+
+@pytest.mark.asyncio
+async def test_history_and_queue_endpoints():
+    server = FakeComfyUI(execution_delay=0.2)
+    port = await server.start()
+    base = f"http://127.0.0.1:{port}"
+    try:
+        async with aiohttp.ClientSession() as session:
+            ids = []
+            for _ in range(3):
+                async with session.post(f"{base}/prompt", json={"prompt": make_prompt(), "client_id": "c"}) as response:
+                    ids.append((await response.json())["prompt_id"])
+            await asyncio.sleep(0.05)
+
+            async with session.get(f"{base}/queue") as response:
+                queue = await response.json()
+            assert [entry[1] for entry in queue["queue_running"]] == ids[:1]
+            assert [entry[1] for entry in queue["queue_pending"]] == ids[1:]
+
+            async with session.post(f"{base}/queue", json={"delete": [ids[2]]}) as response:
+                assert response.status == 200
+            while server.queue_remaining:
+                await asyncio.sleep(0.05)
+
+            async with session.get(f"{base}/history") as response:
+                history = await response.json()
+            assert list(history) == ids[:2]
+            assert history[ids[0]]["status"]["status_str"] == "success"
+            async with session.get(f"{base}/history/{ids[1]}") as response:
+                assert list(await response.json()) == [ids[1]]
+    finally:
+        await server.stop()
+
+@pytest.mark.asyncio
+async def test_model_load_penalty_and_injected_failure():
+    server = FakeComfyUI(model_load_penalty=0.1)
+    port = await server.start()
+    connection = ComfyUIConnection(ComfyUIClient("127.0.0.1", port))
+    try:
+        await connection.start()
+        for checkpoint in ("modelA", "modelA", "modelB"):
+            prompt_id = await connection.client.queue_prompt(make_prompt(checkpoint))
+            await connection.wait_for_images(prompt_id, timeout=5)
+        assert server.model_loads == 2
+
+        server.fail_next()
+        prompt_id = await connection.client.queue_prompt(make_prompt("modelB"))
+        with pytest.raises(Exception, match="Injected failure"):
+            await connection.wait_for_images(prompt_id, timeout=5)
+        assert server.failures == 1
+        assert server.history[prompt_id]["status"]["status_str"] == "error"
+    finally:
+        await connection.close()
+        await server.stop()
+
+@pytest.mark.asyncio
+async def test_timed_out_prompt_is_interrupted():
+    server = FakeComfyUI(execution_delay=5)
+    port = await server.start()
+    connection = ComfyUIConnection(ComfyUIClient("127.0.0.1", port))
+    try:
+        await connection.start()
+        prompt_id = await connection.client.queue_prompt(make_prompt())
+        with pytest.raises(Exception, match=r"\[ComfyUI Timeout Error\]"):
+            await connection.wait_for_images(prompt_id, timeout=0.2)
+        assert server.interrupts == 1
+        assert server.queue_remaining == 0
+        assert server.history[prompt_id]["status"]["status_str"] == "error"
+        await asyncio.sleep(0.05)
+        assert prompt_id not in connection._abandoned
+        assert prompt_id not in connection._prompts
+    finally:
+        await connection.close()
+        await server.stop()
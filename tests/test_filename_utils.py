@@ -1,6 +1,6 @@
 import os
 import unittest
-from filename_utils import get_domain_path
+from filename_utils import get_derivative_path, get_domain_path
 
 class TestFilenameUtils(unittest.TestCase):
     def test_get_domain_path_with_domain(self):
@@ -25,5 +25,12 @@ class TestFilenameUtils(unittest.TestCase):
         self.assertEqual(get_domain_path("", "https://fate.bot"), "")
         self.assertEqual(get_domain_path(None, "https://fate.bot"), "")
 
+    def test_get_derivative_path(self):
+        self.assertEqual(get_derivative_path("/out/12345_abc_1.webp", "thumb"), "/out/12345_abc_1_thumb.webp")
+        self.assertEqual(
+            get_derivative_path("https://fate.bot/12345_abc_1_grid.webp", "medium"),
+            "https://fate.bot/12345_abc_1_grid_medium.webp"
+        )
+
 if __name__ == "__main__":
     unittest.main()
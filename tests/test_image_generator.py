@@ -1,16 +1,39 @@
 import pytest
+import io
 import os
 import json
 import asyncio
+from types import SimpleNamespace
 from unittest.mock import patch, MagicMock, AsyncMock
+from PIL import Image
 from image_generator import ImageGenerator
+from workflow_loader import WorkflowTemplate
+
+def png(size=16, color="red"):
+    buffer = io.BytesIO()
+    Image.new("RGB", (size, size), color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+@pytest.fixture
+def comfyui():
+    """
+    A mocked ComfyUI connection and workflow loader for generators created in the test,
+    with a single model "model1" using workflow "wf1".
+    """
+    with patch("image_generator.ImageGenerator._load_model_configs") as load_configs, \
+            patch("image_generator.WorkflowLoader.load_template_by_name") as load_template, \
+            patch("comfyui_pool.ComfyUIConnection") as connection_class:
+        load_configs.return_value = {"model1": {"workflow": "wf1"}, "DEFAULTS": {"MODEL": "model1"}}
+        connection = connection_class.return_value
+        connection.start = AsyncMock()
+        yield SimpleNamespace(connection=connection, load_template=load_template)
 
 @patch("image_generator.ImageGenerator._load_model_configs")
-@patch("image_generator.WorkflowLoader.load_workflow_by_name")
-@patch("image_generator.ComfyUIClient")
-@patch("image_generator.ImageGenerator.save_image_files")
+@patch("image_generator.WorkflowLoader.load_template_by_name")
+@patch("comfyui_pool.ComfyUIConnection")
+@patch("image_pipeline.ImagePipeline._process")
 @pytest.mark.asyncio
-async def test_generate_image_success(mock_save, mock_client_class, mock_load_wf, mock_load_configs):
+async def test_generate_image_success(mock_save, mock_connection_class, mock_load_wf, mock_load_configs):
     generator = ImageGenerator(
         "localhost", 8188, "/tmp/output", "config/modelConfiguration.json"
     )
@@ -20,48 +43,190 @@ async def test_generate_image_success(mock_save, mock_client_class, mock_load_wf
     }
     # Setup mocks
     mock_load_configs.return_value = mock_configs
-    mock_load_wf.return_value = {"Checkpoint": {"inputs": {}}}
+    mock_load_wf.return_value = WorkflowTemplate({"Checkpoint": {"inputs": {}}})
     
-    mock_client = mock_client_class.return_value
-    mock_client.connect_websocket = AsyncMock()
-    mock_client.queue_prompt = AsyncMock(return_value="prompt-123")
-    mock_client.get_images_from_websocket = AsyncMock(return_value={"SaveImageWebsocket": [b"data"]})
-    mock_client.close = AsyncMock()
+    mock_connection = mock_connection_class.return_value
+    mock_connection.start = AsyncMock()
+    mock_connection.client.queue_prompt = AsyncMock(return_value="prompt-123")
+    mock_connection.wait_for_images = AsyncMock(return_value={"SaveImageWebsocket": [b"data"]})
     
-    mock_save.return_value = ["/tmp/output/img1.webp"]
+    mock_save.return_value = ("/tmp/output/img1.webp", None)
     
     result = await generator.generate_image({"model": "model1", "prompt": "test"})
     
     assert result == "/tmp/output/img1.webp"
-    mock_client.queue_prompt.assert_called_once()
+    mock_connection.client.queue_prompt.assert_called_once()
+    assert mock_connection.wait_for_images.call_args[0][0] == "prompt-123"
     mock_save.assert_called_once()
 
-@patch("os.path.exists", return_value=True)
-@patch("image_generator.Image.open")
+    # The connection is reused by later jobs
+    await generator.generate_image({"model": "model1", "prompt": "test"})
+    mock_connection_class.assert_called_once()
+
 @pytest.mark.asyncio
-async def test_save_image_files(mock_image_open, mock_exists):
+async def test_unload_models():
+    generator = ImageGenerator("localhost", 8188, "/tmp/output", "config/modelConfiguration.json")
+    backend = generator.pool.backends[0]
+    backend.loaded_model = "model1"
+    backend.connection.client.unload_models = AsyncMock()
+
+    await generator.unload_models()
+
+    backend.connection.client.unload_models.assert_called_once()
+    assert backend.loaded_model is None
+
+@pytest.mark.asyncio
+async def test_generator_dispatches_to_configured_backends():
     generator = ImageGenerator(
-        "localhost", 8188, "/tmp/output", "config/modelConfiguration.json"
+        "localhost", 8188, "/tmp/output", "config/modelConfiguration.json",
+        backends=[("gpu1", 8188), ("gpu2", 8189)]
     )
-    mock_img = MagicMock()
-    mock_image_open.return_value = mock_img
-    
-    image_data = [b"fake-data-1", b"fake-data-2"]
-    paths = await generator.save_image_files(image_data, "prompt123")
-    
-    assert len(paths) == 2
-    assert paths[0].endswith(".webp")
-    assert mock_img.save.call_count == 2
+    assert [b.name for b in generator.pool.backends] == ["gpu1:8188", "gpu2:8189"]
+
+    session = MagicMock()
+    generator.http_session = session
+    assert all(b.client.session is session for b in generator.pool.backends)
 
-@patch("image_generator.ComfyUIClient")
 @pytest.mark.asyncio
-async def test_unload_models(mock_client_class):
-    generator = ImageGenerator("localhost", 8188, "/tmp/output", "config/modelConfiguration.json")
-    mock_client = mock_client_class.return_value
-    mock_client.unload_models = AsyncMock()
-    mock_client.close = AsyncMock()
-    
-    await generator.unload_models()
-    
-    mock_client.unload_models.assert_called_once()
-    mock_client.close.assert_called_once()
+async def test_generate_image_streams_batch_into_grid(comfyui, tmp_path):
+    from timing_stats import TimingStats
+
+    timings = TimingStats()
+    generator = ImageGenerator("localhost", 8188, str(tmp_path), "config/modelConfiguration.json", timing_stats=timings)
+    comfyui.load_template.return_value = WorkflowTemplate({"EmptyLatentImage": {"inputs": {"width": 32, "height": 32, "batch_size": 1}}})
+
+    async def wait_for_images(prompt_id, timeout=None, listener=None, on_image=None):
+        for _ in range(4):
+            on_image("SaveImageWebsocket", png(32))
+        return {}
+
+    mock_connection = comfyui.connection
+    mock_connection.client.queue_prompt = AsyncMock(return_value="prompt-123")
+    mock_connection.wait_for_images = AsyncMock(side_effect=wait_for_images)
+
+    result = await generator.generate_image({"model": "model1", "prompt": "test", "count": 4})
+
+    assert result.endswith("_grid.webp")
+    with Image.open(result) as grid:
+        assert grid.size == (64, 64)
+    assert len(list(tmp_path.glob("*.webp"))) == 5
+    from image_generator import GENERATION_STAGE_SECONDS, RECEIVED_BYTES
+    for stage in ("workflow_load", "queue_prompt", "execution", "transfer", "encode", "grid"):
+        assert GENERATION_STAGE_SECONDS.count(stage=stage, model="model1") >= 1
+    assert RECEIVED_BYTES.count(model="model1") >= 1
+    # Execution, transfer and encode times are recorded for wait estimates
+    assert all(timings.histogram("model1", stage).total == 1 for stage in ("execution", "transfer", "encode"))
+    generator.pipeline.shutdown()
+
+@patch("image_generator.ImageGenerator._load_model_configs")
+@patch("image_generator.WorkflowLoader.load_template_by_name")
+@patch("image_generator.ImageGenerator._run_workflow")
+@pytest.mark.asyncio
+async def test_explicit_seed_reuses_cached_result(mock_run, mock_load_wf, mock_load_configs, tmp_path):
+    from result_cache import ResultCache
+
+    generator = ImageGenerator(
+        "localhost", 8188, str(tmp_path), "config/modelConfiguration.json", result_cache=ResultCache(1 << 20)
+    )
+    mock_load_configs.return_value = {"model1": {"workflow": "wf1"}, "DEFAULTS": {"MODEL": "model1"}}
+    mock_load_wf.side_effect = lambda name: WorkflowTemplate({"KSampler": {"inputs": {}}})
+
+    async def run(model_name, workflow, notify, on_event=None, saved_paths=None):
+        tile = tmp_path / f"{mock_run.call_count}_p_1.webp"
+        tile.write_bytes(b"tile")
+        path = tmp_path / f"{mock_run.call_count}_p_grid.webp"
+        path.write_bytes(b"image")
+        saved_paths.extend([str(tile), str(path)])
+        return [str(path)]
+    mock_run.side_effect = run
+
+    assert generator.cached_result({"model": "model1", "prompt": "cat", "seed": 42}) is None
+    first = await generator.generate_image({"model": "model1", "prompt": "cat", "seed": 42})
+    assert generator.cached_result({"model": "model1", "prompt": "cat", "seed": 42}) == first
+    second = await generator.generate_image({"model": "model1", "prompt": "cat", "seed": 42})
+    assert first == second
+    assert mock_run.call_count == 1
+    # The grid's tiles count toward the cache size
+    assert generator.result_cache.total_bytes == len(b"tile") + len(b"image")
+
+    # Random seeds and different seeds always run
+    await generator.generate_image({"model": "model1", "prompt": "cat", "seed": -1})
+    await generator.generate_image({"model": "model1", "prompt": "cat", "seed": 43})
+    assert mock_run.call_count == 3
+    generator.pipeline.shutdown()
+
+@pytest.mark.asyncio
+async def test_single_image_of_expected_grid_gets_derivatives(comfyui, tmp_path):
+    from filename_utils import get_derivative_path
+
+    generator = ImageGenerator("localhost", 8188, str(tmp_path), "config/modelConfiguration.json", derivatives={"thumb": 8})
+    comfyui.load_template.return_value = WorkflowTemplate({"EmptyLatentImage": {"inputs": {"width": 16, "height": 16, "batch_size": 1}}})
+
+    async def wait_for_images(prompt_id, timeout=None, listener=None, on_image=None):
+        on_image("SaveImageWebsocket", png())
+        return {}
+
+    comfyui.connection.client.queue_prompt = AsyncMock(return_value="prompt-7")
+    comfyui.connection.wait_for_images = AsyncMock(side_effect=wait_for_images)
+
+    result = await generator.generate_image({"model": "model1", "prompt": "test", "count": 4})
+
+    assert not result.endswith("_grid.webp")
+    assert os.path.exists(get_derivative_path(result, "thumb"))
+    generator.pipeline.shutdown()
+
+@pytest.mark.asyncio
+async def test_generate_batch_splits_images_by_request(comfyui, tmp_path):
+    generator = ImageGenerator("localhost", 8188, str(tmp_path), "config/modelConfiguration.json")
+    comfyui.load_template.return_value = WorkflowTemplate({"EmptyLatentImage": {"inputs": {"width": 16, "height": 16, "batch_size": 1}}})
+
+    async def wait_for_images(prompt_id, timeout=None, listener=None, on_image=None):
+        for _ in range(3):
+            on_image("SaveImageWebsocket", png(color="blue"))
+        return {}
+
+    mock_connection = comfyui.connection
+    mock_connection.client.queue_prompt = AsyncMock(return_value="prompt-9")
+    mock_connection.wait_for_images = AsyncMock(side_effect=wait_for_images)
+
+    results = await generator.generate_batch({"model": "model1", "prompt": "test"}, [1, 2, 1])
+
+    workflow = mock_connection.client.queue_prompt.call_args.args[0]
+    assert workflow["EmptyLatentImage"]["inputs"]["batch_size"] == 4
+    assert results[0].endswith("prompt-9_1.webp")
+    assert results[1].endswith("_grid.webp")
+    assert results[2] is None
+    generator.pipeline.shutdown()
+
+@pytest.mark.asyncio
+async def test_generate_combined_routes_images_by_branch(comfyui, tmp_path):
+    generator = ImageGenerator("localhost", 8188, str(tmp_path), "config/modelConfiguration.json")
+    comfyui.load_template.return_value = WorkflowTemplate({
+        "Positive": {"class_type": "CLIPTextEncode", "inputs": {"text": ""}},
+        "EmptyLatentImage": {"class_type": "EmptyLatentImage", "inputs": {"width": 16, "height": 16, "batch_size": 1}},
+        "SaveImageWebsocket": {"class_type": "SaveImageWebsocket", "inputs": {"images": ["Positive", 0]}},
+    })
+
+    async def wait_for_images(prompt_id, timeout=None, listener=None, on_image=None):
+        listener("executing", {"node": "SaveImageWebsocket_b1"})
+        on_image("SaveImageWebsocket_b1", png())
+        on_image("SaveImageWebsocket_b1", png())
+        on_image("SaveImageWebsocket_b0", png())
+        return {}
+
+    mock_connection = comfyui.connection
+    mock_connection.client.queue_prompt = AsyncMock(return_value="prompt-5")
+    mock_connection.wait_for_images = AsyncMock(side_effect=wait_for_images)
+    events = [[], []]
+
+    results = await generator.generate_combined(
+        [{"model": "model1", "prompt": "a cat"}, {"model": "model1", "prompt": "a dog"}],
+        [lambda t, d: events[0].append(t), lambda t, d: events[1].append(t)]
+    )
+
+    mock_connection.client.queue_prompt.assert_called_once()
+    assert results[0].endswith("prompt-5-1_1.webp")
+    assert results[1].endswith("prompt-5-2_1_grid.webp")
+    assert events[0] == ["started", "saving"]
+    assert events[1] == ["started", "executing", "saving"]
+    generator.pipeline.shutdown()
@@ -50,3 +50,34 @@ async def test_generate_image_grid_auto_path(mock_new, mock_open):
     
     assert output.endswith("img1_grid.webp")
     assert os.path.dirname(output) == "/path/to"
+
+def test_grid_builder_letterboxes_mixed_sizes():
+    from PIL import Image
+    from image_grid import GridBuilder
+
+    builder = GridBuilder(2, tile_size=(100, 100))
+    builder.add(0, Image.new("RGB", (100, 100), "red"))
+    builder.add(1, Image.new("RGB", (200, 100), "blue"))
+
+    assert builder.complete
+    assert builder.canvas.size == (200, 100)
+    # The wide tile is scaled down and centered with bars above and below
+    assert builder.canvas.getpixel((150, 10)) == (0, 0, 0)
+    assert builder.canvas.getpixel((150, 50)) == (0, 0, 255)
+    builder.close()
+    assert builder.canvas is None
+
+def test_grid_builder_writes_preview(tmp_path):
+    from PIL import Image
+    from image_grid import GridBuilder
+
+    builder = GridBuilder(4, preview_width=50)
+    for i in range(4):
+        builder.add(i, Image.new("RGB", (64, 64), "green"))
+    grid, preview = builder.save(str(tmp_path / "grid.webp"), preview_path=str(tmp_path / "grid_preview.webp"))
+
+    with Image.open(grid) as img:
+        assert img.size == (128, 128)
+    with Image.open(preview) as img:
+        assert img.size == (50, 50)
+    builder.close()
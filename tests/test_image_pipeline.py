@@ -0,0 +1,73 @@
+import io
+import pytest
+from PIL import Image
+from image_pipeline import ImageEncoder, ImagePipeline, ImageStream
+
+def png_bytes(color="red", size=(16, 16)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+async def save(pipeline, images, directory):
+    stream = ImageStream(pipeline, directory, "p1")
+    for image_bytes in images:
+        stream.add(image_bytes)
+    return await stream.finish()
+
+@pytest.mark.asyncio
+async def test_stream_encodes_webp(tmp_path):
+    pipeline = ImagePipeline()
+    paths = await save(pipeline, [png_bytes(), png_bytes("blue")], str(tmp_path))
+
+    assert len(paths) == 2
+    for path in paths:
+        assert path.endswith(".webp")
+        with Image.open(path) as img:
+            assert img.format == "WEBP"
+    pipeline.shutdown()
+
+@pytest.mark.asyncio
+async def test_png_passthrough_writes_original_bytes(tmp_path):
+    data = png_bytes()
+    pipeline = ImagePipeline(ImageEncoder("png"))
+    paths = await save(pipeline, [data], str(tmp_path))
+
+    assert paths[0].endswith(".png")
+    with open(paths[0], "rb") as f:
+        assert f.read() == data
+    pipeline.shutdown()
+
+@pytest.mark.asyncio
+async def test_undecodable_image_is_skipped(tmp_path):
+    pipeline = ImagePipeline()
+    paths = await save(pipeline, [b"not an image", png_bytes()], str(tmp_path))
+
+    assert len(paths) == 1
+    pipeline.shutdown()
+
+def test_unsupported_format():
+    with pytest.raises(ValueError):
+        ImageEncoder("gif")
+
+def test_parse_derivatives():
+    from image_pipeline import parse_derivatives
+    assert parse_derivatives("thumb:256, medium:1024") == {"thumb": 256, "medium": 1024}
+    assert parse_derivatives("") == {}
+    with pytest.raises(ValueError):
+        parse_derivatives("thumb")
+    with pytest.raises(ValueError):
+        parse_derivatives("full:512")
+
+@pytest.mark.asyncio
+async def test_single_image_gets_derivatives_from_one_decode(tmp_path):
+    pipeline = ImagePipeline(ImageEncoder("png"), derivatives={"thumb": 8, "medium": 32})
+    stream = ImageStream(pipeline, str(tmp_path), "p1")
+    stream.add(png_bytes(size=(64, 32)))
+    paths = await stream.finish()
+
+    base = paths[0][:-len(".png")]
+    with Image.open(base + "_thumb.png") as thumb:
+        assert thumb.size == (8, 4)
+    with Image.open(base + "_medium.png") as medium:
+        assert medium.size == (32, 16)
+    pipeline.shutdown()
@@ -0,0 +1,38 @@
+from job_coalescer import JobCoalescer, coalesce_key
+from job_store import Job
+
+def test_only_explicit_seeds_are_coalesced():
+    assert coalesce_key({"prompt": "cat", "seed": -1}, "sdxl") is None
+    assert coalesce_key({"prompt": "cat", "seed": 5}, "sdxl") == coalesce_key({"seed": 5, "prompt": "cat"}, "sdxl")
+    assert coalesce_key({"prompt": "cat", "seed": 5}, "sdxl") != coalesce_key({"prompt": "cat", "seed": 5}, "flux")
+
+def test_attach_and_release():
+    coalescer = JobCoalescer()
+    primary, follower, unrelated = Job("p", "a"), Job("p", "b"), Job("q", "c")
+
+    assert coalescer.attach(primary, "k") is None
+    assert coalescer.attach(follower, "k") is primary
+    assert coalescer.attach(unrelated, None) is None
+    assert coalescer.followers(primary) == [follower]
+    assert coalescer.primary_of(follower) is primary
+
+    assert coalescer.release(primary) == [follower]
+    assert coalescer.primary_of(follower) is None
+    assert len(coalescer) == 0
+    # A later identical request starts a new execution
+    assert coalescer.attach(Job("p", "d"), "k") is None
+
+def test_merged_jobs_keep_their_counts():
+    from job_coalescer import merge_key
+    assert merge_key({"prompt": "cat", "count": 2, "seed": -1}, "sdxl") == merge_key({"prompt": "cat", "count": 4, "seed": -1}, "sdxl")
+    assert merge_key({"prompt": "cat", "seed": 9}, "sdxl") is None
+
+    coalescer = JobCoalescer()
+    leader, member = Job("cat", "a"), Job("cat", "b")
+    coalescer.merge(leader, member, 2, 4)
+
+    assert coalescer.merged_group(leader) == [(leader, 2), (member, 4)]
+    assert coalescer.primary_of(member) is leader
+    assert coalescer.merged_group(Job("dog", "c")) is None
+    assert coalescer.release(leader) == [member]
+    assert coalescer.merged_group(leader) is None
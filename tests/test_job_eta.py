@@ -0,0 +1,27 @@
+import pytest
+from job_eta import EtaEstimator
+from timing_stats import TimingStats
+
+def test_expected_uses_recorded_timings():
+    stats = TimingStats()
+    eta = EtaEstimator(stats, default_seconds=10.0)
+    assert eta.expected("sdxl", 2) == 20.0
+
+    stats.record("sdxl", "execution", 8.0, images=4)
+    stats.record("sdxl", "encode", 0.4, images=4)
+    assert eta.expected("sdxl", 1) == pytest.approx(2.1)
+    # Unknown models fall back to the average over timed ones
+    assert eta.expected("flux", 2) == pytest.approx(4.2)
+    assert eta.remaining("sdxl", 1, elapsed=5.0) == 0.0
+
+def test_schedule_fills_free_workers():
+    eta = EtaEstimator(TimingStats(), workers=2, default_seconds=10.0)
+
+    estimates = eta.schedule(running=[("m", 1, 4.0)], queued=[("m", 1), ("m", 2), ("m", 1)])
+
+    # One worker is idle, the other frees up after 6s; the 20s job then keeps the first busy
+    assert estimates == [(0.0, 10.0), (6.0, 26.0), (10.0, 20.0)]
+
+def test_schedule_never_negative():
+    eta = EtaEstimator(TimingStats(), workers=1, default_seconds=5.0)
+    assert eta.schedule(running=[("m", 1, 60.0)], queued=[("m", 1)]) == [(0.0, 5.0)]
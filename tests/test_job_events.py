@@ -0,0 +1,37 @@
+import pytest
+from job_events import JobEventBroker, format_sse
+
+def test_format_sse():
+    assert format_sse("queue", {"position": 2}) == 'event: queue\ndata: {"position": 2}\n\n'
+
+@pytest.mark.asyncio
+async def test_publish_reaches_only_subscribers_of_job():
+    broker = JobEventBroker()
+    first = broker.subscribe("job1")
+    other = broker.subscribe("job2")
+
+    broker.publish("job1", "progress", {"value": 1, "max": 20})
+    assert first.get_nowait() == ("progress", {"value": 1, "max": 20})
+    assert other.empty()
+
+    broker.unsubscribe("job1", first)
+    broker.unsubscribe("job2", other)
+    assert not broker.has_subscribers()
+
+@pytest.mark.asyncio
+async def test_positions_deduplicated_and_slow_clients_drop_oldest():
+    broker = JobEventBroker(max_pending=2)
+    subscription = broker.subscribe("job")
+    broker.publish_position("job", 3)
+    broker.publish_position("job", 3)
+    broker.publish_position("job", 2)
+    broker.publish("job", "completed", {})
+
+    events = [subscription.get_nowait() for _ in range(subscription.qsize())]
+    assert events == [("queue", {"position": 2}), ("completed", {})]
+
+@pytest.mark.asyncio
+async def test_next_event_times_out_for_keepalive():
+    broker = JobEventBroker()
+    subscription = broker.subscribe("job")
+    assert await broker.next_event(subscription, 0.01) is None
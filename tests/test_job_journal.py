@@ -0,0 +1,106 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+import pytest
+from unittest.mock import patch
+from job_journal import JobJournal
+from job_store import Job
+
+@pytest.fixture
+def journal():
+    with tempfile.TemporaryDirectory() as tmp:
+        journal = JobJournal(os.path.join(tmp, "jobs.db"), retention=60)
+        journal.open()
+        yield journal
+        journal._conn and journal._conn.close()
+
+@pytest.mark.asyncio
+async def test_updates_are_batched_and_coalesced(journal):
+    job = Job("a cat -m anima", "tester")
+    journal.record(job)
+    job.status = "processing"
+    journal.record(job, prompt_id="prompt-1")
+    job.finish("completed", result="out.webp")
+    journal.record(job)
+
+    # Three updates to one job become a single row write
+    with patch.object(journal, "_write", wraps=journal._write) as mock_write:
+        await journal.flush()
+        assert len(mock_write.call_args[0][0]) == 1
+
+    row = journal.load()[0]
+    assert row["status"] == "completed"
+    assert row["prompt_id"] == "prompt-1"
+    assert row["raw_message"] == "a cat -m anima"
+    assert row["result"] == "out.webp"
+
+@pytest.mark.asyncio
+async def test_load_returns_jobs_in_creation_order(journal):
+    first, second = Job("first", "a"), Job("second", "b")
+    journal.record(first)
+    await journal.flush()
+    journal.record(second)
+    first.status = "processing"
+    journal.record(first)
+    await journal.flush()
+
+    assert [row["id"] for row in journal.load()] == [first.id, second.id]
+
+@pytest.mark.asyncio
+async def test_purge_removes_old_finished_jobs(journal):
+    queued, done = Job("queued", "a"), Job("done", "b")
+    done.finish("failed", error="boom")
+    with patch("job_journal.time.time", return_value=1000.0):
+        journal.record(queued)
+        journal.record(done)
+        await journal.flush()
+    with patch("job_journal.time.time", return_value=1100.0):
+        journal.purge()
+
+    assert [row["id"] for row in journal.load()] == [queued.id]
+
+@pytest.mark.asyncio
+async def test_close_waits_for_a_cancelled_flush(journal):
+    job = Job("queued", "a")
+    journal.record(job)
+    loop = asyncio.get_running_loop()
+    started = asyncio.Event()
+    write = journal._write
+
+    def slow_write(rows):
+        loop.call_soon_threadsafe(started.set)
+        time.sleep(0.1)
+        write(rows)
+
+    with patch.object(journal, "_write", side_effect=slow_write):
+        flush = asyncio.create_task(journal.flush())
+        await started.wait()
+        # As at shutdown: the flush is cancelled while its write is still running
+        flush.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await flush
+        await journal.close()
+
+    with sqlite3.connect(journal.path) as conn:
+        assert conn.execute("SELECT id FROM jobs").fetchall() == [(job.id,)]
+
+@pytest.mark.asyncio
+async def test_failed_write_is_retried(journal):
+    job = Job("a cat", "tester")
+    journal.record(job, prompt_id="prompt-1")
+    with patch.object(journal, "_write", side_effect=sqlite3.OperationalError("database is locked")):
+        with pytest.raises(sqlite3.OperationalError):
+            await journal.flush()
+    job.status = "processing"
+    journal.record(job)
+    await journal.flush()
+
+    row = journal.load()[0]
+    assert row["status"] == "processing"
+    assert row["prompt_id"] == "prompt-1"
+    assert row["raw_message"] == "a cat"
+
+def test_uses_wal_mode(journal):
+    assert journal._conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
@@ -0,0 +1,165 @@
+import asyncio
+import pytest
+from job_scheduler import JobScheduler, ModelAffinityScheduler, create_scheduler
+
+def _key(job):
+    return job[0]
+
+@pytest.mark.asyncio
+async def test_fifo_scheduler_preserves_order():
+    scheduler = JobScheduler(_key)
+    for job in [("a", 1), ("b", 2), ("a", 3)]:
+        await scheduler.put(job)
+
+    assert [await scheduler.get() for _ in range(3)] == [("a", 1), ("b", 2), ("a", 3)]
+    assert scheduler.empty()
+
+@pytest.mark.asyncio
+async def test_affinity_scheduler_groups_same_model():
+    scheduler = ModelAffinityScheduler(_key, starvation_limit=10)
+    jobs = [("a", 1), ("b", 2), ("a", 3), ("b", 4), ("a", 5)]
+    for job in jobs:
+        await scheduler.put(job)
+
+    assert scheduler.planned_order() == [("a", 1), ("a", 3), ("a", 5), ("b", 2), ("b", 4)]
+    assert scheduler.position(jobs[1]) == 4
+    assert scheduler.position(("c", 9)) is None
+
+@pytest.mark.asyncio
+async def test_affinity_scheduler_dispatch_matches_plan():
+    scheduler = ModelAffinityScheduler(_key, starvation_limit=10)
+    for job in [("a", 1), ("b", 2), ("a", 3), ("b", 4), ("a", 5)]:
+        await scheduler.put(job)
+
+    plan = scheduler.planned_order()
+    assert [await scheduler.get() for _ in range(5)] == plan
+
+@pytest.mark.asyncio
+async def test_affinity_scheduler_starvation_limit():
+    scheduler = ModelAffinityScheduler(_key, starvation_limit=2)
+    scheduler.current_key = "a"
+    for job in [("b", 0), ("a", 1), ("a", 2), ("a", 3), ("a", 4)]:
+        await scheduler.put(job)
+
+    # The "b" job may only be overtaken twice before it must run
+    assert [await scheduler.get() for _ in range(5)] == [("a", 1), ("a", 2), ("b", 0), ("a", 3), ("a", 4)]
+
+@pytest.mark.asyncio
+async def test_get_waits_for_put():
+    scheduler = JobScheduler()
+    getter = asyncio.create_task(scheduler.get())
+    await asyncio.sleep(0)
+    assert not getter.done()
+
+    await scheduler.put("job")
+    assert await asyncio.wait_for(getter, 1) == "job"
+    scheduler.task_done()
+    with pytest.raises(ValueError):
+        scheduler.task_done()
+
+def test_create_scheduler_unknown_name():
+    with pytest.raises(ValueError):
+        create_scheduler("random")
+    assert isinstance(create_scheduler("affinity", starvation_limit=3), ModelAffinityScheduler)
+
+@pytest.mark.asyncio
+async def test_put_many_wakes_waiting_workers():
+    scheduler = JobScheduler()
+    getters = [asyncio.create_task(scheduler.get()) for _ in range(2)]
+    await asyncio.sleep(0)
+
+    await scheduler.put_many(["a", "b", "c"])
+
+    assert sorted(await asyncio.gather(*getters)) == ["a", "b"]
+    assert scheduler.qsize() == 1
+
+@pytest.mark.asyncio
+async def test_take_matching_removes_only_matching_jobs():
+    scheduler = JobScheduler(_key)
+    scheduler.put_many_nowait([("a", 1), ("b", 2), ("a", 3), ("a", 4)])
+
+    taken = scheduler.take_matching("a", lambda job: job[1] > 1, limit=1)
+
+    assert taken == [("a", 3)]
+    assert [scheduler.get_nowait() for _ in range(3)] == [("a", 1), ("b", 2), ("a", 4)]
+
+def test_take_matching_respects_starvation_limit():
+    scheduler = ModelAffinityScheduler(_key, starvation_limit=1)
+    scheduler.put_many_nowait([("a", 1), ("b", 1), ("a", 2), ("a", 3), ("a", 4)])
+    assert scheduler.get_nowait() == ("a", 1)
+
+    # The first job taken overtakes ("b", 1), which may then not be overtaken again
+    assert scheduler.take_matching("a", lambda job: True, limit=3) == [("a", 2)]
+    assert scheduler._pending[0].bypassed == 1
+    assert scheduler.get_nowait() == ("b", 1)
+
+@pytest.mark.asyncio
+async def test_wait_for_put():
+    scheduler = JobScheduler()
+    assert await scheduler.wait_for_put(0.01) is False
+
+    waiter = asyncio.create_task(scheduler.wait_for_put(1))
+    await asyncio.sleep(0)
+    scheduler.put_nowait("job")
+    assert await waiter is True
+
+def _user(job):
+    return job[0]
+
+@pytest.mark.asyncio
+async def test_fair_scheduler_interleaves_users():
+    from job_scheduler import FairShareScheduler
+    scheduler = FairShareScheduler(user_func=_user)
+    scheduler.put_many_nowait([("flood", i) for i in range(4)])
+    scheduler.put_nowait(("other", 0))
+
+    expected = [("flood", 0), ("other", 0), ("flood", 1), ("flood", 2), ("flood", 3)]
+    assert scheduler.planned_order() == expected
+    assert [scheduler.get_nowait() for _ in range(5)] == expected
+    assert scheduler.empty()
+
+@pytest.mark.asyncio
+async def test_fair_scheduler_weights_costs_and_priorities():
+    from job_scheduler import FairSharePolicy, FairShareScheduler
+    policy = FairSharePolicy(users={"vip": {"priority": "high"}, "heavy": {"weight": 2.0}})
+    scheduler = FairShareScheduler(user_func=_user, cost_func=lambda job: job[1], policy=policy)
+    scheduler.put_many_nowait([("a", 4), ("heavy", 4), ("a", 1), ("vip", 9)])
+
+    # vip first by priority; heavy's 4 images cost as much as 2 of a's at twice the weight
+    assert scheduler.planned_order() == [("vip", 9), ("heavy", 4), ("a", 4), ("a", 1)]
+
+@pytest.mark.asyncio
+async def test_fair_scheduler_running_and_queued_limits():
+    from job_scheduler import FairSharePolicy, FairShareScheduler
+    scheduler = FairShareScheduler(user_func=_user, policy=FairSharePolicy(max_running=1, max_queued=2))
+    scheduler.put_many_nowait([("a", 1), ("a", 2)])
+    assert not scheduler.admits([("a", 3)])
+    assert scheduler.admits([("b", 1), ("b", 2)])
+
+    first = await scheduler.get()
+    assert first == ("a", 1)
+    with pytest.raises(asyncio.QueueEmpty):
+        scheduler.get_nowait()
+
+    waiter = asyncio.create_task(scheduler.get())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+    scheduler.task_done(first)
+    assert await asyncio.wait_for(waiter, 1) == ("a", 2)
+
+def test_fair_share_policy_validation(tmp_path):
+    from job_scheduler import FairSharePolicy
+    with pytest.raises(ValueError):
+        FairSharePolicy(users={"a": {"priority": "urgent"}})
+    with pytest.raises(ValueError):
+        FairSharePolicy(users={"a": {"weight": 0}})
+    with pytest.raises(ValueError):
+        FairSharePolicy(users={"a": {"speed": 1}})
+
+    path = tmp_path / "policy.json"
+    path.write_text('{"priorities": ["staff", "everyone"], "defaults": {"priority": "everyone"}, '
+                    '"users": {"op": {"priority": "staff", "max_queued": 20}}}')
+    policy = FairSharePolicy.from_file(str(path), max_queued=3)
+    assert policy.get("op", "max_queued") == 20
+    assert policy.get("someone", "max_queued") == 3
+    assert policy.priority_rank("op") < policy.priority_rank("someone")
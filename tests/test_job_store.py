@@ -0,0 +1,58 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+from job_store import Job, JobStore
+
+def finished_job(status="completed"):
+    job = Job("prompt", "nick")
+    job.finish(status, result="out.webp")
+    return job
+
+def test_active_jobs_are_never_evicted():
+    store = JobStore(ttl=0, max_finished=0)
+    job = Job("prompt", "nick")
+    store[job.id] = job
+    store.evict()
+    assert store[job.id] is job
+
+def test_finished_jobs_evicted_lru_by_size():
+    store = JobStore(max_finished=2)
+    first, second, third = finished_job(), finished_job(), finished_job()
+    store[first.id] = first
+    store[second.id] = second
+    # Looking up the first job makes the second the least recently used one
+    assert store[first.id] is first
+    store[third.id] = third
+
+    assert second.id not in store
+    assert store.is_expired(second.id)
+    assert first.id in store and third.id in store
+    assert not store.is_expired("never-existed")
+
+def test_finished_jobs_expire_after_ttl():
+    store = JobStore(ttl=60)
+    job = Job("prompt", "nick")
+    store[job.id] = job
+    with patch("job_store.time.monotonic", return_value=1000.0):
+        job.finish("failed", error="boom")
+        store.mark_finished(job)
+    with patch("job_store.time.monotonic", return_value=1030.0):
+        assert store.get(job.id) is job
+    with patch("job_store.time.monotonic", return_value=1061.0):
+        assert store.get(job.id) is None
+    assert store.is_expired(job.id)
+    assert len(store) == 0
+
+@pytest.mark.asyncio
+async def test_job_is_compact_and_wakes_waiters():
+    job = Job("prompt", "nick")
+    assert not hasattr(job, "__dict__")
+    assert job._event is None
+
+    waiter = asyncio.create_task(job.event.wait())
+    await asyncio.sleep(0)
+    job.finish("completed", result="out.webp")
+    await asyncio.wait_for(waiter, 1)
+
+    assert job.raw_message is None
+    assert job.event.is_set()
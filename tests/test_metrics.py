@@ -0,0 +1,40 @@
+import unittest
+from metrics import MetricsRegistry
+
+class TestMetrics(unittest.TestCase):
+    def test_counter_and_gauge_render(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("jobs_total", "Jobs", ["status"])
+        counter.inc(status="completed")
+        counter.inc(2, status="failed")
+        gauge = registry.gauge("queue_depth", "Queued jobs")
+        gauge.set_function(lambda: [({}, 3)])
+
+        output = registry.render()
+        self.assertIn("# TYPE jobs_total counter", output)
+        self.assertIn('jobs_total{status="completed"} 1', output)
+        self.assertIn('jobs_total{status="failed"} 2', output)
+        self.assertIn("queue_depth 3", output)
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram("stage_seconds", "Stage time", ["stage"], buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(value, stage="save")
+
+        output = registry.render()
+        self.assertIn('stage_seconds_bucket{stage="save",le="0.1"} 1', output)
+        self.assertIn('stage_seconds_bucket{stage="save",le="1"} 2', output)
+        self.assertIn('stage_seconds_bucket{stage="save",le="+Inf"} 3', output)
+        self.assertIn('stage_seconds_count{stage="save"} 3', output)
+        self.assertEqual(histogram.count(stage="save"), 3)
+
+    def test_register_returns_existing_metric(self):
+        registry = MetricsRegistry()
+        first = registry.counter("reloads_total", "Reloads")
+        self.assertIs(registry.counter("reloads_total", "Reloads"), first)
+        with self.assertRaises(ValueError):
+            registry.gauge("reloads_total", "Reloads")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -51,5 +51,39 @@ class TestPromptParser(unittest.TestCase):
         # In the current implementation, it will just overwrite.
         self.assertEqual(result['negative_prompt'], "more bad")
 
+    def test_quoted_values(self):
+        result = PromptParser.parse_input('a cat --no "blurry, -w text" --model=\'sdxl\' -c 2')
+        self.assertEqual(result['prompt'], "a cat")
+        self.assertEqual(result['negative_prompt'], "blurry, -w text")
+        self.assertEqual(result['model'], "sdxl")
+        self.assertEqual(result['count'], 2)
+        self.assertIsNone(result['width'])
+
+    def test_dashes_inside_prompt_are_text(self):
+        result = PromptParser.parse_input("it's a self-portrait -ish, mid-century style -m sdxl")
+        self.assertEqual(result['prompt'], "it's a self-portrait -ish, mid-century style")
+        self.assertEqual(result['model'], "sdxl")
+
+    def test_unknown_flag(self):
+        with self.assertRaisesRegex(ValueError, "Unknown option '--stpes'"):
+            PromptParser.parse_input("a cat --stpes 30")
+
+    def test_typed_modifiers(self):
+        result = PromptParser.parse_input(
+            "a cat --steps 28 --cfg 4.5 --sampler Euler_Ancestral --scheduler karras --denoise 0.6 --ar 16:9"
+        )
+        self.assertEqual(result['steps'], 28)
+        self.assertEqual(result['cfg'], 4.5)
+        self.assertEqual(result['sampler'], "euler_ancestral")
+        self.assertEqual(result['scheduler'], "karras")
+        self.assertEqual(result['denoise'], 0.6)
+        self.assertAlmostEqual(result['aspect_ratio'], 16 / 9, places=3)
+        self.assertEqual(PromptParser.parse_input("a cat --aspect 2x3")['aspect_ratio'], round(2 / 3, 4))
+
+    def test_out_of_range_values_are_ignored(self):
+        result = PromptParser.parse_input("a cat --steps 0 --denoise 1.5 --ar 10:1 --sampler two words")
+        for key in ('steps', 'denoise', 'aspect_ratio', 'sampler'):
+            self.assertIsNone(result[key])
+
 if __name__ == "__main__":
     unittest.main()
@@ -44,6 +44,31 @@ class TestPromptProcessor(unittest.TestCase):
         self.assertIn('a beautiful cat', workflow['PositivePrompt']['inputs']['text'])
         self.assertIn('low quality', workflow['NegativePrompt']['inputs']['text'])
 
+    def test_user_sampling_options_override_model(self):
+        prompt_wrapper = {"workflow": self.mock_workflow}
+        filtered_prompt = {'prompt': 'a cat', 'steps': 12, 'cfg': 3.5, 'sampler': 'dpmpp_2m', 'scheduler': 'karras', 'denoise': 0.7}
+
+        PromptProcessor.update_prompt_with_model_config(
+            prompt_wrapper, self.model_config, filtered_prompt, self.global_defaults
+        )
+
+        inputs = prompt_wrapper['workflow']['KSampler']['inputs']
+        self.assertEqual(inputs['steps'], 12)
+        self.assertEqual(inputs['cfg'], 3.5)
+        self.assertEqual(inputs['sampler_name'], 'dpmpp_2m')
+        self.assertEqual(inputs['scheduler'], 'karras')
+        self.assertEqual(inputs['denoise'], 0.7)
+
+    def test_aspect_ratio(self):
+        resolve = PromptProcessor.resolve_dimensions
+        # Keeps the model's pixel count
+        self.assertEqual(resolve(self.model_config, {'aspect_ratio': 16 / 9}, self.global_defaults), (1344, 768))
+        # Derives the missing side
+        self.assertEqual(resolve(self.model_config, {'aspect_ratio': 0.5, 'width': 640}, self.global_defaults), (640, 1280))
+        # Explicit sizes win
+        self.assertEqual(resolve(self.model_config, {'aspect_ratio': 2, 'width': 512, 'height': 512}, self.global_defaults), (512, 512))
+        self.assertEqual(resolve(self.model_config, {}, self.global_defaults), (1024, 1024))
+
     def test_random_seed(self):
         seed = PromptProcessor.generate_random_seed()
         self.assertTrue(1 <= seed <= 1000000)
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import os
+from result_cache import CACHE_REQUESTS, ResultCache, cache_key
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+def test_cache_key_is_canonical():
+    first = cache_key({"KSampler": {"inputs": {"seed": 1, "steps": 20}}}, {"format": "webp"})
+    second = cache_key({"KSampler": {"inputs": {"steps": 20, "seed": 1}}}, {"format": "webp"})
+    assert first == second
+    assert first != cache_key({"KSampler": {"inputs": {"seed": 2, "steps": 20}}}, {"format": "webp"})
+    assert first != cache_key({"KSampler": {"inputs": {"seed": 1, "steps": 20}}}, {"format": "png"})
+
+def test_content_address_moves_result_and_companions(tmp_path):
+    cache = ResultCache(max_bytes=1000, companions=["thumb"])
+    result = write(tmp_path / "1_p_1.webp", b"image")
+    write(tmp_path / "1_p_1_thumb.webp", b"small")
+
+    path, files = cache.content_address(result)
+    cache.put("key", path, files)
+
+    assert os.path.basename(path) != "1_p_1.webp"
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(f) for f in files)
+    assert path.replace(".webp", "_thumb.webp") in files
+    assert cache.total_bytes == 10
+
+    hits = CACHE_REQUESTS.value(result="hit")
+    assert cache.get("key") == path
+    assert CACHE_REQUESTS.value(result="hit") == hits + 1
+    assert cache.get("other") is None
+
+def test_identical_outputs_share_one_file(tmp_path):
+    cache = ResultCache(max_bytes=1000)
+    first, files = cache.content_address(write(tmp_path / "a.webp", b"same"))
+    cache.put("a", first, files)
+    second, files = cache.content_address(write(tmp_path / "b.webp", b"same"))
+    cache.put("b", second, files)
+
+    assert first == second
+    assert os.listdir(tmp_path) == [os.path.basename(first)]
+    assert cache.total_bytes == 4
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(max_bytes=10)
+    paths = []
+    for name in ("a", "b"):
+        path, files = cache.content_address(write(tmp_path / f"{name}.webp", name.encode() * 5))
+        cache.put(name, path, files)
+        paths.append(path)
+    cache.get("a")
+
+    path, files = cache.content_address(write(tmp_path / "c.webp", b"ccccc"))
+    cache.put("c", path, files)
+
+    assert cache.get("b") is None
+    assert not os.path.exists(paths[1])
+    assert cache.get("a") == paths[0]
+    assert cache.total_bytes == 10
+
+def test_missing_file_is_a_miss(tmp_path):
+    cache = ResultCache(max_bytes=100)
+    path, files = cache.content_address(write(tmp_path / "a.webp", b"data"))
+    cache.put("a", path, files)
+    os.remove(path)
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
+    assert cache.total_bytes == 0
+
+def test_tiles_count_toward_the_entry(tmp_path):
+    cache = ResultCache(max_bytes=1000)
+    tile = write(tmp_path / "1_p_1.webp", b"tile")
+    path, files = cache.content_address(write(tmp_path / "1_p_grid.webp", b"grid"), [tile])
+    cache.put("a", path, files)
+    assert tile in files
+    assert cache.total_bytes == 8
+
+    cache.put("a", *cache.content_address(write(tmp_path / "2_p_grid.webp", b"other")))
+    assert not os.path.exists(tile)
+
+def test_index_survives_restart(tmp_path):
+    index = str(tmp_path / ".result_cache.json")
+    cache = ResultCache(max_bytes=1000, index_path=index)
+    path, files = cache.content_address(write(tmp_path / "a.webp", b"kept"))
+    cache.put("a", path, files)
+    stale, files = cache.content_address(write(tmp_path / "b.webp", b"stale"))
+    cache.put("b", stale, files)
+    cache.save()
+    os.remove(stale)
+    # A content-addressed file the index does not know about, e.g. written before a crash
+    untracked = write(tmp_path / ("0" * 64 + ".webp"), b"untracked")
+
+    restarted = ResultCache(max_bytes=1000, index_path=index)
+    assert restarted.get("a") == path
+    assert restarted.get("b") is None
+    assert restarted.total_bytes == 4
+    assert not os.path.exists(untracked)
+
+def test_corrupt_index_keeps_files(tmp_path):
+    index = str(tmp_path / ".result_cache.json")
+    cache = ResultCache(max_bytes=1000, index_path=index)
+    path, files = cache.content_address(write(tmp_path / "a.webp", b"kept"))
+    cache.put("a", path, files)
+    cache.save()
+    with open(index, "w", encoding="utf-8") as f:
+        f.write('{"entries": [')
+
+    restarted = ResultCache(max_bytes=1000, index_path=index)
+    assert len(restarted) == 0
+    assert os.path.exists(path)
+    assert os.path.exists(index + ".corrupt")
+    assert not os.path.exists(index)
+
+def test_flush_saves_index(tmp_path):
+    index = str(tmp_path / ".result_cache.json")
+    cache = ResultCache(max_bytes=1000, index_path=index)
+    path, files = cache.content_address(write(tmp_path / "a.webp", b"kept"))
+    cache.put("a", path, files)
+    assert not os.path.exists(index)
+
+    asyncio.run(cache.flush())
+    with open(index, encoding="utf-8") as f:
+        assert json.load(f)["entries"] == [["a", path, files]]
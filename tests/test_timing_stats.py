@@ -0,0 +1,37 @@
+import pytest
+from timing_stats import StreamingHistogram, TimingStats
+
+def test_histogram_quantiles_within_bucket_resolution():
+    histogram = StreamingHistogram(halflife=0)
+    for value in range(1, 101):
+        histogram.observe(value / 10)
+
+    assert histogram.mean() == pytest.approx(5.05)
+    assert histogram.quantile(0.5) == pytest.approx(5.0, rel=0.1)
+    assert histogram.quantile(0.9) == pytest.approx(9.0, rel=0.1)
+    assert StreamingHistogram().quantile(0.5) is None
+
+def test_histogram_decays_old_observations():
+    histogram = StreamingHistogram(halflife=10)
+    for _ in range(10):
+        histogram.observe(100.0)
+    for _ in range(30):
+        histogram.observe(1.0)
+
+    # The early slow jobs now carry little weight
+    assert histogram.quantile(0.9) == pytest.approx(1.0, rel=0.1)
+    assert histogram.total < 40
+
+def test_timing_stats_scale_run_stages_per_image():
+    stats = TimingStats()
+    assert stats.expected_run("sdxl", 1) is None
+
+    stats.record("sdxl", "queue_wait", 30.0, images=4)
+    stats.record("sdxl", "execution", 8.0, images=4)
+    stats.record("sdxl", "transfer", 0.4, images=4)
+
+    assert stats.expected_run("sdxl", 3) == pytest.approx(6.3)
+    assert stats.histogram("sdxl", "queue_wait").mean() == 30.0
+    assert stats.summary()["sdxl"]["execution"]["count"] == 1
+    with pytest.raises(ValueError):
+        stats.record("sdxl", "upload", 1.0)
@@ -0,0 +1,74 @@
+import json
+import pytest
+from aiohttp import web
+from tracing import NOOP_SPAN, JsonlSpanExporter, OtlpHttpSpanExporter, Tracer, current_span, use_span
+
+class CollectingExporter:
+    def __init__(self):
+        self.spans = []
+
+    async def export(self, spans, resource):
+        self.spans.extend(spans)
+
+def test_unsampled_traces_are_noops():
+    assert Tracer(1.0).start_trace("job") is NOOP_SPAN  # no exporter configured
+    tracer = Tracer(0.0, exporters=[CollectingExporter()])
+    span = tracer.start_trace("job")
+    assert span is NOOP_SPAN and not span.recording
+    span.record("parse", 1, 2)
+    span.end()
+    assert tracer._pending == []
+
+@pytest.mark.asyncio
+async def test_spans_share_the_trace_and_export_as_jsonl(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    tracer = Tracer(1.0, exporters=[JsonlSpanExporter(str(path))])
+    root = tracer.start_trace("job", {"job.id": "j1"})
+
+    with use_span(root):
+        current_span().record("execution", root.start_ns, root.start_ns + 1000, {"model": "sdxl"})
+        current_span().add_event("executing", {"node": "KSampler"})
+    assert current_span() is NOOP_SPAN
+    root.set_attribute("error", "[ComfyUI Execution Error] boom")
+    root.end()
+    await tracer.flush()
+
+    spans = [json.loads(line) for line in path.read_text().splitlines()]
+    child, parent = spans
+    assert child["name"] == "execution" and child["parentSpanId"] == parent["spanId"]
+    assert child["traceId"] == parent["traceId"]
+    assert parent["events"][0]["name"] == "executing"
+    assert parent["status"]["code"] == 2
+    assert {"key": "job.id", "value": {"stringValue": "j1"}} in parent["attributes"]
+
+@pytest.mark.asyncio
+async def test_otlp_exporter_posts_resource_spans():
+    received = []
+
+    async def handle(request):
+        received.append(await request.json())
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_post("/v1/traces", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        tracer = Tracer(1.0, exporters=[OtlpHttpSpanExporter(f"http://127.0.0.1:{port}/v1/traces")])
+        tracer.start_trace("job").end()
+        await tracer.flush()
+    finally:
+        await runner.cleanup()
+
+    resource_spans = received[0]["resourceSpans"][0]
+    assert resource_spans["scopeSpans"][0]["spans"][0]["name"] == "job"
+    assert resource_spans["resource"]["attributes"][0]["key"] == "service.name"
+
+def test_pending_spans_are_bounded():
+    tracer = Tracer(1.0, exporters=[CollectingExporter()], max_pending=2)
+    for _ in range(3):
+        tracer.start_trace("job").end()
+    assert len(tracer._pending) == 2 and tracer.dropped == 1
@@ -0,0 +1,101 @@
+import time
+
+from comfyui_pool import ComfyUIPool
+from vram_policy import VRAM_DECISIONS, VramPolicy
+
+NOW = 100_000.0
+WALL = time.mktime((2026, 3, 2, 9, 30, 0, 0, 0, -1))
+
+def make_backends(*models, idle=0.0):
+    pool = ComfyUIPool([("gpu", 8188 + i) for i in range(len(models))])
+    for backend, model in zip(pool.backends, models):
+        backend.loaded_model = model
+        backend.idle_since = NOW - idle
+    return pool.backends
+
+def summary(decisions):
+    return sorted((d.backend.port - 8188, d.action, d.model, d.reason) for d in decisions)
+
+def test_probability_follows_recent_requests():
+    policy = VramPolicy(idle_timeout=600)
+    assert policy.probability("sdxl", NOW, WALL) == 0.0
+
+    policy.record_request("sdxl", NOW, WALL)
+    single = policy.probability("sdxl", NOW, WALL)
+    for i in range(10):
+        policy.record_request("sdxl", NOW + i, WALL + i)
+    busy = policy.probability("sdxl", NOW + 10, WALL + 10)
+    assert 0.0 < single < busy < 1.0
+    # Recent demand fades with the half-life
+    assert policy.probability("sdxl", NOW + 4 * 3600, WALL + 3600) < busy / 4
+
+def test_probability_remembers_time_of_day():
+    policy = VramPolicy(idle_timeout=600)
+    for day in range(5):
+        for minute in range(0, 60, 10):
+            policy.record_request("lumina", NOW + day * 86400 + minute * 60, WALL + day * 86400 + minute * 60)
+
+    # A day later the recent rate is gone, but this hour is still busy and the evening is not
+    tomorrow_now, tomorrow_wall = NOW + 5 * 86400, WALL + 5 * 86400
+    assert policy.probability("lumina", tomorrow_now, tomorrow_wall) > 0.3
+    assert policy.probability("lumina", tomorrow_now + 10 * 3600, tomorrow_wall + 10 * 3600) < 0.01
+
+def test_unload_decisions():
+    policy = VramPolicy(idle_timeout=600, min_idle=60, max_idle=3600, prewarm=False)
+    for i in range(20):
+        policy.record_request("hot", NOW - 60 * i, WALL - 60 * i)
+    policy.record_request("lukewarm", NOW - 120, WALL - 120)
+    policy.record_request("cold", NOW - 5 * 3600, WALL - 5 * 3600)
+
+    assert summary(policy.decide(make_backends("cold", "queued", idle=30), ["queued"], NOW, WALL)) == [
+        (0, "keep", "cold", "recent"), (1, "keep", "queued", "queued"),
+    ]
+    assert summary(policy.decide(make_backends("hot", "lukewarm", "cold", idle=300), [], NOW, WALL)) == [
+        (0, "keep", "hot", "forecast"), (1, "keep", "lukewarm", "idle"), (2, "unload", "cold", "unlikely"),
+    ]
+    assert summary(policy.decide(make_backends("hot", "lukewarm", idle=900), [], NOW, WALL)) == [
+        (0, "keep", "hot", "forecast"), (1, "unload", "lukewarm", "idle"),
+    ]
+    assert summary(policy.decide(make_backends("hot", idle=4000), [], NOW, WALL)) == [(0, "unload", "hot", "max_idle")]
+
+    # Models of unknown origin, e.g. loaded before a restart, go after the idle timeout
+    unknown, cleared = make_backends(None, None, idle=900)
+    cleared.unknown_models = False
+    assert summary(policy.decide([unknown, cleared], [], NOW, WALL)) == [(0, "unload", None, "unknown")]
+    assert policy.decide(make_backends(None, idle=300), [], NOW, WALL) == []
+
+    # Busy and evicted backends are left alone
+    busy, evicted = make_backends("cold", "cold", idle=900)
+    busy.in_flight = 1
+    evicted.healthy = False
+    assert policy.decide([busy, evicted], [], NOW, WALL) == []
+
+def test_prewarm_decisions():
+    policy = VramPolicy(idle_timeout=600, min_idle=60, prewarm_probability=0.9)
+    for i in range(40):
+        policy.record_request("daily", NOW - 30 * i, WALL - 30 * i)
+
+    # A queued model goes to the empty backend; a warm one is not loaded twice
+    backends = make_backends("sdxl", None, "lumina", idle=30)
+    assert summary(policy.decide(backends, ["lumina", "anima", "anima"], NOW, WALL)) == [
+        (0, "keep", "sdxl", "recent"), (1, "prewarm", "anima", "queued"), (2, "keep", "lumina", "queued"),
+    ]
+    # Without an empty backend, it replaces the least likely model no queued job needs
+    assert summary(policy.decide(make_backends("daily", "sdxl", idle=30), ["anima"], NOW, WALL)) == [
+        (0, "keep", "daily", "recent"), (1, "prewarm", "anima", "queued"),
+    ]
+    # A likely model is only loaded on an empty backend
+    assert summary(policy.decide(make_backends(None, "sdxl", idle=30), [], NOW, WALL)) == [
+        (0, "prewarm", "daily", "forecast"), (1, "keep", "sdxl", "recent"),
+    ]
+    assert summary(policy.decide(make_backends("sdxl", idle=30), [], NOW, WALL)) == [(0, "keep", "sdxl", "recent")]
+
+    policy.prewarm = False
+    assert summary(policy.decide(make_backends(None), ["anima"], NOW, WALL)) == []
+
+def test_report_counts_decisions():
+    policy = VramPolicy(prewarm=False)
+    before = VRAM_DECISIONS.value(action="unload", model="old", reason="max_idle")
+    decisions = policy.decide(make_backends("old", idle=10**5), [], NOW, WALL)
+    policy.report(decisions)
+    assert VRAM_DECISIONS.value(action="unload", model="old", reason="max_idle") == before + 1
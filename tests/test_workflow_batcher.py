@@ -0,0 +1,51 @@
+import pytest
+from workflow_batcher import branch_index, combine_workflows
+
+def make_workflow(text):
+    return {
+        "Checkpoint": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "model.safetensors"}},
+        "Negative": {"class_type": "CLIPTextEncode", "inputs": {"text": "blurry", "clip": ["Checkpoint", 1]}},
+        "Positive": {"class_type": "CLIPTextEncode", "inputs": {"text": text, "clip": ["Checkpoint", 1]}},
+        "Latent": {"class_type": "EmptyLatentImage", "inputs": {"width": 64, "height": 64, "batch_size": 1}},
+        "Sampler": {"class_type": "KSampler", "inputs": {
+            "model": ["Checkpoint", 0], "positive": ["Positive", 0], "negative": ["Negative", 0],
+            "latent_image": ["Latent", 0]
+        }},
+        "Decode": {"class_type": "VAEDecode", "inputs": {"samples": ["Sampler", 0], "vae": ["Checkpoint", 2]}},
+        "SaveImageWebsocket": {"class_type": "SaveImageWebsocket", "inputs": {"images": ["Decode", 0]}},
+    }
+
+def test_shared_nodes_appear_once():
+    combined, outputs = combine_workflows([make_workflow("a cat"), make_workflow("a dog")])
+
+    for node_id in ("Checkpoint", "Negative", "Latent"):
+        assert node_id in combined
+        assert f"{node_id}_b0" not in combined
+    assert combined["Positive_b0"]["inputs"]["text"] == "a cat"
+    assert combined["Positive_b1"]["inputs"]["text"] == "a dog"
+    # Links into a branch point at the same branch, links to shared nodes stay as they are
+    assert combined["Sampler_b1"]["inputs"]["positive"] == ["Positive_b1", 0]
+    assert combined["Sampler_b1"]["inputs"]["negative"] == ["Negative", 0]
+    assert combined["Decode_b1"]["inputs"]["samples"] == ["Sampler_b1", 0]
+    assert outputs == [{"SaveImageWebsocket_b0": "SaveImageWebsocket"}, {"SaveImageWebsocket_b1": "SaveImageWebsocket"}]
+
+def test_identical_workflows_still_get_an_output_each():
+    combined, outputs = combine_workflows([make_workflow("a cat"), make_workflow("a cat")])
+
+    assert "Sampler" in combined
+    assert combined["SaveImageWebsocket_b0"]["inputs"]["images"] == ["Decode", 0]
+    assert [list(branch) for branch in outputs] == [["SaveImageWebsocket_b0"], ["SaveImageWebsocket_b1"]]
+
+def test_different_graphs_cannot_be_combined():
+    other = make_workflow("a dog")
+    del other["Negative"]
+    with pytest.raises(ValueError):
+        combine_workflows([make_workflow("a cat"), other])
+    with pytest.raises(ValueError):
+        combine_workflows([])
+
+def test_branch_index():
+    assert branch_index("SaveImageWebsocket_b3") == 3
+    assert branch_index("SaveImageWebsocket") is None
+    assert branch_index("_b1") is None
+    assert branch_index("Sampler_bx") is None
@@ -0,0 +1,83 @@
+import json
+import os
+
+import pytest
+
+from prompt_processor import PromptProcessor
+from workflow_bindings import apply_bindings, bindings_path, compile_bindings, legacy_bindings, load_bindings
+from workflow_loader import WorkflowLoader
+
+def make_nodes():
+    return {
+        "Loader": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "a.safetensors"}},
+        "Sampler": {"class_type": "KSampler", "inputs": {"seed": 1, "steps": 20, "model": ["Loader", 0]}},
+        "Latent": {"class_type": "EmptySD3LatentImage", "inputs": {"width": 512, "height": 512, "batch_size": 1}},
+        "Text": {"class_type": "CLIPTextEncode", "inputs": {"text": ""}},
+    }
+
+def test_compile_and_apply():
+    nodes = make_nodes()
+    bindings = compile_bindings(
+        {"checkpoint": "Loader.ckpt_name", "seed": ["Sampler.seed"], "positive_prompt": "Text.text"}, nodes, "test"
+    )
+    assert bindings == (("checkpoint", "Loader", "ckpt_name"), ("seed", "Sampler", "seed"), ("positive_prompt", "Text", "text"))
+
+    apply_bindings(nodes, bindings, {"checkpoint": None, "seed": 42, "positive_prompt": "a cat"})
+    assert nodes["Loader"]["inputs"]["ckpt_name"] == "a.safetensors"
+    assert nodes["Sampler"]["inputs"]["seed"] == 42
+    assert nodes["Text"]["inputs"]["text"] == "a cat"
+
+@pytest.mark.parametrize("spec, message", [
+    ({"colour": "Text.text"}, "unknown parameter 'colour'"),
+    ({"seed": "Missing.seed"}, "missing node 'Missing'"),
+    ({"seed": "Sampler.noise_seed"}, "has no input 'noise_seed'"),
+    ({"checkpoint": "Sampler.model"}, "is linked to another node"),
+    ({"seed": "seed"}, "must map to"),
+])
+def test_invalid_bindings_are_rejected(spec, message):
+    with pytest.raises(ValueError, match=message):
+        compile_bindings(spec, make_nodes(), "test")
+
+def test_legacy_bindings_find_latent_by_class():
+    nodes = make_nodes()
+    assert {parameter: node_id for parameter, node_id, _ in legacy_bindings(nodes)} == {
+        "width": "Latent", "height": "Latent", "batch_size": "Latent"
+    }
+
+    workflow = {**nodes, "KSampler": {"class_type": "KSampler", "inputs": {"seed": 1}}}
+    PromptProcessor.update_prompt_with_model_config(
+        {"workflow": workflow}, {"imageWidth": 832, "imageHeight": 1216}, {"prompt": "x", "count": 2}, {}
+    )
+    assert workflow["Latent"]["inputs"] == {"width": 832, "height": 1216, "batch_size": 2}
+    assert workflow["KSampler"]["inputs"]["steps"] == 20
+
+def test_sidecar_file_is_loaded_and_reloaded(tmp_path):
+    path = str(tmp_path / "wf.json")
+    with open(path, "w") as f:
+        json.dump(make_nodes(), f)
+    assert bindings_path(path) == str(tmp_path / "wf.bindings.json")
+
+    with open(bindings_path(path), "w") as f:
+        json.dump({"seed": "Sampler.seed"}, f)
+    template = WorkflowLoader.load_template(path)
+    assert template.bindings == (("seed", "Sampler", "seed"),)
+    assert template.patched_nodes == ("Sampler",)
+
+    # A changed sidecar is picked up; a broken one is rejected while the last good template is kept
+    with open(bindings_path(path), "w") as f:
+        json.dump({"seed": "Sampler.seed", "width": "Latent.width", "height": "Latent.height"}, f)
+    os.utime(bindings_path(path), ns=(template.version[0] + 10**9, template.version[0] + 10**9))
+    template = WorkflowLoader.load_template(path)
+    assert len(template.bindings) == 3
+
+    with open(bindings_path(path), "w") as f:
+        json.dump({"seed": "Sampler.missing"}, f)
+    with pytest.raises(ValueError):
+        load_bindings(path, make_nodes())
+    os.utime(bindings_path(path), ns=(template.version[0] + 2 * 10**9, template.version[0] + 2 * 10**9))
+    assert WorkflowLoader.load_template(path) is template
+
+@pytest.mark.parametrize("name", ["SDXL", "netayume_lumina", "Anima-preview"])
+def test_bundled_sidecars_match_legacy_bindings(name):
+    template = WorkflowLoader.load_template_by_name(name)
+    assert sorted(template.bindings) == sorted(legacy_bindings(template.nodes))
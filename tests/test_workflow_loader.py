@@ -1,8 +1,9 @@
 import unittest
 import os
 import json
+import tempfile
 from unittest.mock import patch, mock_open
-from workflow_loader import WorkflowLoader
+from workflow_loader import WorkflowLoader, WorkflowTemplate
 
 class TestWorkflowLoader(unittest.TestCase):
     def test_load_workflow_data_success(self):
@@ -35,5 +36,39 @@ class TestWorkflowLoader(unittest.TestCase):
             call_args = mock_load.call_args[0][0]
             self.assertTrue(call_args.endswith("workflows/test.json"))
 
+    def test_template_cached_until_file_changes(self):
+        workflow = {"KSampler": {"inputs": {"seed": 1}}, "VAEDecode": {"inputs": {"samples": ["KSampler", 0]}}}
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "wf.json")
+            with open(path, "w") as f:
+                json.dump(workflow, f)
+
+            with patch("workflow_loader.WorkflowLoader.load_workflow_data", wraps=WorkflowLoader.load_workflow_data) as mock_load:
+                first = WorkflowLoader.load_template(path)
+                self.assertIs(WorkflowLoader.load_template(path), first)
+                self.assertEqual(mock_load.call_count, 1)
+
+                workflow["KSampler"]["inputs"]["seed"] = 22
+                with open(path, "w") as f:
+                    json.dump(workflow, f)
+                os.utime(path, ns=(first.version[0] + 1_000_000, first.version[0] + 1_000_000))
+
+                second = WorkflowLoader.load_template(path)
+                self.assertIsNot(second, first)
+                self.assertEqual(second.nodes["KSampler"]["inputs"]["seed"], 22)
+                self.assertEqual(mock_load.call_count, 2)
+
+    def test_instantiate_copies_only_patched_nodes(self):
+        template = WorkflowTemplate({
+            "KSampler": {"inputs": {"seed": 1}},
+            "VAEDecode": {"inputs": {"samples": ["KSampler", 0]}}
+        })
+        instance = template.instantiate()
+        instance["KSampler"]["inputs"]["seed"] = 99
+
+        self.assertEqual(template.nodes["KSampler"]["inputs"]["seed"], 1)
+        self.assertIs(instance["VAEDecode"], template.nodes["VAEDecode"])
+        self.assertEqual(template.patched_nodes, ("KSampler",))
+
 if __name__ == "__main__":
     unittest.main()
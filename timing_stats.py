@@ -0,0 +1,119 @@
+import logging
+import math
+from typing import Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Stages of a job: waiting in the queue, ComfyUI executing the prompt until the first image
+# arrives, the remaining images arriving over the WebSocket, and saving/encoding the output
+STAGES = ("queue_wait", "execution", "transfer", "encode")
+# Stages that make up a job's run time; recorded per image
+RUN_STAGES = ("execution", "transfer", "encode")
+
+class StreamingHistogram:
+    """
+    Constant-size histogram of durations with logarithmic buckets (20% apart, from 10 ms to
+    about an hour), so quantiles are accurate to a few percent whatever the scale. Counts
+    are halved every `halflife` observations, so the histogram follows recent behaviour.
+    """
+    MINIMUM = 0.01
+    GROWTH = 1.2
+    BUCKETS = 72
+
+    __slots__ = ("counts", "total", "sum", "halflife", "_since_decay")
+
+    def __init__(self, halflife: int = 200):
+        self.counts: List[float] = [0.0] * self.BUCKETS
+        self.total = 0.0
+        self.sum = 0.0
+        self.halflife = halflife
+        self._since_decay = 0
+
+    def observe(self, value: float):
+        value = max(0.0, value)
+        if value <= self.MINIMUM:
+            index = 0
+        else:
+            index = min(self.BUCKETS - 1, math.ceil(math.log(value / self.MINIMUM, self.GROWTH)))
+        self.counts[index] += 1
+        self.total += 1
+        self.sum += value
+        self._since_decay += 1
+        if self.halflife and self._since_decay >= self.halflife:
+            self._decay()
+
+    def _decay(self):
+        self.counts = [count / 2 for count in self.counts]
+        self.total /= 2
+        self.sum /= 2
+        self._since_decay = 0
+
+    def mean(self) -> Optional[float]:
+        return self.sum / self.total if self.total else None
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Approximate q-quantile (0 < q <= 1): the geometric middle of the bucket it falls in.
+        """
+        if not self.total:
+            return None
+        target = q * self.total
+        cumulative = 0.0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if count and cumulative >= target:
+                return self.MINIMUM * self.GROWTH ** index / (math.sqrt(self.GROWTH) if index else 1)
+        return self.MINIMUM * self.GROWTH ** (self.BUCKETS - 1)
+
+class TimingStats:
+    """
+    Recent job timings per model and stage. Run stages are stored per image, so jobs of
+    different sizes share one distribution and a job's expected run time scales with its count.
+    """
+    def __init__(self, halflife: int = 200):
+        self.halflife = halflife
+        self._histograms: Dict[Tuple[Optional[Hashable], str], StreamingHistogram] = {}
+
+    def record(self, model: Optional[Hashable], stage: str, seconds: float, images: int = 1):
+        if stage not in STAGES:
+            raise ValueError(f"Unknown timing stage '{stage}'. Available: {', '.join(STAGES)}")
+        if stage in RUN_STAGES:
+            seconds /= max(1, images)
+        histogram = self._histograms.get((model, stage))
+        if histogram is None:
+            histogram = self._histograms[(model, stage)] = StreamingHistogram(self.halflife)
+        histogram.observe(seconds)
+
+    def histogram(self, model: Optional[Hashable], stage: str) -> Optional[StreamingHistogram]:
+        return self._histograms.get((model, stage))
+
+    def models(self) -> List[Optional[Hashable]]:
+        return list(dict.fromkeys(model for model, _ in self._histograms))
+
+    def expected_run(self, model: Optional[Hashable], images: int) -> Optional[float]:
+        """
+        Mean run time in seconds of a job for `model` producing `images` images, or None
+        before any job for that model has been timed.
+        """
+        if self.histogram(model, "execution") is None:
+            return None
+        per_image = 0.0
+        for stage in RUN_STAGES:
+            histogram = self.histogram(model, stage)
+            mean = histogram.mean() if histogram is not None else None
+            per_image += mean or 0.0
+        return per_image * max(1, images)
+
+    def summary(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """
+        Count, mean, median and 90th percentile of every recorded stage, by model.
+        """
+        result: Dict[str, Dict[str, Dict[str, float]]] = {}
+        for (model, stage), histogram in self._histograms.items():
+            result.setdefault(str(model), {})[stage] = {
+                "count": round(histogram.total, 1),
+                "mean": histogram.mean(),
+                "p50": histogram.quantile(0.5),
+                "p90": histogram.quantile(0.9),
+            }
+        return result
@@ -0,0 +1,241 @@
+import asyncio
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import random
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Offset from time.perf_counter() to Unix time, so stage timestamps taken with perf_counter can become span times
+_PERF_OFFSET_NS = time.time_ns() - time.perf_counter_ns()
+
+def perf_to_ns(perf_seconds: float) -> int:
+    return _PERF_OFFSET_NS + int(perf_seconds * 1e9)
+
+def monotonic_to_ns(monotonic_seconds: float) -> int:
+    return time.time_ns() - int((time.monotonic() - monotonic_seconds) * 1e9)
+
+def _attribute_value(value: Any) -> Dict[str, Any]:
+    # OTLP/JSON AnyValue
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _attribute_value(value)} for key, value in attributes.items() if value is not None]
+
+class Span:
+    """
+    One timed operation of a trace, with attributes and timestamped events. Spans of a
+    sampled-out trace are NOOP_SPAN, whose methods do nothing.
+    """
+    __slots__ = ("tracer", "trace_id", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "events")
+
+    def __init__(
+        self,
+        tracer: Optional["Tracer"],
+        name: str,
+        trace_id: str,
+        parent_id: Optional[str] = None,
+        start_ns: Optional[int] = None,
+        attributes: Optional[Dict[str, Any]] = None
+    ):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = dict(attributes or {})
+        self.events: List[tuple] = []
+
+    @property
+    def recording(self) -> bool:
+        return True
+
+    def child(self, name: str, attributes: Optional[Dict[str, Any]] = None, start_ns: Optional[int] = None) -> "Span":
+        return Span(self.tracer, name, self.trace_id, self.span_id, start_ns, attributes)
+
+    def record(self, name: str, start_ns: int, end_ns: int, attributes: Optional[Dict[str, Any]] = None):
+        """
+        Adds a finished child span for a stage timed elsewhere.
+        """
+        self.child(name, attributes, start_ns).end(end_ns)
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def add_event(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        self.events.append((time.time_ns(), name, attributes or {}))
+
+    def end(self, end_ns: Optional[int] = None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns or time.time_ns()
+        self.tracer._on_end(self)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _attributes(self.attributes),
+            "events": [
+                {"timeUnixNano": str(time_ns), "name": name, "attributes": _attributes(attributes)}
+                for time_ns, name, attributes in self.events
+            ],
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.attributes.get("error"):
+            span["status"] = {"code": 2, "message": str(self.attributes["error"])}
+        return span
+
+class _NoopSpan(Span):
+    __slots__ = ()
+
+    def __init__(self):
+        super().__init__(None, "", "")
+
+    @property
+    def recording(self) -> bool:
+        return False
+
+    def child(self, name: str, attributes: Optional[Dict[str, Any]] = None, start_ns: Optional[int] = None) -> "Span":
+        return self
+
+    def record(self, name: str, start_ns: int, end_ns: int, attributes: Optional[Dict[str, Any]] = None):
+        pass
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def add_event(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        pass
+
+    def end(self, end_ns: Optional[int] = None):
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+_current_span: contextvars.ContextVar[Span] = contextvars.ContextVar("current_span", default=NOOP_SPAN)
+
+def current_span() -> Span:
+    """
+    The span of the job the calling task is working on, or NOOP_SPAN.
+    """
+    return _current_span.get()
+
+@contextlib.contextmanager
+def use_span(span: Span) -> Iterator[Span]:
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        _current_span.reset(token)
+
+class JsonlSpanExporter:
+    """
+    Appends finished spans to a file, one OTLP/JSON span per line.
+    """
+    def __init__(self, path: str):
+        self.path = path
+
+    async def export(self, spans: List[Dict[str, Any]], resource: Dict[str, Any]):
+        lines = "".join(json.dumps(span, separators=(",", ":")) + "\n" for span in spans)
+
+        def _write():
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+
+        await asyncio.to_thread(_write)
+
+class OtlpHttpSpanExporter:
+    """
+    Sends finished spans to an OpenTelemetry collector with OTLP over HTTP/JSON
+    (e.g. http://localhost:4318/v1/traces).
+    """
+    def __init__(self, endpoint: str, session=None, timeout: float = 10.0):
+        self.endpoint = endpoint
+        self.session = session
+        self.timeout = timeout
+
+    async def export(self, spans: List[Dict[str, Any]], resource: Dict[str, Any]):
+        import aiohttp
+
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": _attributes(resource)},
+            "scopeSpans": [{"scope": {"name": "fatebot.tracing"}, "spans": spans}],
+        }]}
+        session = self.session or aiohttp.ClientSession()
+        try:
+            async with session.post(self.endpoint, json=payload, timeout=aiohttp.ClientTimeout(total=self.timeout)) as response:
+                if response.status >= 400:
+                    raise Exception(f"collector answered {response.status}")
+        finally:
+            if self.session is None:
+                await session.close()
+
+class Tracer:
+    """
+    Creates job traces and batches finished spans for the exporters. Sampling is decided once
+    per trace with probability `sample_rate`; unsampled traces use NOOP_SPAN throughout, so
+    they cost one random number. Spans are exported every `flush_interval` seconds by `run()`,
+    and dropped beyond `max_pending` if the exporters fall behind.
+    """
+    def __init__(
+        self,
+        sample_rate: float = 0.0,
+        exporters: Sequence = (),
+        service_name: str = "fatebot-image-service",
+        max_pending: int = 4096
+    ):
+        self.sample_rate = sample_rate if exporters else 0.0
+        self.exporters = list(exporters)
+        self.resource = {"service.name": service_name}
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._pending: List[Span] = []
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    def start_trace(self, name: str, attributes: Optional[Dict[str, Any]] = None, start_ns: Optional[int] = None) -> Span:
+        if not self.enabled or random.random() >= self.sample_rate:
+            return NOOP_SPAN
+        return Span(self, name, os.urandom(16).hex(), start_ns=start_ns, attributes=attributes)
+
+    def _on_end(self, span: Span):
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.append(span)
+
+    async def flush(self):
+        if not self._pending:
+            return
+        spans, self._pending = self._pending, []
+        payload = [span.to_otlp() for span in spans]
+        for exporter in self.exporters:
+            try:
+                await exporter.export(payload, self.resource)
+            except Exception as e:
+                logger.warning(f"Could not export {len(payload)} span(s) with {type(exporter).__name__}: {e}")
+
+    async def run(self, flush_interval: float = 5.0):
+        while True:
+            await asyncio.sleep(flush_interval)
+            await self.flush()
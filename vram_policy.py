@@ -0,0 +1,225 @@
+import logging
+import math
+import time
+from typing import Dict, Hashable, List, Optional, Sequence
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+VRAM_DECISIONS = REGISTRY.counter(
+    "vram_policy_decisions_total", "Decisions of the VRAM policy per backend and evaluation, by action, model and reason",
+    ["action", "model", "reason"]
+)
+VRAM_FORECAST = REGISTRY.gauge(
+    "vram_policy_request_probability", "Forecast probability of a request for the model within the idle timeout", ["model"]
+)
+
+HOUR = 3600.0
+DAY = 24 * HOUR
+
+class ModelDemand:
+    """
+    Request history of one model: a recent request rate that decays with `halflife` seconds,
+    and request counts per hour of the day that decay with `daily_halflife` days.
+    """
+    __slots__ = ("recent", "updated_at", "hourly", "hourly_updated_at", "first_seen")
+
+    def __init__(self, now: float, wall: float):
+        self.recent = 0.0
+        self.updated_at = now
+        self.hourly = [0.0] * 24
+        self.hourly_updated_at = wall
+        self.first_seen = wall
+
+    def record(self, now: float, wall: float, halflife: float, daily_halflife: float):
+        self.recent = self.recent_weight(now, halflife) + 1.0
+        self.updated_at = now
+        decay = 0.5 ** (max(0.0, wall - self.hourly_updated_at) / (daily_halflife * DAY))
+        self.hourly = [count * decay for count in self.hourly]
+        self.hourly[time.localtime(wall).tm_hour] += 1.0
+        self.hourly_updated_at = wall
+
+    def recent_weight(self, now: float, halflife: float) -> float:
+        return self.recent * 0.5 ** (max(0.0, now - self.updated_at) / halflife)
+
+    def rate(self, now: float, wall: float, halflife: float, daily_halflife: float) -> float:
+        """
+        Expected requests per second: the busier of the recent rate and the usual rate at this hour of the day.
+        """
+        # A decayed count spread over the mean age of the window it covers
+        recent = self.recent_weight(now, halflife) / (halflife / math.log(2))
+        tau = daily_halflife / math.log(2)
+        days = max(1.0, tau * (1 - math.exp(-max(0.0, wall - self.first_seen) / DAY / tau)))
+        decay = 0.5 ** (max(0.0, wall - self.hourly_updated_at) / (daily_halflife * DAY))
+        usual = self.hourly[time.localtime(wall).tm_hour] * decay / (days * HOUR)
+        return max(recent, usual)
+
+class VramDecision:
+    """
+    What the policy wants done with one backend: 'keep' its model, 'unload' it, or 'prewarm' `model` on it.
+    """
+    __slots__ = ("action", "backend", "model", "reason")
+
+    def __init__(self, action: str, backend, model: Optional[Hashable], reason: str):
+        self.action = action
+        self.backend = backend
+        self.model = model
+        self.reason = reason
+
+    def __repr__(self) -> str:
+        return f"VramDecision({self.action!r}, {self.backend.name!r}, {self.model!r}, {self.reason!r})"
+
+class VramPolicy:
+    """
+    Decides which models the ComfyUI backends keep in VRAM from the queue and a forecast of requests.
+
+    A model on an idle backend is kept while a queued job needs it, for at least `min_idle` seconds
+    after its last job, and up to `max_idle` seconds while a request for it within `idle_timeout`
+    seconds is at least `keep_probability` likely; otherwise it is unloaded once the backend has
+    been idle for `idle_timeout` seconds, or already after `min_idle` when that is less than
+    `unload_probability` likely.
+    A backend whose models are unknown (`unknown_models`, e.g. after a restart) is unloaded
+    after `idle_timeout`.
+    With `prewarm`, a queued model that no backend has loaded is loaded on an idle backend before
+    its job starts, and a model forecast at `prewarm_probability` or more on an empty one.
+    """
+    def __init__(
+        self,
+        idle_timeout: float = 600.0,
+        min_idle: float = 60.0,
+        max_idle: float = 3600.0,
+        keep_probability: float = 0.5,
+        unload_probability: float = 0.1,
+        prewarm: bool = True,
+        prewarm_probability: float = 0.9,
+        halflife: float = HOUR,
+        daily_halflife: float = 7.0
+    ):
+        self.idle_timeout = idle_timeout
+        self.min_idle = min(min_idle, idle_timeout)
+        self.max_idle = max(max_idle, idle_timeout)
+        self.keep_probability = keep_probability
+        self.unload_probability = unload_probability
+        self.prewarm = prewarm
+        self.prewarm_probability = prewarm_probability
+        self.halflife = halflife
+        self.daily_halflife = daily_halflife
+        self.demand: Dict[Hashable, ModelDemand] = {}
+
+    def record_request(self, model: Optional[Hashable], now: Optional[float] = None, wall: Optional[float] = None):
+        if model is None:
+            return
+        now = time.monotonic() if now is None else now
+        wall = time.time() if wall is None else wall
+        demand = self.demand.get(model)
+        if demand is None:
+            demand = self.demand[model] = ModelDemand(now, wall)
+        demand.record(now, wall, self.halflife, self.daily_halflife)
+
+    def probability(self, model: Optional[Hashable], now: Optional[float] = None, wall: Optional[float] = None) -> float:
+        """
+        Probability of at least one request for `model` within the next `idle_timeout` seconds.
+        """
+        demand = self.demand.get(model)
+        if demand is None:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        wall = time.time() if wall is None else wall
+        rate = demand.rate(now, wall, self.halflife, self.daily_halflife)
+        return 1 - math.exp(-rate * self.idle_timeout)
+
+    def decide(
+        self, backends: Sequence, queued_models: Sequence[Optional[Hashable]],
+        now: Optional[float] = None, wall: Optional[float] = None
+    ) -> List[VramDecision]:
+        """
+        Decisions for the healthy, idle backends (`in_flight` 0), given the models of the queued
+        jobs in dispatch order. Busy and evicted backends are left alone.
+        """
+        now = time.monotonic() if now is None else now
+        wall = time.time() if wall is None else wall
+        queued = set(queued_models)
+        probabilities = {model: self.probability(model, now, wall) for model in self.demand}
+        for model, probability in probabilities.items():
+            VRAM_FORECAST.set(probability, model=str(model))
+
+        decisions: List[VramDecision] = []
+        free = []
+        for backend in backends:
+            if not backend.healthy or backend.in_flight:
+                continue
+            model = backend.loaded_model
+            idle = now - backend.idle_since
+            if model is None:
+                free.append(backend)
+                # Models left from before a restart or an outage are unloaded like an idle one
+                if backend.unknown_models and idle >= self.idle_timeout:
+                    decisions.append(VramDecision("unload", backend, None, "unknown"))
+                continue
+            probability = probabilities.get(model, 0.0)
+            if model in queued:
+                decisions.append(VramDecision("keep", backend, model, "queued"))
+            elif idle < self.min_idle:
+                decisions.append(VramDecision("keep", backend, model, "recent"))
+            elif idle >= self.max_idle:
+                decisions.append(VramDecision("unload", backend, model, "max_idle"))
+            elif probability >= self.keep_probability:
+                decisions.append(VramDecision("keep", backend, model, "forecast"))
+            elif idle >= self.idle_timeout:
+                decisions.append(VramDecision("unload", backend, model, "idle"))
+            elif probability < self.unload_probability:
+                decisions.append(VramDecision("unload", backend, model, "unlikely"))
+            else:
+                decisions.append(VramDecision("keep", backend, model, "idle"))
+
+        if not self.prewarm:
+            return decisions
+        prewarms = self._prewarm(backends, decisions, free, queued_models, probabilities)
+        # A prewarm replaces whatever was decided for its backend
+        targets = {decision.backend for decision in prewarms}
+        return [decision for decision in decisions if decision.backend not in targets] + prewarms
+
+    def _prewarm(
+        self, backends: Sequence, decisions: List[VramDecision], free: List,
+        queued_models: Sequence[Optional[Hashable]], probabilities: Dict[Hashable, float]
+    ) -> List[VramDecision]:
+        warm = {backend.loaded_model for backend in backends if backend.healthy and backend.loaded_model is not None}
+        # Backends with no known model or being unloaded anyway, then those whose model is kept
+        # without a queued job, least likely first
+        spare = free + [d.backend for d in decisions if d.action == "unload" and d.backend not in free]
+        spare += sorted(
+            (d.backend for d in decisions if d.action == "keep" and d.reason != "queued"),
+            key=lambda backend: probabilities.get(backend.loaded_model, 0.0)
+        )
+        prewarms = []
+        for model in dict.fromkeys(queued_models):
+            if model is None or model in warm or not spare:
+                continue
+            backend = spare.pop(0)
+            prewarms.append(VramDecision("prewarm", backend, model, "queued"))
+            warm.add(model)
+
+        # Forecast models only go to backends with nothing loaded
+        empty = [backend for backend in spare if backend.loaded_model is None]
+        forecast = sorted(
+            (model for model, probability in probabilities.items()
+             if probability >= self.prewarm_probability and model not in warm),
+            key=lambda model: -probabilities[model]
+        )
+        for model, backend in zip(forecast, empty):
+            prewarms.append(VramDecision("prewarm", backend, model, "forecast"))
+        return prewarms
+
+    @staticmethod
+    def report(decisions: Sequence[VramDecision]):
+        """
+        Logs the decisions and counts them in `vram_policy_decisions_total`.
+        """
+        for decision in decisions:
+            VRAM_DECISIONS.inc(action=decision.action, model=str(decision.model or ""), reason=decision.reason)
+            message = f"VRAM policy: {decision.action} {decision.model} on {decision.backend.name} ({decision.reason})"
+            if decision.action == "keep":
+                logger.debug(message)
+            else:
+                logger.info(message)
@@ -0,0 +1,79 @@
+import json
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+def _is_link(value) -> bool:
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) and isinstance(value[1], int)
+
+def _branch_id(node_id: str, index: int) -> str:
+    return f"{node_id}_b{index}"
+
+def branch_index(node_id: str) -> Optional[int]:
+    """
+    Index of the workflow a node of a combined graph belongs to, or None for a shared node.
+    """
+    base, separator, index = node_id.rpartition('_b')
+    return int(index) if separator and base and index.isdigit() else None
+
+def _varying_nodes(workflows: List[Dict], output_class: str) -> Set[str]:
+    """
+    Nodes whose inputs differ between the workflows, plus every node downstream of one.
+    Output nodes always get a copy per workflow so each one's images can be told apart.
+    """
+    first = workflows[0]
+    varying = {
+        node_id for node_id, node in first.items()
+        if node.get('class_type') == output_class
+        or any(json.dumps(w[node_id], sort_keys=True) != json.dumps(node, sort_keys=True) for w in workflows[1:])
+    }
+    changed = True
+    while changed:
+        changed = False
+        for node_id, node in first.items():
+            if node_id in varying:
+                continue
+            if any(_is_link(value) and value[0] in varying for value in node.get('inputs', {}).values()):
+                varying.add(node_id)
+                changed = True
+    return varying
+
+def combine_workflows(workflows: List[Dict], output_class: str = 'SaveImageWebsocket') -> Tuple[Dict, List[Dict[str, str]]]:
+    """
+    Merges materialized copies of the same workflow into one graph. Nodes that are identical
+    in every copy (loaders, shared conditioning) appear once; nodes that differ, and everything
+    downstream of them, are duplicated per copy as a separate branch. Returns the combined graph
+    and, per copy, a map from its output node ids in the combined graph to the original ids.
+    """
+    if not workflows:
+        raise ValueError("No workflows to combine")
+    node_ids = set(workflows[0])
+    if any(set(w) != node_ids for w in workflows[1:]):
+        raise ValueError("Only copies of the same workflow can be combined")
+
+    varying = _varying_nodes(workflows, output_class)
+    combined: Dict[str, Dict] = {}
+    for node_id, node in workflows[0].items():
+        if node_id not in varying:
+            combined[node_id] = node
+
+    outputs: List[Dict[str, str]] = []
+    for index, workflow in enumerate(workflows):
+        branch_outputs = {}
+        for node_id in workflows[0]:
+            if node_id not in varying:
+                continue
+            node = workflow[node_id]
+            inputs = {
+                name: [_branch_id(value[0], index), value[1]] if _is_link(value) and value[0] in varying else value
+                for name, value in node.get('inputs', {}).items()
+            }
+            combined[_branch_id(node_id, index)] = {**node, 'inputs': inputs}
+            if node.get('class_type') == output_class:
+                branch_outputs[_branch_id(node_id, index)] = node_id
+        outputs.append(branch_outputs)
+
+    logger.debug(f"Combined {len(workflows)} workflows: {len(combined) - len(varying) * len(workflows)} shared node(s), "
+                 f"{len(varying)} per branch")
+    return combined, outputs
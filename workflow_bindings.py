@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Logical parameters a workflow can bind, with the values PromptProcessor computes for them
+PARAMETERS = {
+    'checkpoint': "checkpoint file (checkpointName)",
+    'unet': "diffusion model file (unetName)",
+    'clip': "text encoder file (clipName)",
+    'vae': "VAE file (vae)",
+    'seed': "sampler seed",
+    'steps': "sampling steps",
+    'cfg': "guidance scale",
+    'sampler': "sampler name",
+    'scheduler': "scheduler name",
+    'denoise': "denoising strength",
+    'width': "latent width",
+    'height': "latent height",
+    'batch_size': "images per execution",
+    'prompt': "the user's prompt alone",
+    'default_prompt': "the model's defaultPositivePrompt alone",
+    'positive_prompt': "default and user prompt joined",
+    'negative_prompt': "full negative prompt",
+}
+
+# Bindings of workflows without a sidecar file, matching the node ids of the bundled workflows.
+# Nodes a workflow does not have are skipped.
+LEGACY_BINDINGS = {
+    'checkpoint': ['Checkpoint.ckpt_name'],
+    'unet': ['UNETLoader.unet_name'],
+    'clip': ['CLIPLoader.clip_name'],
+    'vae': ['VAELoader.vae_name'],
+    'seed': ['KSampler.seed'],
+    'steps': ['KSampler.steps'],
+    'cfg': ['KSampler.cfg'],
+    'sampler': ['KSampler.sampler_name'],
+    'scheduler': ['KSampler.scheduler'],
+    'denoise': ['KSampler.denoise'],
+    'default_prompt': ['PromptConcatenate.string_a'],
+    'prompt': ['PromptConcatenate.string_b'],
+    'positive_prompt': ['PositivePrompt.text'],
+    'negative_prompt': ['NegativePrompt.text'],
+}
+# Latent image nodes are found by class, whatever their id
+LATENT_CLASSES = ('EmptyLatentImage', 'EmptySD3LatentImage', 'EmptyHunyuanLatentVideo')
+
+# (parameter, node id, input name)
+Binding = Tuple[str, str, str]
+
+def bindings_path(workflow_path: str) -> str:
+    """
+    The sidecar file declaring a workflow's bindings: `workflows/SDXL.json` -> `workflows/SDXL.bindings.json`.
+    """
+    root, _ = os.path.splitext(workflow_path)
+    return f"{root}.bindings.json"
+
+def compile_bindings(spec: Dict, nodes: Dict, source: str, require_inputs: bool = True) -> Tuple[Binding, ...]:
+    """
+    Validates a binding map {parameter: "node.input" or a list of them} against the workflow's
+    nodes and returns it as a flat tuple of assignments. Raises ValueError on any mistake.
+    With `require_inputs` off, a bound input the node does not list yet is added to it.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError(f"{source}: bindings must be a JSON object")
+    bindings: List[Binding] = []
+    for parameter, targets in spec.items():
+        if parameter not in PARAMETERS:
+            raise ValueError(f"{source}: unknown parameter '{parameter}'. Available: {', '.join(PARAMETERS)}")
+        for target in [targets] if isinstance(targets, str) else targets:
+            node_id, _, input_name = target.rpartition('.') if isinstance(target, str) else ('', '', '')
+            if not node_id or not input_name:
+                raise ValueError(f"{source}: '{parameter}' must map to \"node.input\" paths, got {target!r}")
+            node = nodes.get(node_id)
+            if not isinstance(node, dict) or not isinstance(node.get('inputs'), dict):
+                raise ValueError(f"{source}: '{parameter}' refers to missing node '{node_id}'")
+            if require_inputs and input_name not in node['inputs']:
+                raise ValueError(f"{source}: node '{node_id}' has no input '{input_name}' for '{parameter}'")
+            if isinstance(node['inputs'].get(input_name), list):
+                raise ValueError(f"{source}: input '{target}' for '{parameter}' is linked to another node")
+            bindings.append((parameter, node_id, input_name))
+    return tuple(bindings)
+
+def legacy_bindings(nodes: Dict) -> Tuple[Binding, ...]:
+    """
+    Bindings for a workflow without a sidecar file: LEGACY_BINDINGS restricted to the literal
+    inputs the workflow has, plus the size and batch of its latent image node.
+    """
+    spec: Dict[str, List[str]] = {}
+    for parameter, targets in LEGACY_BINDINGS.items():
+        for target in targets:
+            node_id, _, input_name = target.rpartition('.')
+            node = nodes.get(node_id)
+            if isinstance(node, dict) and isinstance(node.get('inputs'), dict) and not isinstance(node['inputs'].get(input_name), list):
+                spec.setdefault(parameter, []).append(target)
+    # A prompt concatenation node feeds the positive prompt itself
+    if 'prompt' in spec:
+        spec.pop('positive_prompt', None)
+    latent = find_latent(nodes)
+    if latent is not None:
+        for parameter in ('width', 'height', 'batch_size'):
+            spec[parameter] = [f"{latent}.{parameter}"]
+    return compile_bindings(spec, nodes, "legacy bindings", require_inputs=False)
+
+def load_bindings(workflow_path: str, nodes: Dict) -> Tuple[Binding, ...]:
+    """
+    The validated bindings of a workflow: its sidecar file if there is one, otherwise the legacy map.
+    """
+    path = bindings_path(workflow_path)
+    if not os.path.exists(path):
+        return legacy_bindings(nodes)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            spec = json.load(f)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON format in {path}: {e}")
+    return compile_bindings(spec, nodes, os.path.basename(path))
+
+def apply_bindings(workflow: Dict, bindings: Tuple[Binding, ...], values: Dict):
+    """
+    Writes each bound parameter's value into the workflow. Parameters whose value is None keep
+    the workflow's own setting. The bound nodes must already be copies owned by this job.
+    """
+    for parameter, node_id, input_name in bindings:
+        value = values.get(parameter)
+        if value is not None:
+            workflow[node_id]['inputs'][input_name] = value
+
+def bound_nodes(bindings: Tuple[Binding, ...]) -> Tuple[str, ...]:
+    return tuple(dict.fromkeys(node_id for _, node_id, _ in bindings))
+
+def find_latent(nodes: Dict) -> Optional[str]:
+    """
+    Id of the workflow's latent image node, by class or, for nodes without one, by id.
+    """
+    return next((
+        node_id for node_id, node in nodes.items()
+        if isinstance(node, dict) and isinstance(node.get('inputs'), dict)
+        and (node.get('class_type') or node_id) in LATENT_CLASSES
+    ), None)
@@ -1,14 +1,51 @@
 import json
 import os
 import logging
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
+
+from workflow_bindings import Binding, bindings_path, bound_nodes, legacy_bindings, load_bindings
 
 logger = logging.getLogger(__name__)
 
+WORKFLOWS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "workflows")
+
+class WorkflowTemplate:
+    """
+    A parsed workflow kept in memory and shared between jobs, with its validated parameter
+    bindings (see workflow_bindings). Each job gets its own instance from `instantiate`,
+    which copies only the bound nodes and shares every other node with the template.
+    """
+    __slots__ = ("nodes", "version", "bindings", "bindings_file", "bindings_version", "patched_nodes")
+
+    def __init__(
+        self,
+        nodes: Dict,
+        version: Optional[Tuple[int, int]] = None,
+        bindings: Optional[Tuple[Binding, ...]] = None,
+        bindings_file: Optional[str] = None,
+        bindings_version: Optional[Tuple[int, int]] = None
+    ):
+        self.nodes = nodes
+        self.version = version
+        self.bindings = legacy_bindings(nodes) if bindings is None else bindings
+        self.bindings_file = bindings_file
+        self.bindings_version = bindings_version
+        self.patched_nodes = bound_nodes(self.bindings)
+
+    def instantiate(self) -> Dict:
+        workflow = dict(self.nodes)
+        for node_id in self.patched_nodes:
+            node = workflow[node_id]
+            workflow[node_id] = {**node, 'inputs': dict(node.get('inputs', {}))}
+        return workflow
+
 class WorkflowLoader:
     """
     Handles the loading of ComfyUI workflow definitions from JSON files stored on disk.
+    Parsed workflows are cached as templates and re-read when the file changes.
     """
+    _templates: Dict[str, WorkflowTemplate] = {}
+
     @staticmethod
     def load_workflow_data(workflow_path: str) -> Optional[Dict]:
         """
@@ -32,13 +69,74 @@ class WorkflowLoader:
             logger.error(f"Error loading workflow data: {e}")
             raise e
 
+    @staticmethod
+    def file_version(workflow_path: str) -> Optional[Tuple[int, int]]:
+        """
+        Returns the (mtime, size) pair used to detect changes, or None if the file cannot be read.
+        """
+        try:
+            stat = os.stat(workflow_path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    @staticmethod
+    def reload_template(workflow_path: str) -> WorkflowTemplate:
+        """
+        Parses the workflow file and its bindings and replaces its cached template. Raises if
+        either file is invalid.
+        """
+        version = WorkflowLoader.file_version(workflow_path)
+        bindings_file = bindings_path(workflow_path)
+        bindings_version = WorkflowLoader.file_version(bindings_file)
+        nodes = WorkflowLoader.load_workflow_data(workflow_path)
+        template = WorkflowTemplate(nodes, version, load_bindings(workflow_path, nodes), bindings_file, bindings_version)
+        if version is not None:
+            WorkflowLoader._templates[workflow_path] = template
+        return template
+
+    @staticmethod
+    def load_template(workflow_path: str) -> WorkflowTemplate:
+        """
+        Returns the cached template for a workflow file, parsing it again only if the
+        modification time or size of the workflow or its bindings changed since it was cached.
+        """
+        version = WorkflowLoader.file_version(workflow_path)
+        template = WorkflowLoader._templates.get(workflow_path)
+        if (
+            template is not None and version is not None and template.version == version
+            and template.bindings_version == WorkflowLoader.file_version(template.bindings_file)
+        ):
+            return template
+
+        try:
+            return WorkflowLoader.reload_template(workflow_path)
+        except Exception:
+            if template is None:
+                raise
+            # A broken edit must not take a working workflow offline; keep serving the last good version
+            logger.error(f"Failed to reload {workflow_path}; keeping the previously loaded version")
+            return template
+
+    @staticmethod
+    def template_version(workflow_path: str) -> Tuple[Optional[Tuple[int, int]], Optional[Tuple[int, int]]]:
+        """
+        Versions of a workflow file and of its bindings file, used to detect changes to either.
+        """
+        return (WorkflowLoader.file_version(workflow_path), WorkflowLoader.file_version(bindings_path(workflow_path)))
+
+    @staticmethod
+    def get_workflow_path(workflow_name: str) -> str:
+        return os.path.join(WORKFLOWS_DIR, f"{workflow_name}.json")
+
     @staticmethod
     def load_workflow_by_name(workflow_name: str) -> Optional[Dict]:
         """
-        Loads a named workflow from the 'workflows' directory.
+        Loads a named workflow from the 'workflows' directory as a fresh per-job instance.
         """
-        # Assuming we are in image-service/ and workflows are in image-service/workflows/
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        workflow_path = os.path.join(current_dir, "workflows", f"{workflow_name}.json")
-        logger.info(f"Loading workflow: {workflow_name}")
-        return WorkflowLoader.load_workflow_data(workflow_path)
+        logger.debug(f"Loading workflow: {workflow_name}")
+        return WorkflowLoader.load_template_by_name(workflow_name).instantiate()
+
+    @staticmethod
+    def load_template_by_name(workflow_name: str) -> WorkflowTemplate:
+        return WorkflowLoader.load_template(WorkflowLoader.get_workflow_path(workflow_name))